@@ -1,2 +1,5 @@
+from .csrdirectedgraph import CSRDirectedGraph
 from .directedgraph import DirectedGraph
 from .lineardirectedgraph import LinearDirectedGraph
+
+__all__ = ["CSRDirectedGraph", "DirectedGraph", "LinearDirectedGraph"]
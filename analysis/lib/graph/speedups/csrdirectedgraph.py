@@ -0,0 +1,758 @@
+from numba import njit
+import numpy as np
+
+
+@njit(cache=True)
+def _append_pair(pairs, size, root, target):
+    # double the capacity of pairs if needed
+    if size == pairs.shape[0]:
+        grown = np.empty((pairs.shape[0] * 2, 2), dtype=np.int64)
+        grown[:size] = pairs[:size]
+        pairs = grown
+
+    pairs[size, 0] = root
+    pairs[size, 1] = target
+    return pairs
+
+
+@njit(cache=True)
+def _collect(offsets, neighbors, start, visited, frontier):
+    """Collect all descendants of start in breadth-first order.
+
+    Descendants are marked in visited and stored in frontier; visited nodes are
+    not traversed again.  visited is not reset.
+
+    Parameters
+    ----------
+    offsets : ndarray(int64)
+    neighbors : ndarray(int64)
+    start : int
+        index of start node
+    visited : ndarray(bool)
+    frontier : ndarray(int64)
+        preallocated array of same length as number of nodes
+
+    Returns
+    -------
+    int
+        number of descendants stored in frontier
+    """
+    size = 0
+    for j in range(offsets[start], offsets[start + 1]):
+        node = neighbors[j]
+        if not visited[node]:
+            visited[node] = True
+            frontier[size] = node
+            size += 1
+
+    i = 0
+    while i < size:
+        node = frontier[i]
+        i += 1
+        for j in range(offsets[node], offsets[node + 1]):
+            next_node = neighbors[j]
+            if not visited[next_node]:
+                visited[next_node] = True
+                frontier[size] = next_node
+                size += 1
+
+    return size
+
+
+@njit(cache=True)
+def network_pairs(offsets, neighbors, nodes, root_ix, root_ids):
+    """Return ndarray of shape(n, 2) where each entry is [root_id, target_id]
+
+    Note: includes self: [root_id, root_id]
+
+    Parameters
+    ----------
+    offsets : ndarray(int64)
+    neighbors : ndarray(int64)
+    nodes : ndarray(int64)
+        original node ids
+    root_ix : ndarray(int64)
+        index of each root in nodes, or -1 if not in graph
+    root_ids : ndarray(int64)
+
+    Returns
+    -------
+    ndarray of shape(n, 2)
+    """
+    visited = np.zeros(len(nodes), dtype=np.bool_)
+    frontier = np.empty(len(nodes), dtype=np.int64)
+    pairs = np.empty((max(len(root_ids) * 2, 16), 2), dtype=np.int64)
+    size = 0
+
+    for i in range(len(root_ids)):
+        root = root_ids[i]
+        pairs = _append_pair(pairs, size, root, root)
+        size += 1
+
+        if root_ix[i] == -1:
+            continue
+
+        count = _collect(offsets, neighbors, root_ix[i], visited, frontier)
+        for j in range(count):
+            pairs = _append_pair(pairs, size, root, nodes[frontier[j]])
+            size += 1
+            # only reset nodes visited from this root
+            visited[frontier[j]] = False
+
+    return pairs[:size].copy()
+
+
+@njit(cache=True)
+def network_pairs_global(offsets, neighbors, nodes, root_ix, root_ids):
+    """Like network_pairs(), but each node is claimed by the first network that
+    encounters it, and roots are never claimed by other networks.
+
+    Parameters
+    ----------
+    offsets : ndarray(int64)
+    neighbors : ndarray(int64)
+    nodes : ndarray(int64)
+        original node ids
+    root_ix : ndarray(int64)
+        index of each root in nodes, or -1 if not in graph
+    root_ids : ndarray(int64)
+
+    Returns
+    -------
+    ndarray of shape(n, 2)
+    """
+    visited = np.zeros(len(nodes), dtype=np.bool_)
+    frontier = np.empty(len(nodes), dtype=np.int64)
+    pairs = np.empty((max(len(root_ids) * 2, 16), 2), dtype=np.int64)
+    size = 0
+
+    for i in range(len(root_ix)):
+        if root_ix[i] != -1:
+            visited[root_ix[i]] = True
+
+    for i in range(len(root_ids)):
+        root = root_ids[i]
+        pairs = _append_pair(pairs, size, root, root)
+        size += 1
+
+        if root_ix[i] == -1:
+            continue
+
+        count = _collect(offsets, neighbors, root_ix[i], visited, frontier)
+        for j in range(count):
+            pairs = _append_pair(pairs, size, root, nodes[frontier[j]])
+            size += 1
+
+    return pairs[:size].copy()
+
+
+@njit(cache=True)
+def label_networks(offsets, neighbors, root_ix):
+    """Label each node with the root whose network contains it, in a single
+    breadth-first sweep from all roots.  Each node is traversed at most once.
+
+    Parameters
+    ----------
+    offsets : ndarray(int64)
+    neighbors : ndarray(int64)
+    root_ix : ndarray(int64)
+        index of each root node, or -1 if not in graph
+
+    Returns
+    -------
+    (ndarray(uint32), ndarray(bool))
+        tuple of label of each node (position of root in root_ix + 1, or 0 if
+        not in any network) and True for each node where the networks of more
+        than one root meet; descendants of these nodes are not marked
+    """
+    num_nodes = len(offsets) - 1
+    labels = np.zeros(num_nodes, dtype=np.uint32)
+    conflicts = np.zeros(num_nodes, dtype=np.bool_)
+    frontier = np.empty(num_nodes, dtype=np.int64)
+
+    for i in range(len(root_ix)):
+        root = root_ix[i]
+        if root == -1:
+            continue
+
+        label = np.uint32(i + 1)
+        if labels[root] != 0:
+            conflicts[root] = True
+            continue
+
+        labels[root] = label
+        frontier[0] = root
+        size = 1
+        j = 0
+        while j < size:
+            node = frontier[j]
+            j += 1
+            for k in range(offsets[node], offsets[node + 1]):
+                next_node = neighbors[k]
+                if labels[next_node] == 0:
+                    labels[next_node] = label
+                    frontier[size] = next_node
+                    size += 1
+                elif labels[next_node] != label:
+                    conflicts[next_node] = True
+
+    return labels, conflicts
+
+
+@njit(cache=True)
+def flat_descendants(offsets, neighbors, start_ix):
+    """Return the descendants of each start node as flat arrays.
+
+    Parameters
+    ----------
+    offsets : ndarray(int64)
+    neighbors : ndarray(int64)
+    start_ix : ndarray(int64)
+        index of each start node, or -1 if not in graph
+
+    Returns
+    -------
+    (ndarray(int64), ndarray(int64))
+        tuple of offsets of descendants of each start node into values, and
+        values (node indexes)
+    """
+    num_nodes = len(offsets) - 1
+    visited = np.zeros(num_nodes, dtype=np.bool_)
+    frontier = np.empty(num_nodes, dtype=np.int64)
+    out_offsets = np.zeros(len(start_ix) + 1, dtype=np.int64)
+    values = np.empty(max(num_nodes, 16), dtype=np.int64)
+    size = 0
+
+    for i in range(len(start_ix)):
+        if start_ix[i] != -1:
+            count = _collect(offsets, neighbors, start_ix[i], visited, frontier)
+
+            if size + count > len(values):
+                grown = np.empty(max(len(values) * 2, size + count), dtype=np.int64)
+                grown[:size] = values[:size]
+                values = grown
+
+            values[size : size + count] = frontier[:count]
+            size += count
+            for j in range(count):
+                visited[frontier[j]] = False
+
+        out_offsets[i + 1] = size
+
+    return out_offsets, values[:size].copy()
+
+
+@njit(cache=True)
+def flat_components(offsets, neighbors, source_ix):
+    """Return groups of each source node not already in a group, plus all of its
+    descendants.
+
+    Parameters
+    ----------
+    offsets : ndarray(int64)
+    neighbors : ndarray(int64)
+    source_ix : ndarray(int64)
+        index of each source node, in order
+
+    Returns
+    -------
+    (ndarray(int64), ndarray(int64))
+        tuple of group indexes and values (node indexes)
+    """
+    num_nodes = len(offsets) - 1
+    seen = np.zeros(num_nodes, dtype=np.bool_)
+    visited = np.zeros(num_nodes, dtype=np.bool_)
+    frontier = np.empty(num_nodes, dtype=np.int64)
+    groups = np.empty(max(num_nodes, 16), dtype=np.int64)
+    values = np.empty(max(num_nodes, 16), dtype=np.int64)
+    size = 0
+    group = 0
+
+    for i in range(len(source_ix)):
+        node = source_ix[i]
+        if seen[node]:
+            continue
+
+        count = _collect(offsets, neighbors, node, visited, frontier)
+        # add current node unless it is its own descendant
+        if not visited[node]:
+            frontier[count] = node
+            count += 1
+
+        if size + count > len(values):
+            capacity = max(len(values) * 2, size + count)
+            grown = np.empty(capacity, dtype=np.int64)
+            grown[:size] = groups[:size]
+            groups = grown
+            grown = np.empty(capacity, dtype=np.int64)
+            grown[:size] = values[:size]
+            values = grown
+
+        for j in range(count):
+            visited[frontier[j]] = False
+            seen[frontier[j]] = True
+            groups[size] = group
+            values[size] = frontier[j]
+            size += 1
+
+        group += 1
+
+    return groups[:size].copy(), values[:size].copy()
+
+
+@njit(cache=True)
+def is_reachable(offsets, neighbors, source_ix, target_ix, max_depth):
+    """Return True for each pair of source and target node for which there
+    exists a route from source to target within max_depth.
+
+    Parameters
+    ----------
+    offsets : ndarray(int64)
+    neighbors : ndarray(int64)
+    source_ix : ndarray(int64)
+        index of each source node, or -1 if not in graph
+    target_ix : ndarray(int64)
+        index of each target node, or -1 if not in graph
+    max_depth : int
+
+    Returns
+    -------
+    ndarray(bool)
+    """
+    num_nodes = len(offsets) - 1
+    visited = np.zeros(num_nodes, dtype=np.bool_)
+    frontier = np.empty(num_nodes, dtype=np.int64)
+    out = np.zeros(len(source_ix), dtype=np.bool_)
+
+    for i in range(len(source_ix)):
+        source = source_ix[i]
+        target = target_ix[i]
+        if source == -1 or target == -1:
+            continue
+
+        # breadth-first traversal by level up to max_depth
+        size = 0
+        for j in range(offsets[source], offsets[source + 1]):
+            node = neighbors[j]
+            if not visited[node]:
+                visited[node] = True
+                frontier[size] = node
+                size += 1
+
+        level_start = 0
+        depth = 1
+        while level_start < size and depth <= max_depth + 1:
+            level_end = size
+            for k in range(level_start, level_end):
+                node = frontier[k]
+                if node == target:
+                    out[i] = True
+                    break
+
+                for j in range(offsets[node], offsets[node + 1]):
+                    next_node = neighbors[j]
+                    if not visited[next_node]:
+                        visited[next_node] = True
+                        frontier[size] = next_node
+                        size += 1
+
+            if out[i]:
+                break
+
+            level_start = level_end
+            depth += 1
+
+        for k in range(size):
+            visited[frontier[k]] = False
+
+    return out
+
+
+@njit(cache=True)
+def find_loops(offsets, neighbors, source_ix, max_depth):
+    """Find loops in the network.
+
+    Uses a depth-first search to find nodes that join to nodes already seen
+    during traversal.
+
+    Parameters
+    ----------
+    offsets : ndarray(int64)
+    neighbors : ndarray(int64)
+    source_ix : ndarray(int64)
+        index of each source node, or -1 if not in graph
+    max_depth : int
+
+    Returns
+    -------
+    ndarray(bool)
+        True for each node index that is a loop
+    """
+    num_nodes = len(offsets) - 1
+    seen = np.zeros(num_nodes, dtype=np.bool_)
+    loops = np.zeros(num_nodes, dtype=np.bool_)
+    # each node is only expanded once, so stack cannot exceed the number of edges
+    stack = np.empty(len(neighbors) + 1, dtype=np.int64)
+
+    for i in range(len(source_ix)):
+        if source_ix[i] == -1:
+            continue
+
+        depth = 0
+        stack[0] = source_ix[i]
+        size = 1
+        prev_node = source_ix[i]
+        while size:
+            depth += 1
+            if depth >= max_depth:
+                break
+
+            size -= 1
+            node = stack[size]
+            if seen[node]:
+                loops[prev_node] = True
+            else:
+                seen[node] = True
+                # push in reverse order so that neighbors are visited in order
+                for j in range(offsets[node + 1] - 1, offsets[node] - 1, -1):
+                    stack[size] = neighbors[j]
+                    size += 1
+
+            prev_node = node
+
+    return loops
+
+
+@njit(cache=True)
+def accumulate_descendants(offsets, neighbors, values):
+    """Sum values of each node and all of its distinct descendants.
+
+    If each node has at most one distinct child (e.g., networks facing
+    downstream) or at most one parent (e.g., networks facing upstream), totals
+    are accumulated in topological order, visiting each node and edge once.
+    Otherwise, or if there are cycles, the descendants of each node are
+    traversed separately.
+
+    Parameters
+    ----------
+    offsets : ndarray(int64)
+    neighbors : ndarray(int64)
+    values : ndarray of shape (num_nodes, k)
+
+    Returns
+    -------
+    ndarray of shape (num_nodes, k)
+    """
+    num_nodes = len(offsets) - 1
+
+    ### each node has at most one child: add the total of the child to each
+    # node, following the chain of children from each node until reaching a
+    # node that is already done
+    child = np.full(num_nodes, -1, dtype=np.int64)
+    single_child = True
+    for node in range(num_nodes):
+        for j in range(offsets[node], offsets[node + 1]):
+            if child[node] == -1:
+                child[node] = neighbors[j]
+            elif child[node] != neighbors[j]:
+                single_child = False
+                break
+
+        if not single_child:
+            break
+
+    if single_child:
+        totals = values.copy()
+        # 0 = pending, 1 = in progress, 2 = done
+        state = np.zeros(num_nodes, dtype=np.uint8)
+        stack = np.empty(num_nodes, dtype=np.int64)
+        acyclic = True
+        for start in range(num_nodes):
+            size = 0
+            node = start
+            while node != -1 and state[node] == 0:
+                state[node] = 1
+                stack[size] = node
+                size += 1
+                node = child[node]
+
+            if node != -1 and state[node] == 1:
+                acyclic = False
+                break
+
+            while size > 0:
+                size -= 1
+                node = stack[size]
+                if child[node] != -1:
+                    totals[node] += totals[child[node]]
+                state[node] = 2
+
+        if acyclic:
+            return totals
+
+    ### each node has at most one parent: add the total of each node to its
+    # parent, in reverse breadth-first order from nodes without parents
+    parent = np.full(num_nodes, -1, dtype=np.int64)
+    single_parent = True
+    for node in range(num_nodes):
+        for j in range(offsets[node], offsets[node + 1]):
+            next_node = neighbors[j]
+            if parent[next_node] == -1 and next_node != node:
+                parent[next_node] = node
+            elif parent[next_node] != node:
+                single_parent = False
+                break
+
+        if not single_parent:
+            break
+
+    if single_parent:
+        added = parent == -1
+        order = np.empty(num_nodes, dtype=np.int64)
+        size = 0
+        for node in range(num_nodes):
+            if added[node]:
+                order[size] = node
+                size += 1
+
+        i = 0
+        while i < size:
+            node = order[i]
+            i += 1
+            for j in range(offsets[node], offsets[node + 1]):
+                next_node = neighbors[j]
+                if not added[next_node]:
+                    added[next_node] = True
+                    order[size] = next_node
+                    size += 1
+
+        # nodes in cycles are not reachable from nodes without parents
+        if size == num_nodes:
+            totals = values.copy()
+            for i in range(num_nodes - 1, -1, -1):
+                node = order[i]
+                if parent[node] != -1:
+                    totals[parent[node]] += totals[node]
+
+            return totals
+
+    ### otherwise, traverse the descendants of each node
+    totals = values.copy()
+    visited = np.zeros(num_nodes, dtype=np.bool_)
+    frontier = np.empty(num_nodes, dtype=np.int64)
+    for node in range(num_nodes):
+        count = _collect(offsets, neighbors, node, visited, frontier)
+        for j in range(count):
+            if frontier[j] != node:
+                totals[node] += values[frontier[j]]
+            visited[frontier[j]] = False
+
+    return totals
+
+
+def remap_ids(ids):
+    """Remap ids to dense indexes into the sorted unique ids.
+
+    Parameters
+    ----------
+    ids : ndarray(int64)
+
+    Returns
+    -------
+    (ndarray(int64), ndarray(int64))
+        tuple of sorted unique ids and index of each id into those
+    """
+    if len(ids) == 0:
+        return ids, ids
+
+    min_id = ids.min()
+    max_id = ids.max()
+
+    # avoid sorting ids if they are relatively dense (e.g., lineIDs)
+    if max_id - min_id < 4 * len(ids):
+        present = np.zeros(max_id - min_id + 1, dtype="bool")
+        present[ids - min_id] = True
+        lookup = np.cumsum(present, dtype="int64") - 1
+        return np.flatnonzero(present) + min_id, lookup[ids - min_id]
+
+    unique_ids, ix = np.unique(ids, return_inverse=True)
+    return unique_ids, ix.astype("int64")
+
+
+class CSRDirectedGraph(object):
+    def __init__(self, source, target):
+        """Create a DirectedGraph stored in compressed sparse row (CSR) format
+        from source and target ndarrays.
+
+        Node ids are remapped to dense indexes, and the neighbors of each node
+        are stored in a single array, in order of node index; the neighbors of
+        node i are neighbors[offsets[i]:offsets[i + 1]].  This uses much less
+        memory than DirectedGraph and traversals do not allocate per node.
+
+        This has the same methods as DirectedGraph, and returns the same
+        results (descendants are returned in breadth-first order).
+
+        source and target must be the same length
+
+        Parameters
+        ----------
+        source : ndarray(int64)
+        target : ndarray(int64)
+        """
+        source = np.asarray(source, dtype="int64")
+        target = np.asarray(target, dtype="int64")
+
+        # sorted unique node ids; the index into this is the dense node index
+        self.nodes, ix = remap_ids(np.concatenate([source, target]))
+        source_ix = ix[: len(source)]
+        target_ix = ix[len(source) :]
+
+        order = np.argsort(source_ix, kind="stable")
+        self.neighbors = target_ix[order]
+        degree = np.bincount(source_ix, minlength=len(self.nodes))
+        self.offsets = np.zeros(len(self.nodes) + 1, dtype="int64")
+        np.cumsum(degree, out=self.offsets[1:])
+
+        # source nodes in order of first appearance; the stable sort keeps the
+        # first appearance of each source node first
+        first = np.sort(order[self.offsets[:-1][degree > 0]])
+        self._sources = source_ix[first]
+        self._size = len(self._sources)
+
+    def __len__(self):
+        return self._size
+
+    def _get_index(self, ids):
+        """Get the dense index of each node id, or -1 if not in graph."""
+        ids = np.asarray(ids, dtype="int64")
+        if len(self.nodes) == 0:
+            return np.full(len(ids), -1, dtype="int64")
+
+        ix = np.minimum(np.searchsorted(self.nodes, ids), len(self.nodes) - 1)
+        return np.where(self.nodes[ix] == ids, ix, -1).astype("int64")
+
+    def components(self):
+        groups, values = self.flat_components()
+        if len(values) == 0:
+            return []
+
+        return [set(group.tolist()) for group in np.split(values, np.flatnonzero(np.diff(groups)) + 1)]
+
+    def flat_components(self):
+        """Same as components, but returns a tuple of group indexes and values"""
+        groups, values = flat_components(self.offsets, self.neighbors, self._sources)
+        return groups, self.nodes[values]
+
+    def descendants(self, sources):
+        offsets, values = flat_descendants(self.offsets, self.neighbors, self._get_index(sources))
+        values = self.nodes[values]
+        return [set(values[offsets[i] : offsets[i + 1]].tolist()) for i in range(len(offsets) - 1)]
+
+    def is_reachable(self, sources, targets, max_depth=None):
+        if not len(sources) == len(targets):
+            raise ValueError("sources and targets must be same length")
+
+        max_depth = max_depth or len(self)
+        return is_reachable(self.offsets, self.neighbors, self._get_index(sources), self._get_index(targets), max_depth)
+
+    def find_loops(self, sources, max_depth=None):
+        if max_depth is None:
+            max_depth = len(self)
+
+        loops = find_loops(self.offsets, self.neighbors, self._get_index(sources), max_depth)
+        return set(self.nodes[loops].tolist())
+
+    def network_pairs(self, sources):
+        sources = np.asarray(sources, dtype="int64")
+        return network_pairs(self.offsets, self.neighbors, self.nodes, self._get_index(sources), sources)
+
+    def network_labels(self, sources):
+        """Assign each node in the networks of sources to the source whose
+        network contains it, in a single sweep.  Networks are expected to be
+        disjoint; nodes reachable from more than one source are assigned to the
+        first and returned as conflicts.
+
+        This is equivalent to network_pairs() for disjoint networks, without
+        creating pairs for each source.
+
+        Parameters
+        ----------
+        sources : ndarray(int64)
+            unique source node ids
+
+        Returns
+        -------
+        (ndarray(int64), ndarray(uint32), ndarray(int64))
+            tuple of node ids, position in sources of the network that
+            contains each node, and node ids that are in multiple networks;
+            sources not in graph are included as their own network
+        """
+        sources = np.asarray(sources, dtype="int64")
+        source_ix = self._get_index(sources)
+        labels, conflicts = label_networks(self.offsets, self.neighbors, source_ix)
+
+        labeled = labels > 0
+        missing = np.flatnonzero(source_ix == -1)
+
+        # conflicts are only detected where networks meet; all descendants of
+        # those nodes are also in multiple networks
+        conflicts = np.flatnonzero(conflicts)
+        if len(conflicts):
+            _, descendants = flat_descendants(self.offsets, self.neighbors, conflicts)
+            conflicts = np.union1d(conflicts, descendants)
+
+        return (
+            np.concatenate([self.nodes[labeled], sources[missing]]),
+            np.concatenate([labels[labeled] - 1, missing.astype("uint32")]),
+            self.nodes[conflicts],
+        )
+
+    def accumulate_descendants(self, sources, ids, values):
+        """Sum the values of each source and all of its distinct descendants,
+        without creating pairs of each source and its descendants.
+
+        This is equivalent to summing values over network_pairs() of unique
+        sources.
+
+        Parameters
+        ----------
+        sources : ndarray(int64)
+            source node ids
+        ids : ndarray(int64)
+            unique node ids that have values; these may include nodes not in
+            graph.  All other nodes have values of 0.
+        values : ndarray of shape (len(ids), ) or (len(ids), k)
+
+        Returns
+        -------
+        ndarray of shape (len(sources), ) or (len(sources), k)
+        """
+        sources = np.asarray(sources, dtype="int64")
+        ids = np.asarray(ids, dtype="int64")
+        values = np.asarray(values)
+        flat = values.ndim == 1
+        if flat:
+            values = values.reshape(-1, 1)
+
+        # values of sources and ids not in graph
+        sorter = np.argsort(ids)
+        ix = np.minimum(np.searchsorted(ids, sources, sorter=sorter), max(len(ids) - 1, 0))
+        found = np.zeros(len(sources), dtype="bool")
+        if len(ids):
+            found = ids[sorter[ix]] == sources
+        totals = np.zeros((len(sources), values.shape[1]), dtype=values.dtype)
+        totals[found] = values[sorter[ix[found]]]
+
+        id_ix = self._get_index(ids)
+        node_values = np.zeros((len(self.nodes), values.shape[1]), dtype=values.dtype)
+        node_values[id_ix[id_ix != -1]] = values[id_ix != -1]
+        node_totals = accumulate_descendants(self.offsets, self.neighbors, node_values)
+
+        source_ix = self._get_index(sources)
+        totals[source_ix != -1] = node_totals[source_ix[source_ix != -1]]
+
+        return totals[:, 0] if flat else totals
+
+    def network_pairs_global(self, sources):
+        sources = np.asarray(sources, dtype="int64")
+        return network_pairs_global(self.offsets, self.neighbors, self.nodes, self._get_index(sources), sources)
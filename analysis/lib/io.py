@@ -52,6 +52,25 @@ def read_feathers(paths, columns=None, geo=False, new_fields=None):
     return merged.reset_index(drop=True)
 
 
+def read_memory_mapped(path):
+    """Read a feather file into a pyarrow.Table backed by a memory map of the file.
+
+    The file must be written with compression="uncompressed"; data are then
+    read from the OS page cache on demand instead of being copied into memory
+    of this process, so that the same file can be read by multiple processes
+    without duplicating it in memory.
+
+    Parameters
+    ----------
+    path : str or Path
+
+    Returns
+    -------
+    pyarrow.Table
+    """
+    return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+
 def read_arrow_tables(paths, columns=None, filter=None, new_fields=None, dict_fields=None, allow_missing_columns=False):
     """Read multiple feather files into a single pyarrow.Table
 
@@ -0,0 +1,202 @@
+"""Identify drainage basins and fingerprint their network inputs so that only
+basins whose inputs changed since a previous run need to be recomputed.
+
+A drainage basin is a set of flowlines connected by joins, regardless of
+barriers.  All networks and statistics of a basin, including upstream and
+downstream totals, are calculated only from the flowlines, joins, and barriers
+within that basin.
+
+Line IDs of flowlines cut at barriers and barrier IDs are assigned in order
+and are not stable between runs, so basins are fingerprinted using keys that
+are: NHDPlusID plus the rank of the lineID among all lines with that NHDPlusID
+for flowlines and joins, and kind plus SARPID for barriers.
+
+Waterbodies and wetlands that intersect flowlines are included in the
+fingerprint of the basin of each flowline, because they are used to calculate
+network statistics.  Other inputs of the network analysis (e.g., marine and
+Great Lakes flowlines) are not fingerprinted; changes to them require a full
+run.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+
+from analysis.lib.graph.speedups import CSRDirectedGraph
+
+
+def get_line_basins(line_ids, joins):
+    """Assign each flowline to the drainage basin that contains it.
+
+    Parameters
+    ----------
+    line_ids : ndarray(uint32)
+    joins : pandas DataFrame
+        contains upstream_id, downstream_id
+
+    Returns
+    -------
+    pandas Series
+        basin index for each lineID, indexed on lineID
+    """
+    interior = joins.loc[(joins.upstream_id != 0) & (joins.downstream_id != 0)]
+    source = interior.downstream_id.values.astype("int64")
+    target = interior.upstream_id.values.astype("int64")
+
+    # joins in both directions so that each component includes all connected lines
+    graph = CSRDirectedGraph(np.concatenate([source, target]), np.concatenate([target, source]))
+    groups, values = graph.flat_components()
+    basins = pd.Series(groups, index=values)
+
+    # lines that are not joined to any other lines are their own basin
+    isolated = np.setdiff1d(line_ids, values)
+    start = groups.max() + 1 if len(groups) else 0
+    basins = pd.concat([basins, pd.Series(np.arange(start, start + len(isolated)), index=isolated)])
+
+    return basins.reindex(line_ids).rename("basin")
+
+
+def fingerprint_basins(flowlines, joins, barriers, barrier_joins, line_tables=None):
+    """Calculate a fingerprint of the network inputs of each drainage basin.
+
+    The fingerprint is the sum of the hashes of all flowlines, joins, barrier
+    joins, and rows of line_tables in the basin, based on stable keys instead
+    of line IDs and barrier IDs.  Any change to flowline attributes, joins,
+    the location, kind, or attributes of a barrier, or the waterbodies or
+    wetlands of a flowline changes the fingerprint of its basin.
+
+    Parameters
+    ----------
+    flowlines : pyarrow Table
+    joins : pyarrow Table
+    barriers : pyarrow Table
+    barrier_joins : pyarrow Table
+    line_tables : list of pyarrow Table, optional (default: None)
+        other inputs joined to flowlines, must have lineID (e.g., flowline
+        waterbodies and wetlands)
+
+    Returns
+    -------
+    (pandas DataFrame, pandas DataFrame)
+        tuple of lines with lineID, NHDPlusID, rank, fingerprint and barriers
+        with id, kind, SARPID, fingerprint; fingerprint is null for barriers
+        that are not joined to any flowlines
+    """
+    flowlines = flowlines.to_pandas().sort_values(by="lineID")
+    flowlines["rank"] = flowlines.groupby("NHDPlusID").cumcount().astype("uint32")
+
+    joins = joins.to_pandas()
+    barrier_joins = barrier_joins.to_pandas().join(
+        barriers.select(["id", "SARPID"]).to_pandas().set_index("id"), on="id"
+    )
+
+    basins = get_line_basins(flowlines.lineID.values, joins)
+    keys = flowlines.set_index("lineID")[["NHDPlusID", "rank"]].join(basins)
+
+    def replace_line_ids(df):
+        """Replace upstream_id and downstream_id by their keys and return the
+        basin of each row"""
+        for col in ["upstream_id", "downstream_id"]:
+            side = col.replace("_id", "")
+            df = df.join(keys.rename(columns=lambda c: f"{side}_{c}"), on=col).drop(columns=[col])
+            df[f"{side}_NHDPlusID"] = df[f"{side}_NHDPlusID"].fillna(0)
+            df[f"{side}_rank"] = df[f"{side}_rank"].fillna(0)
+
+        basin = df.upstream_basin.fillna(df.downstream_basin)
+        return df.drop(columns=["upstream_basin", "downstream_basin"]), basin
+
+    barrier_ids = barrier_joins.id.values
+    joins, join_basins = replace_line_ids(joins.drop(columns=["HUC2"], errors="ignore"))
+    barrier_joins, barrier_basins = replace_line_ids(barrier_joins.drop(columns=["id"]))
+
+    row_basins = [
+        keys.basin.loc[flowlines.lineID.values].values,
+        join_basins.values,
+        barrier_basins.values,
+    ]
+    row_hashes = [
+        pd.util.hash_pandas_object(flowlines.drop(columns=["lineID"]), index=False).values,
+        pd.util.hash_pandas_object(joins, index=False).values,
+        pd.util.hash_pandas_object(barrier_joins, index=False).values,
+    ]
+
+    for i, table in enumerate(line_tables or []):
+        df = table.to_pandas().join(keys, on="lineID").drop(columns=["lineID"])
+        row_basins.append(df.pop("basin").values)
+        # include the position of the table so that identical rows of different
+        # tables have different hashes
+        row_hashes.append(pd.util.hash_pandas_object(df.assign(table=i), index=False).values)
+
+    row_basins = np.concatenate(row_basins)
+    row_hashes = np.concatenate(row_hashes)
+
+    # joins to lines that are not present do not belong to any basin
+    ix = ~np.isnan(row_basins)
+    row_basins = row_basins[ix].astype("int64")
+    row_hashes = row_hashes[ix]
+
+    # sum hashes per basin, wrapping on overflow
+    ix = np.argsort(row_basins, kind="stable")
+    row_basins = row_basins[ix]
+    starts = np.concatenate([[0], np.flatnonzero(row_basins[1:] != row_basins[:-1]) + 1])
+    fingerprints = pd.Series(np.add.reduceat(row_hashes[ix], starts), index=row_basins[starts])
+
+    lines = keys.join(fingerprints.rename("fingerprint"), on="basin").drop(columns=["basin"]).reset_index()
+
+    barriers = barriers.select(["id", "kind", "SARPID"]).to_pandas()
+    barriers["kind"] = barriers.kind.astype("str")
+    barrier_basins = pd.Series(barrier_basins.values, index=barrier_ids).dropna()
+    barrier_basins = barrier_basins.groupby(level=0).first()
+    barriers["fingerprint"] = fingerprints.reindex(barrier_basins.reindex(barriers.id.values).values).values
+
+    return lines, barriers
+
+
+def get_id_map(previous, current, keys, id_col):
+    """Match IDs assigned in a previous run to IDs in the current run for
+    records in basins that did not change.
+
+    Parameters
+    ----------
+    previous : pyarrow Table
+        output of fingerprint_basins() for the previous run
+    current : pyarrow Table
+        output of fingerprint_basins() for the current run
+    keys : list of str
+        stable keys of each record
+    id_col : str
+
+    Returns
+    -------
+    pyarrow Table
+        contains previous, current
+    """
+    keys = keys + ["fingerprint"]
+    previous = previous.filter(pc.is_valid(previous["fingerprint"])).select(keys + [id_col])
+    current = current.filter(pc.is_valid(current["fingerprint"])).select(keys + [id_col])
+
+    matched = previous.rename_columns({id_col: "previous"}).join(
+        current.rename_columns({id_col: "current"}), keys, join_type="inner"
+    )
+
+    return matched.select(["previous", "current"]).combine_chunks()
+
+
+def update_ids(values, id_map):
+    """Replace IDs from a previous run with IDs of the current run.
+
+    Values that are not in id_map are not changed (e.g., 0 or -1 for missing
+    values).
+
+    Parameters
+    ----------
+    values : pyarrow Array or ChunkedArray
+    id_map : pyarrow Table
+        output of get_id_map()
+
+    Returns
+    -------
+    pyarrow Array or ChunkedArray
+    """
+    ix = pc.index_in(values, value_set=pc.cast(id_map["previous"], values.type))
+    return pc.if_else(pc.is_valid(ix), pc.cast(pc.take(id_map["current"], ix), values.type), values)
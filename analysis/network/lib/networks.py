@@ -11,7 +11,7 @@ import numpy as np
 
 from analysis.constants import HUC2_EXITS, NETWORK_TYPES, EPA_CAUSE_TO_CODE, BARRIER_KINDS
 
-from analysis.lib.graph.speedups import DirectedGraph, LinearDirectedGraph
+from analysis.lib.graph.speedups import CSRDirectedGraph, LinearDirectedGraph
 from analysis.lib.io import read_arrow_tables
 from analysis.network.lib.stats import (
     calculate_upstream_functional_network_stats,
@@ -150,7 +150,7 @@ def connect_huc2s(joins, huc2s):
     # NOTE: we have to convert to strings for graph to work
     upstream_huc2 = pc.cast(cross_region["upstream_HUC2"], pa.int64()).combine_chunks()
     downstream_huc2 = pc.cast(cross_region["downstream_HUC2"], pa.int64()).combine_chunks()
-    graph = DirectedGraph(
+    graph = CSRDirectedGraph(
         pa.concat_arrays([upstream_huc2, downstream_huc2]).to_numpy().astype("int64"),
         pa.concat_arrays([downstream_huc2, upstream_huc2]).to_numpy().astype("int64"),
     )
@@ -361,6 +361,46 @@ def coalesce_multiple_upstream_networks(network_segments, joins, flowlines):
     return network_segments
 
 
+def label_upstream_networks(upstream_graph, root_ids, dup_filename):
+    """Assign each lineID in the upstream networks of root_ids to the networkID
+    of the network that contains it, in a single pass over the graph.
+
+    Networks are assigned a networkID based on the lineID at their root.
+    Networks are expected to be disjoint because the graph is broken at each
+    root; if any lineIDs are reachable from multiple roots, these are written
+    to dup_filename and an error is raised.
+
+    Parameters
+    ----------
+    upstream_graph : CSRDirectedGraph
+        graph facing upstream
+    root_ids : pyarrow Array
+        unique lineIDs at the root of each network
+    dup_filename : str
+        filename where lineIDs that are found in multiple networks are written
+
+    Returns
+    -------
+    pyarrow Table
+        contains networkID, lineID, root (index of root in root_ids)
+    """
+    line_ids, labels, conflicts = upstream_graph.network_labels(root_ids.to_numpy().astype("int64"))
+
+    if len(conflicts):
+        write_feather(pa.table({"lineID": conflicts}), dup_filename)
+        raise ValueError(
+            f"{len(conflicts)} lineIDs are found in multiple networks: {', '.join([str(v) for v in conflicts[:10]])}..."
+        )
+
+    return pa.Table.from_pydict(
+        {
+            "networkID": pc.cast(root_ids, pa.uint32()).take(labels),
+            "lineID": line_ids.astype("uint32"),
+            "root": labels,
+        }
+    )
+
+
 def create_functional_upstream_networks(
     joins,
     focal_barrier_joins,
@@ -430,37 +470,27 @@ def create_functional_upstream_networks(
 
     ### Create a directed graph facing upstream and traverse joins to create
     # origin networks and barrier networks
-    upstream_graph = DirectedGraph(
+    upstream_graph = CSRDirectedGraph(
         upstream_joins["downstream_id"].to_numpy().astype("int64"),
         upstream_joins["upstream_id"].to_numpy().astype("int64"),
     )
 
-    print(f"Generating networks for {len(origin_ids):,} origin points")
-    if len(origin_ids) > 0:
-        origin_network_segments = pa.Table.from_arrays(
-            upstream_graph.network_pairs(origin_ids.to_numpy().astype("int64")).T.astype("uint32"),
-            ["networkID", "lineID"],
-        )
-        origin_network_segments = coalesce_multiple_upstream_networks(origin_network_segments, joins, flowlines)
+    print(f"Generating networks for {len(origin_ids):,} origin points and {len(barrier_upstream_ids):,} barriers")
+    network_segments = label_upstream_networks(
+        upstream_graph,
+        pa.concat_arrays([pc.cast(origin_ids, pa.uint32()), pc.cast(barrier_upstream_ids, pa.uint32())]),
+        "/tmp/dup_upstream_functional_networks.feather",
+    )
+    is_origin = pc.less(network_segments["root"], len(origin_ids))
 
-    else:
-        origin_network_segments = pa.Table.from_arrays(
-            [[], []], schema=pa.schema([("networkID", pa.uint32()), ("lineID", pa.uint32())])
-        )
+    origin_network_segments = network_segments.filter(is_origin).select(["networkID", "lineID"])
+    if len(origin_network_segments):
+        origin_network_segments = coalesce_multiple_upstream_networks(origin_network_segments, joins, flowlines)
 
-    print(f"Generating networks for {len(barrier_upstream_ids):,} barriers")
-    if len(barrier_upstream_ids):
-        barrier_network_segments = pa.Table.from_arrays(
-            upstream_graph.network_pairs(barrier_upstream_ids.to_numpy().astype("int64")).T.astype("uint32"),
-            ["networkID", "lineID"],
-        )
+    barrier_network_segments = network_segments.filter(pc.invert(is_origin)).select(["networkID", "lineID"])
+    if len(barrier_network_segments):
         barrier_network_segments = coalesce_multiple_upstream_networks(barrier_network_segments, joins, flowlines)
 
-    else:
-        barrier_network_segments = pa.Table.from_arrays(
-            [[], []], schema=pa.schema([("networkID", pa.uint32()), ("lineID", pa.uint32())])
-        )
-
     # use categorical type to store network type
     network_type_values = pa.array(["origin", "barrier"])
     origin_network_segments = origin_network_segments.append_column(
@@ -476,20 +506,6 @@ def create_functional_upstream_networks(
         [origin_network_segments, barrier_network_segments]
     ).combine_chunks()
 
-    # check for duplicates
-    dups = (
-        upstream_functional_network_segments.group_by("lineID")
-        .aggregate([("lineID", "count_distinct")])
-        .rename_columns({"lineID_count_distinct": "count"})
-        .filter(pc.field("count") > 1)
-        .combine_chunks()
-    )
-    if len(dups):
-        write_feather(dups, "/tmp/dup_upstream_functional_networks.feather")
-        raise ValueError(
-            f"{len(dups)} lineIDs are found in multiple networks: {', '.join([str(v) for v in dups['lineID'][:10].to_pylist()])}..."
-        )
-
     print(
         f"{len(pc.unique(upstream_functional_network_segments['networkID'])):,} upstream functional networks created in {time() - start:.2f}s"
     )
@@ -555,35 +571,20 @@ def create_upstream_mainstem_networks(joins, focal_barrier_joins, upstream_joins
         )
 
         # create graph of mainstem joins facing in the upstream direction
-        upstream_mainstem_graph = DirectedGraph(
+        upstream_mainstem_graph = CSRDirectedGraph(
             upstream_mainstem_joins["downstream_id"].to_numpy().astype("int64"),
             upstream_mainstem_joins["upstream_id"].to_numpy().astype("int64"),
         )
 
-        upstream_mainstem_network_segments = pa.Table.from_arrays(
-            upstream_mainstem_graph.network_pairs(mainstem_barrier_upstream_ids.to_numpy().astype("int64")).T.astype(
-                "uint32"
-            ),
-            ["networkID", "lineID"],
-        )
+        upstream_mainstem_network_segments = label_upstream_networks(
+            upstream_mainstem_graph,
+            pc.unique(mainstem_barrier_upstream_ids),
+            "/tmp/dup_upstream_mainstem_networks.feather",
+        ).select(["networkID", "lineID"])
         upstream_mainstem_network_segments = coalesce_multiple_upstream_networks(
             upstream_mainstem_network_segments, joins, mainstem_flowlines
         )
 
-        # check for duplicates
-        dups = (
-            upstream_mainstem_network_segments.group_by("lineID")
-            .aggregate([("lineID", "count_distinct")])
-            .rename_columns({"lineID_count_distinct": "count"})
-            .filter(pc.field("count") > 1)
-            .combine_chunks()
-        )
-        if len(dups):
-            write_feather(dups, "/tmp/dup_upstream_mainstem_networks.feather")
-            raise ValueError(
-                f"{len(dups)} lineIDs are found in multiple networks: {', '.join([str(v) for v in dups['lineID'][:10].to_pylist()])}..."
-            )
-
         del upstream_mainstem_graph
 
     else:
@@ -5,7 +5,7 @@ import pyarrow.compute as pc
 import numpy as np
 
 from analysis.constants import METERS_TO_MILES, KM2_TO_ACRES, EPA_CAUSE_TO_CODE, BARRIER_KINDS
-from analysis.lib.graph.speedups import DirectedGraph
+from analysis.lib.graph.speedups import CSRDirectedGraph
 from analysis.lib.io import read_arrow_tables
 
 data_dir = Path("data")
@@ -456,23 +456,26 @@ def calculate_total_upstream_functional_stats(network, focal_barrier_joins, fn_u
     )
 
     # construct graph facing upstream
-    upstream_graph = DirectedGraph(
+    upstream_graph = CSRDirectedGraph(
         network_joins["networkID"].to_numpy().astype("int64"),  # downstream side of join
         network_joins["upstream_id"].to_numpy().astype("int64"),  # upstream side of join
     )
 
-    # TODO: this is a performance hotspot (for road crossings)
-    upstreams = pa.Table.from_arrays(
-        upstream_graph.network_pairs(pc.unique(network["networkID"]).to_numpy().astype("int64")).T.astype("uint32"),
-        ["networkID", "upstream_network"],
-    )
-
+    # sum counts of each network and all networks upstream of it in a single
+    # pass over the graph, instead of joining counts to pairs of each network
+    # and all of its upstream networks
+    network_ids = pc.unique(network["networkID"]).to_numpy().astype("int64")
     count_cols = [c for c in fn_upstream_counts.column_names if c.startswith("fn_")]
-    counts = (
-        upstreams.join(fn_upstream_counts, "upstream_network", "networkID")
-        .group_by("networkID")
-        .aggregate([(col, "sum") for col in count_cols])
-        .rename_columns({f"{col}_sum": col.replace("fn_", "totu_") for col in count_cols})
+    totals = upstream_graph.accumulate_descendants(
+        network_ids,
+        fn_upstream_counts["networkID"].to_numpy().astype("int64"),
+        np.stack([pc.fill_null(fn_upstream_counts[col], 0).to_numpy().astype("int64") for col in count_cols], axis=1),
+    )
+    counts = pa.Table.from_pydict(
+        {
+            "networkID": pa.array(network_ids.astype("uint32")),
+            **{col.replace("fn_", "totu_"): totals[:, i] for i, col in enumerate(count_cols)},
+        }
     )
 
     # backfill counts so this is complete then set to smallest data types
@@ -504,15 +507,11 @@ def calculate_total_upstream_functional_stats(network, focal_barrier_joins, fn_u
         .drop(["lineID"])
     )
 
-    # find all upstream networks for these
-    invasive_upstreams = invasive_roots.join(upstreams, "networkID", join_type="inner")
-
-    # combine both sets of IDs
-    invasive_network_ids = pc.unique(
-        pa.concat_arrays(
-            [invasive_upstreams["upstream_network"].combine_chunks(), invasive_roots["networkID"].combine_chunks()]
-        )
+    # find these and all upstream networks in a single sweep
+    invasive_network_ids, _, _ = upstream_graph.network_labels(
+        pc.unique(invasive_roots["networkID"]).to_numpy().astype("int64")
     )
+    invasive_network_ids = pa.array(invasive_network_ids.astype("uint32"))
 
     invasive_networks = out_index.join(
         pa.Table.from_pydict(
@@ -833,17 +832,11 @@ def calculate_downstream_linear_network_stats(
         .rename_columns({"networkID": "upstream_network", "downstream_id": "downstream_network"})
     )
 
-    downstream_graph = DirectedGraph(
+    downstream_graph = CSRDirectedGraph(
         downstream_network_joins["upstream_network"].to_numpy().astype("int64"),
         downstream_network_joins["downstream_network"].to_numpy().astype("int64"),
     )
 
-    network_ids = focal_barrier_downstreams["networkID"].to_numpy().astype("int64")
-    downstreams = pa.Table.from_arrays(
-        downstream_graph.network_pairs(network_ids).T.astype("uint32"),
-        ["networkID", "downstream_network"],
-    )
-
     # use the upstream IDs to join against the network, this gives those barriers
     # that are downstream (interior or at downstream endpoint) but not the
     # barrier at the top of the linear network (which would then need to be deducted)
@@ -867,30 +860,34 @@ def calculate_downstream_linear_network_stats(
         .rename_columns({**{f"{kind}s_sum": f"{kind}s" for kind in BARRIER_KINDS}})
     )
 
+    # sum counts and miles of each network and all networks downstream of it in
+    # a single pass over the graph
     count_cols = [f"{kind}s" for kind in BARRIER_KINDS]
-    tot_downstream_stats = (
-        downstreams.join(downstream_counts, "downstream_network", "networkID")
-        .join(
-            network_stats.select(["networkID", "dl_total_miles"]).rename_columns({"dl_total_miles": "miles_to_outlet"}),
-            "downstream_network",
-            "networkID",
-        )
-        .group_by("networkID")
-        .aggregate([(col, "sum") for col in count_cols] + [("miles_to_outlet", "sum")])
-        .rename_columns(
-            {
-                **{f"{col}_sum": f"totd_{col}" for col in count_cols},
-                "miles_to_outlet_sum": "miles_to_outlet",
-            }
-        )
+    network_values = network_stats.select(["networkID", "dl_total_miles"]).join(
+        downstream_counts, "networkID", join_type="full outer"
+    )
+    value_ids = network_values["networkID"].to_numpy().astype("int64")
+    network_ids = pc.unique(focal_barrier_downstreams["networkID"]).to_numpy().astype("int64")
+    counts = downstream_graph.accumulate_descendants(
+        network_ids,
+        value_ids,
+        np.stack([pc.fill_null(network_values[col], 0).to_numpy().astype("int64") for col in count_cols], axis=1),
+    )
+    miles = downstream_graph.accumulate_descendants(
+        network_ids,
+        value_ids,
+        pc.fill_null(network_values["dl_total_miles"], 0).to_numpy().astype("float64"),
     )
 
-    # fill missing values then set to smallest data types
-    tot_downstream_stats = (
-        focal_barrier_downstreams.select(["networkID"])
-        .join(tot_downstream_stats, "networkID", join_type="inner")
-        .combine_chunks()
+    tot_downstream_stats = pa.Table.from_pydict(
+        {
+            "networkID": pa.array(network_ids.astype("uint32")),
+            "miles_to_outlet": miles,
+            **{f"totd_{col}": counts[:, i] for i, col in enumerate(count_cols)},
+        }
     )
+
+    # fill missing values then set to smallest data types
     out = {
         "networkID": tot_downstream_stats["networkID"],
         "miles_to_outlet": pc.cast(pc.fill_null(tot_downstream_stats["miles_to_outlet"], 0), pa.float32()),
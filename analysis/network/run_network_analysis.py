@@ -7,9 +7,36 @@ The final outputs of this process are a set of network-related files for each re
 and network type (dams or small barriers):
 
 data/networks/<region>/<network type>/*
+
+Groups of connected HUC2s share no flowlines, and network types only share
+read-only inputs, so each combination of group and network type is run as a
+separate work unit in a pool of processes.  Inputs for each group are first
+written to uncompressed feather files that are memory-mapped by the work units,
+so that they are not duplicated in memory of each process.  Work units are
+started largest first, as long as their estimated memory fits within
+MEMORY_BUDGET.  Once all network types are done for a group, their upstream
+network segments are merged into network_segments.feather for each HUC2.
+Outputs of each group are written to the temporary directory of the group and
+only moved to data/networks/clean once all of them are complete, so that a
+failed run does not leave outputs of the group partially updated.
+
+To rebuild only the networks affected by changes to barriers or flowlines since
+the previous run, run with --incremental.  Each group is split into drainage
+basins (flowlines connected by joins regardless of barriers), and the inputs of
+each basin are fingerprinted and compared to those of the previous run, which
+are stored in data/networks/state.  Networks are only created for basins that
+changed; outputs of the previous run for all other basins are reused, updating
+line IDs and barrier IDs that may have been renumbered since then.  Groups
+without a previous run are rebuilt in full, and groups without any changes are
+skipped.  Run without --incremental after changes to the network analysis
+itself.
 """
 
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import os
 from pathlib import Path
+import shutil
+import sys
 from time import time
 import warnings
 
@@ -17,105 +44,60 @@ import pandas as pd
 import pyarrow as pa
 from pyarrow.dataset import dataset
 import pyarrow.compute as pc
-from pyarrow.feather import write_feather
+from pyarrow.feather import read_table, write_feather
 
 from analysis.constants import NETWORK_TYPES
-from analysis.lib.io import read_arrow_tables
+from analysis.lib.io import read_arrow_tables, read_memory_mapped
+from analysis.network.lib.basins import fingerprint_basins, get_id_map, update_ids
 from analysis.network.lib.networks import load_flowlines, create_barrier_networks
 
 warnings.simplefilter("always")  # show geometry related warnings every time
 
 
+# maximum number of work units to run at the same time
+MAX_WORKERS = os.cpu_count()
+
+# maximum total estimated memory of work units running at the same time
+MEMORY_BUDGET = int(0.75 * os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES"))
+
+# rough estimate of the peak memory used per flowline in a group to prepare the
+# inputs of the group or to create the networks of a single network type
+BYTES_PER_FLOWLINE = 2048
+
+
 data_dir = Path("data")
 nhd_dir = data_dir / "nhd/clean"
 networks_dir = data_dir / "networks"
 src_dir = networks_dir / "raw"
 out_dir = networks_dir / "clean"
-out_dir.mkdir(exist_ok=True, parents=True)
-
+tmp_dir = networks_dir / "tmp"
+state_dir = networks_dir / "state"
 
-start = time()
 
-huc2_group_df = pd.read_feather(networks_dir / "connected_huc2s.feather").sort_values(by=["group", "HUC2"])
-huc2s = huc2_group_df.HUC2.values
-groups = huc2_group_df.groupby("group").HUC2.apply(list).tolist()
+def get_group_dir(group_huc2s):
+    return tmp_dir / "_".join(group_huc2s)
 
-all_barriers = (
-    dataset(src_dir / "all_barriers.feather", format="feather")
-    .to_table(
-        columns=[
-            "id",
-            "SARPID",
-            "kind",
-            "HUC2",
-            "primary_network",
-            "largefish_network",
-            "smallfish_network",
-            "invasive",
-        ],
-        # exclude all removed barriers from this analysis; they are handled in a separate step
-        filter=pc.field("removed") == False,  # noqa
-    )
-    .combine_chunks()
-)
-
-all_joins = read_arrow_tables(
-    [src_dir / huc2 / "flowline_joins.feather" for huc2 in huc2s],
-    columns=[
-        "upstream",
-        "downstream",
-        "type",
-        "marine",
-        "great_lakes",
-        "upstream_id",
-        "downstream_id",
-        "junction",
-    ],
-    new_fields={"HUC2": huc2s},
-    dict_fields={"HUC2"},
-)
-
-
-all_barrier_joins = (
-    all_barriers.select(
-        [
-            "id",
-            "primary_network",
-            "largefish_network",
-            "smallfish_network",
-            "invasive",
-        ]
-    )
-    .join(
-        read_arrow_tables(
-            [src_dir / huc2 / "barrier_joins.feather" for huc2 in huc2s],
-            columns=[
-                "id",
-                "upstream_id",
-                "downstream_id",
-                "kind",
-                "marine",
-                "great_lakes",
-                "type",
-            ],
-            new_fields={"HUC2": huc2s},
-            dict_fields={"HUC2"},
-        ),
-        "id",
-        join_type="inner",
-    )
-    .combine_chunks()
-)
 
+def prepare_group(group_huc2s, all_barriers, all_joins, all_barrier_joins):
+    """Write the barriers and joins for a group of connected HUC2s to
+    uncompressed feather files that can be memory-mapped by each work unit of
+    the group.
 
-for group_huc2s in groups:
-    print(f"\n===========================\nCreating networks for {', '.join(group_huc2s)}")
-    group_start = time()
+    Parameters
+    ----------
+    group_huc2s : list of str
+    all_barriers : pyarrow Table
+    all_joins : pyarrow Table
+    all_barrier_joins : pyarrow Table
+    """
+    group_dir = get_group_dir(group_huc2s)
+    group_dir.mkdir(exist_ok=True, parents=True)
 
-    # create output directories
+    # create output directories; outputs are first written to the group
+    # directory and moved to the output directory by save_outputs()
     for huc2 in group_huc2s:
-        huc2_dir = out_dir / huc2
-        huc2_dir.mkdir(exist_ok=True, parents=True)
+        (group_dir / huc2).mkdir(exist_ok=True, parents=True)
+        (out_dir / huc2).mkdir(exist_ok=True, parents=True)
 
     # select records in HUC2s
     group_huc2_array = pa.array(group_huc2s)
@@ -125,29 +107,306 @@ for group_huc2s in groups:
     )
     barrier_joins = all_barrier_joins.filter(pc.is_in(all_barrier_joins["HUC2"], group_huc2_array))
 
+    write_feather(barriers, group_dir / "barriers.feather", compression="uncompressed")
+    write_feather(joins, group_dir / "joins.feather", compression="uncompressed")
+    write_feather(barrier_joins, group_dir / "barrier_joins.feather", compression="uncompressed")
+
+
+def prepare_flowlines(group_huc2s):
+    """Load flowlines for a group of connected HUC2s and write them to an
+    uncompressed feather file that can be memory-mapped by each work unit of
+    the group.
+
+    The drainage basins of the group, including the waterbodies and wetlands
+    of their flowlines, are also fingerprinted so that they can be compared to
+    those of later runs.
+
+    Parameters
+    ----------
+    group_huc2s : list of str
+
+    Returns
+    -------
+    float
+        elapsed time in seconds
+    """
+    start = time()
+    group_dir = get_group_dir(group_huc2s)
+
     flowlines = load_flowlines(group_huc2s)
+    write_feather(flowlines, group_dir / "flowlines.feather", compression="uncompressed")
+
+    lines, barriers = fingerprint_basins(
+        flowlines,
+        read_memory_mapped(group_dir / "joins.feather"),
+        read_memory_mapped(group_dir / "barriers.feather"),
+        read_memory_mapped(group_dir / "barrier_joins.feather"),
+        line_tables=[
+            read_arrow_tables(
+                [src_dir / huc2 / "flowline_waterbodies.feather" for huc2 in group_huc2s],
+                columns=["lineID", "wbID", "km2"],
+            ),
+            read_arrow_tables(
+                [src_dir / huc2 / "flowline_wetlands.feather" for huc2 in group_huc2s],
+                columns=["lineID", "wetlandID", "km2"],
+            ),
+        ],
+    )
+    lines.to_feather(group_dir / "basins.feather")
+    barriers.to_feather(group_dir / "barrier_basins.feather")
 
-    # collate all upstream functional and mainstem network assignments into
-    # a single table
-    upstream_network_segments = flowlines.select(["lineID", "HUC2"])
+    return time() - start
 
-    for network_type in NETWORK_TYPES:
-        print(f"-------------------------\nCreating networks for {network_type}")
-        network_start = time()
 
-        breaking_kinds = pa.array(NETWORK_TYPES[network_type]["kinds"])
-        col = NETWORK_TYPES[network_type].get("column")
+def compare_group(group_huc2s):
+    """Compare the drainage basins of a group of connected HUC2s to those of
+    the previous run.
+
+    If any basins changed, the maps of line IDs and barrier IDs of the
+    previous run to those of this run are written for records in basins that
+    did not change.
+
+    Parameters
+    ----------
+    group_huc2s : list of str
 
-        filter = pc.is_in(pc.field("kind"), breaking_kinds)
+    Returns
+    -------
+    str
+        "full" if there is no previous run of the group or any barriers are not
+        joined to flowlines, "unchanged" if no basins or IDs changed, otherwise
+        "incremental"
+    """
+    group_dir = get_group_dir(group_huc2s)
+    previous_dir = state_dir / group_dir.name
 
-        if col:
-            # Select barriers marked as participating in this network
-            filter = filter & pc.equal(pc.field(col), True)
-        # otherwise: all barriers otherwise included here are used for the analysis,
-        # including road crossings
-        # NOTE: this means all surveyed road barriers that are small-bodied fish barriers and worse
-        # are included in the analysis for unsurveyed road crossings
+    if not (previous_dir / "basins.feather").exists():
+        return "full"
 
+    lines = read_table(group_dir / "basins.feather")
+    barriers = read_table(group_dir / "barrier_basins.feather")
+    previous_lines = read_table(previous_dir / "basins.feather")
+    previous_barriers = read_table(previous_dir / "barrier_basins.feather")
+
+    # barriers that are not in any basin cannot be matched between runs
+    if barriers["fingerprint"].null_count > 0:
+        return "full"
+
+    line_map = get_id_map(previous_lines, lines, ["NHDPlusID", "rank"], "lineID")
+    barrier_map = get_id_map(previous_barriers, barriers, ["kind", "SARPID"], "id")
+
+    if (
+        len(line_map) == len(lines) == len(previous_lines)
+        and len(barrier_map) == len(barriers) == len(previous_barriers)
+        and line_map["previous"].equals(line_map["current"])
+        and barrier_map["previous"].equals(barrier_map["current"])
+    ):
+        return "unchanged"
+
+    write_feather(line_map, group_dir / "line_map.feather", compression="uncompressed")
+    write_feather(barrier_map, group_dir / "barrier_map.feather", compression="uncompressed")
+
+    return "incremental"
+
+
+def save_outputs(group_huc2s):
+    """Move outputs of a group of connected HUC2s from the group directory to
+    the output directory of each HUC2, and save the fingerprints of its
+    drainage basins for comparison by later incremental runs.
+
+    The fingerprints of the previous run are removed before outputs are moved,
+    so that if this fails partway, the next incremental run of the group is a
+    full run instead of reusing outputs that do not match the fingerprints.
+
+    Parameters
+    ----------
+    group_huc2s : list of str
+    """
+    group_dir = get_group_dir(group_huc2s)
+    group_state_dir = state_dir / group_dir.name
+    shutil.rmtree(group_state_dir, ignore_errors=True)
+
+    for huc2 in group_huc2s:
+        for filename in (group_dir / huc2).glob("*.feather"):
+            os.replace(filename, out_dir / huc2 / filename.name)
+
+    group_state_dir.mkdir(exist_ok=True, parents=True)
+    for filename in ["basins.feather", "barrier_basins.feather"]:
+        shutil.copy(group_dir / filename, group_state_dir / filename)
+
+
+def update_columns(table, columns, id_map):
+    """Replace IDs from the previous run with IDs of the current run in
+    columns of table.
+
+    Parameters
+    ----------
+    table : pyarrow Table
+    columns : list of str
+    id_map : pyarrow Table
+        output of get_id_map()
+
+    Returns
+    -------
+    pyarrow Table
+    """
+    for col in columns:
+        table = table.set_column(table.schema.get_field_index(col), col, update_ids(table[col], id_map))
+
+    return table
+
+
+def read_previous_outputs(group_huc2s, network_type, line_map, barrier_map):
+    """Read outputs of the previous run for a single network type in a group of
+    connected HUC2s for networks and barriers in drainage basins that did not
+    change, and update their line IDs and barrier IDs to those of this run.
+
+    Parameters
+    ----------
+    group_huc2s : list of str
+    network_type : str
+    line_map : pyarrow Table
+    barrier_map : pyarrow Table
+
+    Returns
+    -------
+    dict
+        {"network_stats": ..., "barrier_networks": ..., "network_segments": ...,
+        "downstream_mainstem_segments": ..., "downstream_linear_segments": ...}
+    """
+
+    def read(filename, columns=None):
+        return pa.concat_tables(
+            [
+                read_table(out_dir / huc2 / filename, columns=columns)
+                for huc2 in group_huc2s
+                if (out_dir / huc2 / filename).exists()
+            ]
+        )
+
+    network_stats = read(f"{network_type}_network_stats.feather")
+    network_stats = network_stats.filter(pc.is_in(network_stats["networkID"], line_map["previous"]))
+    network_stats = update_columns(network_stats, ["networkID", "downstream_networkID"], line_map)
+    network_stats = update_columns(
+        network_stats, ["barrier_id", "upstream_barrier_id", "downstream_barrier_id"], barrier_map
+    )
+
+    barrier_networks = read(f"{network_type}_network.feather")
+    barrier_networks = barrier_networks.filter(pc.is_in(barrier_networks["id"], barrier_map["previous"]))
+    barrier_networks = update_columns(barrier_networks, ["upNetID", "downNetID"], line_map)
+    barrier_networks = update_columns(barrier_networks, ["id", "UpstreamBarrierID", "DownstreamBarrierID"], barrier_map)
+
+    network_segments = read("network_segments.feather", columns=["lineID", network_type, f"{network_type}_mainstem"])
+    network_segments = network_segments.filter(pc.is_in(network_segments["lineID"], line_map["previous"]))
+    network_segments = update_columns(network_segments, network_segments.column_names, line_map)
+
+    outputs = {
+        "network_stats": network_stats,
+        "barrier_networks": barrier_networks,
+        "network_segments": network_segments,
+    }
+
+    for name in ["downstream_mainstem_segments", "downstream_linear_segments"]:
+        segments = read(f"{network_type}_{name}.feather")
+        segments = segments.filter(pc.is_in(segments["id"], barrier_map["previous"]))
+        segments = update_columns(segments, ["lineID"], line_map)
+        outputs[name] = update_columns(segments, ["id"], barrier_map)
+
+    return outputs
+
+
+def append_table(table, other):
+    """Append rows of other to table, promoting types as needed.
+
+    Parameters
+    ----------
+    table : pyarrow Table or None
+    other : pyarrow Table
+
+    Returns
+    -------
+    pyarrow Table
+    """
+    if table is None:
+        return other
+
+    return pa.concat_tables([table, other.select(table.column_names)], promote_options="permissive")
+
+
+def create_group_networks(group_huc2s, network_type, incremental=False):
+    """Create networks and calculate statistics for a single network type in a
+    group of connected HUC2s, and write outputs for each HUC2 to the temporary
+    directory of the group (see save_outputs()).
+
+    Upstream functional and mainstem network segments are written to the
+    temporary directory of the group to be merged with those of other network
+    types.
+
+    Parameters
+    ----------
+    group_huc2s : list of str
+    network_type : str
+        name of network network_type, one of NETWORK_TYPES keys
+    incremental : bool, optional (default: False)
+        if True, only create networks for drainage basins that changed since
+        the previous run and reuse outputs of the previous run for all other
+        basins (see compare_group())
+
+    Returns
+    -------
+    float
+        elapsed time in seconds
+    """
+    start = time()
+    group_dir = get_group_dir(group_huc2s)
+
+    print(f"-------------------------\nCreating networks for {network_type} in {', '.join(group_huc2s)}")
+
+    barriers = read_memory_mapped(group_dir / "barriers.feather")
+    joins = read_memory_mapped(group_dir / "joins.feather")
+    barrier_joins = read_memory_mapped(group_dir / "barrier_joins.feather")
+    flowlines = read_memory_mapped(group_dir / "flowlines.feather")
+
+    breaking_kinds = pa.array(NETWORK_TYPES[network_type]["kinds"])
+    col = NETWORK_TYPES[network_type].get("column")
+
+    filter = pc.is_in(pc.field("kind"), breaking_kinds)
+
+    if col:
+        # Select barriers marked as participating in this network
+        filter = filter & pc.equal(pc.field(col), True)
+    # otherwise: all barriers otherwise included here are used for the analysis,
+    # including road crossings
+    # NOTE: this means all surveyed road barriers that are small-bodied fish barriers and worse
+    # are included in the analysis for unsurveyed road crossings
+
+    # HUC2 of all focal barriers, including those in basins that did not change
+    barrier_huc2 = barriers.filter(filter).select(["id", "HUC2"])
+
+    if incremental:
+        line_map = read_memory_mapped(group_dir / "line_map.feather")
+        barrier_map = read_memory_mapped(group_dir / "barrier_map.feather")
+
+        # only create networks for flowlines in basins that changed
+        flowlines = flowlines.filter(pc.invert(pc.is_in(flowlines["lineID"], line_map["current"])))
+        line_ids = flowlines["lineID"]
+        joins = joins.filter(
+            pc.or_(pc.is_in(joins["upstream_id"], line_ids), pc.is_in(joins["downstream_id"], line_ids))
+        )
+        barrier_joins = barrier_joins.filter(
+            pc.or_(pc.is_in(barrier_joins["upstream_id"], line_ids), pc.is_in(barrier_joins["downstream_id"], line_ids))
+        )
+        barriers = barriers.filter(pc.is_in(barriers["id"], barrier_joins["id"]))
+
+        print(f"Recreating networks for {len(flowlines):,} flowlines in changed basins")
+
+    network_stats = None
+    barrier_networks = None
+    upstream_network_segments = None
+    downstream_mainstem_networks = None
+    downstream_linear_networks = None
+
+    if len(flowlines):
         focal_barriers = barriers.filter(filter).combine_chunks()
         focal_barrier_joins = barrier_joins.filter(filter).combine_chunks()
 
@@ -167,52 +426,92 @@ for group_huc2s in groups:
             network_type,
         )
 
-        upstream_network_segments = upstream_network_segments.join(
-            upstream_functional_networks.select(["lineID", "networkID"]).rename_columns({"networkID": network_type}),
-            "lineID",
-        ).join(
-            upstream_mainstem_networks.select(["lineID", "networkID"]).rename_columns(
-                {"networkID": f"{network_type}_mainstem"}
+        upstream_network_segments = (
+            flowlines.select(["lineID"])
+            .join(
+                upstream_functional_networks.select(["lineID", "networkID"]).rename_columns(
+                    {"networkID": network_type}
+                ),
+                "lineID",
+            )
+            .join(
+                upstream_mainstem_networks.select(["lineID", "networkID"]).rename_columns(
+                    {"networkID": f"{network_type}_mainstem"}
+                ),
+                "lineID",
+            )
+        )
+        downstream_mainstem_networks = downstream_mainstem_networks.select(["id", "lineID"])
+        downstream_linear_networks = downstream_linear_networks.select(["id", "lineID"])
+
+    if incremental:
+        previous = read_previous_outputs(group_huc2s, network_type, line_map, barrier_map)
+        network_stats = append_table(network_stats, previous["network_stats"])
+        barrier_networks = append_table(barrier_networks, previous["barrier_networks"])
+        upstream_network_segments = append_table(upstream_network_segments, previous["network_segments"])
+        downstream_mainstem_networks = append_table(
+            downstream_mainstem_networks, previous["downstream_mainstem_segments"]
+        )
+        downstream_linear_networks = append_table(downstream_linear_networks, previous["downstream_linear_segments"])
+
+    write_feather(
+        upstream_network_segments, group_dir / f"{network_type}_network_segments.feather", compression="uncompressed"
+    )
+
+    # save network stats to the HUC2 where the network originates
+    for huc2 in sorted(pc.unique(network_stats["origin_HUC2"]).to_pylist()):
+        write_feather(
+            network_stats.filter(pc.equal(network_stats["origin_HUC2"], huc2)),
+            group_dir / huc2 / f"{network_type}_network_stats.feather",
+        )
+
+    # tag downstream networks to HUC2 based on the HUC2 of the barrier at top of downstream network
+    downstream_mainstem_networks = downstream_mainstem_networks.join(barrier_huc2, "id")
+    downstream_linear_networks = downstream_linear_networks.join(barrier_huc2, "id")
+
+    # save barriers by the HUC2 where they are located and downstream linear networks
+    # based on the HUC2 where the barrier is located
+    for huc2 in group_huc2s:
+        write_feather(
+            barrier_networks.filter(pc.equal(barrier_networks["HUC2"], huc2)),
+            group_dir / huc2 / f"{network_type}_network.feather",
+        )
+
+        write_feather(
+            downstream_mainstem_networks.filter(pc.equal(downstream_mainstem_networks["HUC2"], huc2)).select(
+                ["id", "lineID"]
             ),
-            "lineID",
+            group_dir / huc2 / f"{network_type}_downstream_mainstem_segments.feather",
         )
 
-        # save network stats to the HUC2 where the network originates
-        for huc2 in sorted(pc.unique(network_stats["origin_HUC2"]).to_pylist()):
-            write_feather(
-                network_stats.filter(pc.equal(network_stats["origin_HUC2"], huc2)),
-                out_dir / huc2 / f"{network_type}_network_stats.feather",
-            )
+        write_feather(
+            downstream_linear_networks.filter(pc.equal(downstream_linear_networks["HUC2"], huc2)).select(
+                ["id", "lineID"]
+            ),
+            group_dir / huc2 / f"{network_type}_downstream_linear_segments.feather",
+        )
 
-        # tag downstream networks to HUC2 based on the HUC2 of the barrier at top of downstream network
-        # tmp = barriers.set_index("id").HUC2
-        barrier_huc2 = focal_barriers.select(["id", "HUC2"])
-        downstream_mainstem_networks = downstream_mainstem_networks.join(barrier_huc2, "id")
-        downstream_linear_networks = downstream_linear_networks.join(barrier_huc2, "id")
-
-        # save barriers by the HUC2 where they are located and downstream linear networks
-        # based on the HUC2 where the barrier is located
-        for huc2 in group_huc2s:
-            write_feather(
-                barrier_networks.filter(pc.equal(barrier_networks["HUC2"], huc2)),
-                out_dir / huc2 / f"{network_type}_network.feather",
-            )
+    return time() - start
 
-            write_feather(
-                downstream_mainstem_networks.filter(pc.equal(downstream_mainstem_networks["HUC2"], huc2)).select(
-                    ["id", "lineID"]
-                ),
-                out_dir / huc2 / f"{network_type}_downstream_mainstem_segments.feather",
-            )
 
-            write_feather(
-                downstream_linear_networks.filter(pc.equal(downstream_linear_networks["HUC2"], huc2)).select(
-                    ["id", "lineID"]
-                ),
-                out_dir / huc2 / f"{network_type}_downstream_linear_segments.feather",
-            )
+def merge_network_segments(group_huc2s):
+    """Merge upstream network segments of all network types for a group of
+    connected HUC2s and write them to the temporary directory of the group for
+    the HUC2 where they are located.
 
-    print("-------------------------\n")
+    Parameters
+    ----------
+    group_huc2s : list of str
+    """
+    group_dir = get_group_dir(group_huc2s)
+
+    # collate all upstream functional and mainstem network assignments into
+    # a single table
+    upstream_network_segments = read_memory_mapped(group_dir / "flowlines.feather").select(["lineID", "HUC2"])
+    for network_type in NETWORK_TYPES:
+        upstream_network_segments = upstream_network_segments.join(
+            read_memory_mapped(group_dir / f"{network_type}_network_segments.feather"), "lineID"
+        )
 
     # all network segments without networks marked -1
     upstream_network_segments = pa.Table.from_pydict(
@@ -228,13 +527,179 @@ for group_huc2s in groups:
     )
 
     # save network segments in the HUC2 where they are located
-    print("Serializing network segments")
     for huc2 in group_huc2s:
         write_feather(
             upstream_network_segments.filter(pc.equal(upstream_network_segments["HUC2"], huc2)),
-            out_dir / huc2 / "network_segments.feather",
+            group_dir / huc2 / "network_segments.feather",
+        )
+
+
+def run_work_units(units):
+    """Run work units in a pool of processes, largest first, limiting the total
+    estimated memory of units running at the same time to MEMORY_BUDGET.
+
+    A unit that exceeds MEMORY_BUDGET on its own is run when no other units are
+    running.  Each unit runs in a new process so that its memory is released
+    when it finishes.
+
+    Parameters
+    ----------
+    units : list of (int, func, tuple)
+        estimated memory in bytes, function, and arguments of each unit
+
+    Returns
+    -------
+    list
+        results of each unit, in the same order as units
+    """
+    pending = sorted(range(len(units)), key=lambda i: units[i][0], reverse=True)
+    results = [None] * len(units)
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS, max_tasks_per_child=1) as executor:
+        while pending or running:
+            available = MEMORY_BUDGET - sum(units[i][0] for i in running.values())
+
+            for i in list(pending):
+                if len(running) >= MAX_WORKERS:
+                    break
+
+                memory, func, args = units[i]
+                if memory <= available or not running:
+                    running[executor.submit(func, *args)] = i
+                    pending.remove(i)
+                    available -= memory
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    return results
+
+
+if __name__ == "__main__":
+    start = time()
+
+    huc2_group_df = pd.read_feather(networks_dir / "connected_huc2s.feather").sort_values(by=["group", "HUC2"])
+    huc2s = huc2_group_df.HUC2.values
+    groups = huc2_group_df.groupby("group").HUC2.apply(list).tolist()
+
+    all_barriers = (
+        dataset(src_dir / "all_barriers.feather", format="feather")
+        .to_table(
+            columns=[
+                "id",
+                "SARPID",
+                "kind",
+                "HUC2",
+                "primary_network",
+                "largefish_network",
+                "smallfish_network",
+                "invasive",
+            ],
+            # exclude all removed barriers from this analysis; they are handled in a separate step
+            filter=pc.field("removed") == False,  # noqa
+        )
+        .combine_chunks()
+    )
+
+    all_joins = read_arrow_tables(
+        [src_dir / huc2 / "flowline_joins.feather" for huc2 in huc2s],
+        columns=[
+            "upstream",
+            "downstream",
+            "type",
+            "marine",
+            "great_lakes",
+            "upstream_id",
+            "downstream_id",
+            "junction",
+        ],
+        new_fields={"HUC2": huc2s},
+        dict_fields={"HUC2"},
+    )
+
+    all_barrier_joins = (
+        all_barriers.select(
+            [
+                "id",
+                "primary_network",
+                "largefish_network",
+                "smallfish_network",
+                "invasive",
+            ]
+        )
+        .join(
+            read_arrow_tables(
+                [src_dir / huc2 / "barrier_joins.feather" for huc2 in huc2s],
+                columns=[
+                    "id",
+                    "upstream_id",
+                    "downstream_id",
+                    "kind",
+                    "marine",
+                    "great_lakes",
+                    "type",
+                ],
+                new_fields={"HUC2": huc2s},
+                dict_fields={"HUC2"},
+            ),
+            "id",
+            join_type="inner",
         )
+        .combine_chunks()
+    )
+
+    # estimate memory of each group based on its number of flowlines
+    group_memory = [
+        BYTES_PER_FLOWLINE
+        * sum(dataset(src_dir / huc2 / "flowlines.feather", format="feather").count_rows() for huc2 in group_huc2s)
+        for group_huc2s in groups
+    ]
+
+    print(f"Preparing inputs for {len(groups)} groups of HUC2s")
+    prepare_start = time()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for group_huc2s in groups:
+        prepare_group(group_huc2s, all_barriers, all_joins, all_barrier_joins)
+
+    del all_barriers, all_joins, all_barrier_joins
+
+    run_work_units(
+        [(memory, prepare_flowlines, (group_huc2s,)) for group_huc2s, memory in zip(groups, group_memory)]
+    )
+    print(f"Inputs prepared in {time() - prepare_start:.2f}s")
+
+    if "--incremental" in sys.argv:
+        modes = [compare_group(group_huc2s) for group_huc2s in groups]
+        for group_huc2s, mode in zip(groups, modes):
+            print(f"{', '.join(group_huc2s)}: {mode}")
+    else:
+        modes = ["full"] * len(groups)
+
+    changed = [
+        (group_huc2s, memory, mode)
+        for group_huc2s, memory, mode in zip(groups, group_memory, modes)
+        if mode != "unchanged"
+    ]
+
+    units = [
+        (memory, create_group_networks, (group_huc2s, network_type, mode == "incremental"))
+        for group_huc2s, memory, mode in changed
+        for network_type in NETWORK_TYPES
+    ]
+    print(f"Creating networks for {len(units)} combinations of HUC2 groups and network types")
+    elapsed = run_work_units(units)
+    for (_, _, (group_huc2s, network_type, _)), unit_elapsed in zip(units, elapsed):
+        print(f"{network_type} networks for {', '.join(group_huc2s)} done in {unit_elapsed:.2f}s")
+
+    print("-------------------------\n")
+
+    print("Serializing network segments")
+    for group_huc2s, _, _ in changed:
+        merge_network_segments(group_huc2s)
+        save_outputs(group_huc2s)
 
-    print(f"group done in {time() - group_start:.2f}s\n\n")
+    shutil.rmtree(tmp_dir)
 
-print(f"All done in {time() - start:.2f}s")
+    print(f"All done in {time() - start:.2f}s")
@@ -0,0 +1,139 @@
+"""Benchmark the dict-based DirectedGraph against CSRDirectedGraph for creating
+upstream functional networks for a group of connected HUC2s.
+
+This uses the flowline joins and barrier joins created by cut_flowlines.py,
+broken at the barriers of a given network type (same as
+analysis/network/lib/networks.py::create_barrier_networks).  Origins are
+limited to joins without a downstream flowline.
+
+Run from the root of this repository:
+python -m analysis.network.special.benchmark_graphs <HUC2> <network type>
+
+The HUC2 defaults to 02 and is expanded to all HUC2s in its connected group;
+network type defaults to dams.
+"""
+
+import ctypes
+import gc
+import os
+from pathlib import Path
+import sys
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from analysis.constants import NETWORK_TYPES
+from analysis.lib.graph.speedups import CSRDirectedGraph, DirectedGraph
+from analysis.lib.io import read_arrow_tables
+
+
+REPEATS = 3
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+data_dir = Path("data")
+networks_dir = data_dir / "networks"
+src_dir = networks_dir / "raw"
+
+
+def get_resident_memory():
+    """Get resident memory after returning freed memory to the OS, so that
+    temporary arrays are not included (Linux only).
+
+    Returns
+    -------
+    int
+        bytes
+    """
+    gc.collect()
+    ctypes.CDLL("libc.so.6").malloc_trim(0)
+    return int(Path("/proc/self/statm").read_text().split()[1]) * PAGE_SIZE
+
+
+def benchmark(graph_class, source, target, origin_ids, barrier_ids):
+    """Create graph and traverse networks from origins and barriers.
+
+    Returns
+    -------
+    (dict, list of ndarray)
+        tuple of {"build": <seconds>, "traverse": <seconds>, "memory": <bytes>}
+        and network pairs for origins and barriers
+    """
+    memory = get_resident_memory()
+    start = perf_counter()
+    graph = graph_class(source, target)
+    build = perf_counter() - start
+    memory = get_resident_memory() - memory
+
+    elapsed = []
+    for _ in range(REPEATS):
+        start = perf_counter()
+        pairs = [graph.network_pairs(origin_ids), graph.network_pairs(barrier_ids)]
+        elapsed.append(perf_counter() - start)
+
+    return {"build": build, "traverse": np.min(elapsed), "memory": memory}, pairs
+
+
+def sort_pairs(pairs):
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+if __name__ == "__main__":
+    huc2 = sys.argv[1] if len(sys.argv) > 1 else "02"
+    network_type = sys.argv[2] if len(sys.argv) > 2 else "dams"
+
+    huc2_group_df = pd.read_feather(networks_dir / "connected_huc2s.feather")
+    group = huc2_group_df.loc[huc2_group_df.HUC2 == huc2, "group"].iloc[0]
+    huc2s = sorted(huc2_group_df.loc[huc2_group_df.group == group].HUC2.values)
+
+    print(f"Loading joins for {', '.join(huc2s)}")
+    joins = read_arrow_tables(
+        [src_dir / huc2 / "flowline_joins.feather" for huc2 in huc2s], columns=["upstream_id", "downstream_id"]
+    )
+    barrier_joins = read_arrow_tables(
+        [src_dir / huc2 / "barrier_joins.feather" for huc2 in huc2s], columns=["upstream_id", "kind"]
+    )
+    barrier_joins = barrier_joins.filter(
+        pc.and_(
+            pc.is_in(barrier_joins["kind"], pa.array(NETWORK_TYPES[network_type]["kinds"])),
+            pc.not_equal(barrier_joins["upstream_id"], 0),
+        )
+    )
+
+    interior_joins = joins.filter(
+        pc.and_(pc.not_equal(joins["upstream_id"], 0), pc.not_equal(joins["downstream_id"], 0))
+    )
+    upstream_joins = interior_joins.join(
+        barrier_joins.select(["upstream_id"]), "upstream_id", join_type="left anti"
+    ).combine_chunks()
+
+    source = upstream_joins["downstream_id"].to_numpy().astype("int64")
+    target = upstream_joins["upstream_id"].to_numpy().astype("int64")
+    barrier_ids = pc.unique(barrier_joins["upstream_id"]).to_numpy().astype("int64")
+    origin_ids = np.setdiff1d(
+        pc.unique(joins.filter(pc.equal(joins["downstream_id"], 0))["upstream_id"]).to_numpy().astype("int64"),
+        barrier_ids,
+    )
+
+    print(f"{len(source):,} joins, {len(origin_ids):,} origins, {len(barrier_ids):,} barriers\n")
+
+    # compile traversal functions before benchmarking
+    for graph_class in [DirectedGraph, CSRDirectedGraph]:
+        graph_class(source[:10], target[:10]).network_pairs(origin_ids[:10])
+
+    print(f"{'backend':>16}  {'build (s)':>10}  {'traverse (s)':>12}  {'memory (MB)':>12}")
+    results = {}
+    for graph_class in [DirectedGraph, CSRDirectedGraph]:
+        timings, results[graph_class.__name__] = benchmark(graph_class, source, target, origin_ids, barrier_ids)
+        print(
+            f"{graph_class.__name__:>16}  {timings['build']:>10.2f}  {timings['traverse']:>12.2f}  "
+            f"{timings['memory'] / 1e6:>12.1f}"
+        )
+
+    for expected, actual in zip(results["DirectedGraph"], results["CSRDirectedGraph"]):
+        if not np.array_equal(sort_pairs(expected), sort_pairs(actual)):
+            raise ValueError("network pairs do not match between backends")
+
+    print("\nnetwork pairs match between backends")
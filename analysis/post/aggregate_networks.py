@@ -1,38 +1,32 @@
-from io import BytesIO
 from pathlib import Path
 from time import time
-from zipfile import ZipFile, ZIP_DEFLATED
 
 import duckdb
 import geopandas as gp
-import numpy as np
 import pandas as pd
+import pyarrow.compute as pc
 from pyarrow.dataset import dataset
-from pyarrow.csv import write_csv
+from pyarrow.feather import write_feather
 
-from analysis.constants import SEVERITY_TO_PASSABILITY, STATES
+from analysis.constants import SEVERITY_TO_PASSABILITY
 from analysis.lib.util import get_signed_dtype, append
+from analysis.post.lib.search_index import create_search_index
+from analysis.post.lib.unit_index import create_unit_index
 from analysis.rank.lib.networks import get_network_results, get_removed_network_results
 from analysis.rank.lib.metrics import classify_streamorder, classify_spps, classify_annual_flow, classify_cost
 from api.constants import (
     GENERAL_API_FIELDS1,
     UNIT_FIELDS,
+    UNIT_ID_FIELDS,
+    QUERY_FIELDS,
     DAM_API_FIELDS,
     SB_API_FIELDS,
     COMBINED_API_FIELDS,
     WF_API_FIELDS,
     ROAD_CROSSING_API_FIELDS,
     BARRIER_SEARCH_RESULT_FIELDS,
-    CUSTOM_TIER_FIELDS,
-    DAM_EXPORT_FIELDS,
-    SB_EXPORT_FIELDS,
-    COMBINED_EXPORT_FIELDS,
-    ROAD_CROSSING_EXPORT_FIELDS,
     verify_domains,
 )
-from api.metadata import get_readme, get_terms
-from api.lib.domains import unpack_domains
-from api.settings import LOGO_PATH
 from analysis.constants import NETWORK_TYPES
 
 # NOTE: no need to aggregate stats for full / dams-only networks
@@ -46,8 +40,6 @@ api_dir = data_dir / "api"
 api_dir.mkdir(exist_ok=True, parents=True)
 results_dir = data_dir / "barriers/networks"
 results_dir.mkdir(exist_ok=True, parents=True)
-zip_dir = api_dir / "downloads"
-zip_dir.mkdir(exist_ok=True)
 tmp_dir = Path("/tmp/sarp")
 tmp_dir.mkdir(exist_ok=True)
 
@@ -103,7 +95,9 @@ dams["FatalityClass"] = (dams.Fatality > 0).fillna(0).astype("uint8")
 
 # export removed dams for separate API endpoint
 # NOTE: these don't have network stats for removed dams
-pd.DataFrame(dams.loc[dams.Removed, removed_dam_cols].reset_index()).to_feather(api_dir / "removed_dams.feather")
+pd.DataFrame(dams.loc[dams.Removed, removed_dam_cols].reset_index()).to_feather(
+    api_dir / "removed_dams.feather", compression="uncompressed"
+)
 
 # Drop all dropped / duplicate dams from API / tiles
 # NOTE: excluded ones are retained but don't have networks; ones on loops are
@@ -196,7 +190,12 @@ tmp["id"] = tmp.id.astype("uint32")
 # add report URL
 tmp["URL"] = "https://tool.aquaticbarriers.org/report/dams/" + tmp.SARPID
 
-tmp.sort_values("SARPID").drop_duplicates(subset="SARPID").reset_index(drop=True).to_feather(api_dir / "dams.feather")
+# sort by HUC12 so that records within each HUC are contiguous (see unit index below)
+# NOTE: API datasets are not compressed so that they can be memory-mapped and
+# shared by all API processes
+tmp.sort_values("SARPID").drop_duplicates(subset="SARPID").sort_values(by=["HUC12", "SARPID"]).reset_index(
+    drop=True
+).to_feather(api_dir / "dams.feather", compression="uncompressed")
 
 
 #########################################################################################
@@ -304,9 +303,9 @@ tmp["id"] = tmp.id.astype("uint32")
 # add report URL
 tmp["URL"] = "https://tool.aquaticbarriers.org/report/combined_barriers/" + tmp.SARPID
 
-tmp.sort_values("SARPID").drop_duplicates(subset="SARPID").reset_index(drop=True).to_feather(
-    api_dir / "small_barriers.feather"
-)
+tmp.sort_values("SARPID").drop_duplicates(subset="SARPID").sort_values(by=["HUC12", "SARPID"]).reset_index(
+    drop=True
+).to_feather(api_dir / "small_barriers.feather", compression="uncompressed")
 
 #########################################################################################
 ###
@@ -478,9 +477,9 @@ for network_type in ["combined_barriers", "largefish_barriers", "smallfish_barri
     # add report URL
     tmp["URL"] = f"https://tool.aquaticbarriers.org/report/{network_type}/" + tmp.SARPID
 
-    tmp.sort_values("SARPID").drop_duplicates(subset="SARPID").reset_index(drop=True).to_feather(
-        api_dir / f"{network_type}.feather"
-    )
+    tmp.sort_values("SARPID").drop_duplicates(subset="SARPID").sort_values(by=["HUC12", "SARPID"]).reset_index(
+        drop=True
+    ).to_feather(api_dir / f"{network_type}.feather", compression="uncompressed")
 
     # save for search
     if network_type == "combined_barriers":
@@ -589,7 +588,9 @@ verify_domains(tmp)
 tmp["id"] = tmp.id.astype("uint32")
 
 
-tmp.sort_values(by=["SARPID", "network_type"]).reset_index(drop=True).to_feather(api_dir / "waterfalls.feather")
+tmp.sort_values(by=["SARPID", "network_type"]).reset_index(drop=True).to_feather(
+    api_dir / "waterfalls.feather", compression="uncompressed"
+)
 
 
 #########################################################################################
@@ -648,9 +649,9 @@ verify_domains(tmp)
 
 # downcast id to uint32 or it breaks in UI
 tmp["id"] = tmp.id.astype("uint32")
-tmp.sort_values("SARPID").drop_duplicates(subset="SARPID").reset_index(drop=True).to_feather(
-    api_dir / "road_crossings.feather"
-)
+tmp.sort_values("SARPID").drop_duplicates(subset="SARPID").sort_values(by=["HUC12", "SARPID"]).reset_index(
+    drop=True
+).to_feather(api_dir / "road_crossings.feather", compression="uncompressed")
 
 ### Save barrier search items
 # TODO: split this into 2 tables: one by SARPID and one for searching name that drops all that are empty strings
@@ -671,36 +672,37 @@ for col in ["Name", "River", "State", "BarrierType"]:
 
 search_barriers.to_feather(tmp_dir / "search_barriers.feather")
 
+# create trigram index for searching by name
+# NOTE: these must be uncompressed and written as a single record batch so that
+# they can be memory-mapped by the API
+print("Creating barrier name search index")
+names = search_barriers.loc[search_barriers.search_key != "", ["SARPID", "search_key"]].reset_index(drop=True)
+names["search_key"] = names.search_key.str.lower()
+names, trigrams = create_search_index(names)
+write_feather(names, api_dir / "search_barriers_name.feather", compression="uncompressed", chunksize=len(names))
+write_feather(
+    trigrams, api_dir / "search_barriers_name_trigrams.feather", compression="uncompressed", chunksize=len(trigrams)
+)
+
 
 ################################################################################
 ### Create DuckDB database for much faster barrier lookup by SARPID and name
 ################################################################################
 
 # NOTE:
-# this uses an index on SARPID, which works because it is highly selective and thus high performance;
+# this only contains tables used to search barriers by SARPID or name; details
+# of individual barriers are read by the API directly from the feather files
+# using an index of rows by SARPID (see api/lib/details.py).
+# The index on SARPID works because it is highly selective and thus high performance;
 # name and other fields are not indexed because the current indexes in DuckDB
-# are not actually used when querying them (not selective enough), so they are
-# slower than reading directly from the feather files.
-# This excludes waterfalls, which aren't searched via the API (and also would fail unique index below)
+# are not actually used when querying them (not selective enough).
 
-print("Creating DuckDB database for faster barrier lookup")
+print("Creating DuckDB database for faster barrier search")
 out_db = api_dir / "api.db"
 if out_db.exists():
     out_db.unlink()
 
 with duckdb.connect(str(out_db)) as con:
-    for network_type in network_types:
-        print(f"Creating {network_type} table")
-        ds = dataset(api_dir / f"{network_type}.feather", format="feather")
-        _ = con.execute(f"CREATE TABLE {network_type} AS SELECT * from ds")
-        _ = con.execute(f"CREATE UNIQUE INDEX {network_type}_sarpid_index ON {network_type} (SARPID)")
-
-    if "road_crossings" not in network_types:
-        print("Creating road_crossings table")
-        ds = dataset(api_dir / "road_crossings.feather", format="feather")
-        _ = con.execute("CREATE TABLE road_crossings AS SELECT * from ds")
-        _ = con.execute("CREATE UNIQUE INDEX road_crossings_sarpid_index ON road_crossings (SARPID)")
-
     print("Creating seach_barriers table")
     ds = dataset(tmp_dir / "search_barriers.feather", format="feather")
     _ = con.execute("CREATE TABLE search_barriers AS SELECT SARPID, Name, River, State, BarrierType, lat, lon from ds")
@@ -712,51 +714,51 @@ with duckdb.connect(str(out_db)) as con:
 
 
 ################################################################################
-### Pre-create zip files for national downloads
+### Create index of rows in each summary unit
 ################################################################################
-filename = "aquatic_barrier_ranks.csv"
-unit_ids = {"State": np.array(sorted(STATES.keys()))}
-
-for barrier_type in ["dams", "small_barriers", "combined_barriers", "road_crossings"]:
-    print(f"Creating {zip_dir}/{barrier_type}.zip...")
 
-    warnings = None
+# NOTE: this is used by the API to read only the rows in the selected summary
+# units instead of scanning all rows.  Barriers are sorted by HUC12 above, so
+# each HUC is a single range of rows; other units may have multiple ranges.
+for barrier_type in QUERY_FIELDS:
+    print(f"Creating {barrier_type} summary unit index")
+    columns = UNIT_ID_FIELDS + (["Ranked"] if barrier_type != "road_crossings" else [])
+    df = dataset(api_dir / f"{barrier_type}.feather", format="feather").to_table(columns=columns).combine_chunks()
+    write_feather(create_unit_index(df, UNIT_ID_FIELDS), api_dir / f"{barrier_type}_unit_index.feather")
 
-    columns = ["id"]
-    match barrier_type:
-        case "dams":
-            columns += DAM_EXPORT_FIELDS
-        case "small_barriers":
-            columns += SB_EXPORT_FIELDS
-        case "combined_barriers" | "largefish_barriers" | "smallfish_barriers":
-            columns += COMBINED_EXPORT_FIELDS
-        case "road_crossings":
-            columns += ROAD_CROSSING_EXPORT_FIELDS
-            warnings = "this dataset includes road/stream crossings (potential barriers) derived from the USGS Road Crossings dataset (2022) or USFS National Road / Stream crossings dataset (2024) that have not yet been surveyed for impacts to aquatic organisms.  These only include those that were snapped to the aquatic network and should not be taken as a comprehensive survey of all possible road-related barriers."
 
-    columns = [c for c in columns if c not in CUSTOM_TIER_FIELDS]
+################################################################################
+### Pre-aggregate counts of query field combinations by summary unit
+################################################################################
 
-    df = dataset(api_dir / f"{barrier_type}.feather", format="feather").to_table(columns=columns).combine_chunks()
-    if barrier_type != "road_crossings":
-        df = df.sort_by([("HasNetwork", "descending")])
-
-    df = unpack_domains(df.drop(["id"]))
-
-    ### Get metadata
-    readme = get_readme(
-        filename=filename,
-        barrier_type=barrier_type,
-        fields=df.column_names,
-        unit_ids=unit_ids,
-        warnings=warnings,
+# NOTE: these are used by the query API endpoint to answer requests that only
+# select summary units, without scanning all barriers in those units.
+# Counts are limited to ranked barriers (except road crossings) to match the query endpoint.
+unit_counts_dir = api_dir / "unit_counts"
+unit_counts_dir.mkdir(exist_ok=True)
+
+for barrier_type, query_fields in QUERY_FIELDS.items():
+    print(f"Aggregating {barrier_type} counts by summary unit")
+    filter = None if barrier_type == "road_crossings" else pc.field("Ranked") == True  # noqa
+    df = (
+        dataset(api_dir / f"{barrier_type}.feather", format="feather")
+        .to_table(columns=UNIT_ID_FIELDS + ["lon", "lat"] + query_fields, filter=filter)
+        .combine_chunks()
     )
-    terms = get_terms()
 
-    with ZipFile(zip_dir / f"{barrier_type}.zip", "w", compression=ZIP_DEFLATED, compresslevel=9) as out:
-        csv_stream = BytesIO()
-        write_csv(df, csv_stream)
-        out.writestr(filename, csv_stream.getvalue())
+    for layer in UNIT_ID_FIELDS:
+        counts = df.group_by([layer] + query_fields).aggregate([("lon", "count")])
+        counts = counts.select([layer] + query_fields + ["lon_count"]).rename_columns(
+            [layer] + query_fields + ["_count"]
+        )
+        counts = counts.set_column(counts.num_columns - 1, "_count", counts["_count"].cast("uint32"))
+        write_feather(counts, unit_counts_dir / f"{barrier_type}_{layer}.feather")
+
+        bounds = (
+            df.group_by(layer)
+            .aggregate([("lon", "min"), ("lat", "min"), ("lon", "max"), ("lat", "max")])
+            .select([layer, "lon_min", "lat_min", "lon_max", "lat_max"])
+            .rename_columns([layer, "xmin", "ymin", "xmax", "ymax"])
+        )
+        write_feather(bounds, unit_counts_dir / f"{barrier_type}_{layer}_bounds.feather")
 
-        out.writestr("README.txt", readme)
-        out.writestr("TERMS_OF_USE.txt", terms)
-        out.write(LOGO_PATH, LOGO_PATH.name)
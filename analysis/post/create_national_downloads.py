@@ -0,0 +1,222 @@
+"""Create zip files of CSVs of all barriers in all states for national downloads.
+
+Each download is created in a separate process.  Downloads are only recreated
+if the barrier data, the export fields, the data version, or the metadata
+templates have changed since the last time they were created; these are
+tracked in manifest.json.
+
+Run after analysis/post/aggregate_networks.py:
+python analysis/post/create_national_downloads.py
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+from pathlib import Path
+from time import time
+
+import numpy as np
+import pyarrow.compute as pc
+from pyarrow.dataset import dataset
+
+from analysis.constants import STATES
+from api.constants import (
+    CUSTOM_TIER_FIELDS,
+    DAM_EXPORT_FIELDS,
+    SB_EXPORT_FIELDS,
+    COMBINED_EXPORT_FIELDS,
+    ROAD_CROSSING_EXPORT_FIELDS,
+    DAM_FIELD_DEFINITIONS,
+    SB_FIELD_DEFINITIONS,
+    COMBINED_FIELD_DEFINITIONS,
+    ROAD_CROSSING_FIELD_DEFINITIONS,
+)
+from api.lib.archive import write_download_zip
+from api.lib.domains import unpack_domains, unpack_schema
+from api import metadata
+from api.metadata import get_readme, get_terms
+from api.settings import DATA_VERSION, DATA_DATE
+
+
+BARRIER_TYPES = ["dams", "small_barriers", "combined_barriers", "road_crossings"]
+FILENAME = "aquatic_barrier_ranks.csv"
+
+# maximum number of records to unpack and write to CSV at a time
+BATCH_SIZE = 100_000
+
+# size of blocks read at a time to hash data files
+HASH_BLOCK_SIZE = 1 << 24
+
+data_dir = Path("data")
+api_dir = data_dir / "api"
+zip_dir = api_dir / "downloads"
+manifest_filename = zip_dir / "manifest.json"
+
+unit_ids = {"State": np.array(sorted(STATES.keys()))}
+
+FIELD_DEFINITIONS_BY_TYPE = {
+    "dams": DAM_FIELD_DEFINITIONS,
+    "small_barriers": SB_FIELD_DEFINITIONS,
+    "combined_barriers": COMBINED_FIELD_DEFINITIONS,
+    "road_crossings": ROAD_CROSSING_FIELD_DEFINITIONS,
+}
+
+
+def get_export_fields(barrier_type):
+    """Get fields and warnings to include in download of barrier_type.
+
+    Parameters
+    ----------
+    barrier_type : str
+
+    Returns
+    -------
+    (list, str or None)
+        tuple of export fields and warnings
+    """
+    warnings = None
+    match barrier_type:
+        case "dams":
+            columns = DAM_EXPORT_FIELDS
+        case "small_barriers":
+            columns = SB_EXPORT_FIELDS
+        case "combined_barriers":
+            columns = COMBINED_EXPORT_FIELDS
+        case "road_crossings":
+            columns = ROAD_CROSSING_EXPORT_FIELDS
+            warnings = "this dataset includes road/stream crossings (potential barriers) derived from the USGS Road Crossings dataset (2022) or USFS National Road / Stream crossings dataset (2024) that have not yet been surveyed for impacts to aquatic organisms.  These only include those that were snapped to the aquatic network and should not be taken as a comprehensive survey of all possible road-related barriers."
+
+    return [c for c in columns if c not in CUSTOM_TIER_FIELDS], warnings
+
+
+def get_key(barrier_type, filename, columns, warnings):
+    """Get a key that changes if the contents of the data file, the export
+    fields, the data version, or the metadata templates change.
+
+    The key is based on the metadata templates instead of the rendered README
+    and terms of use, because these include the current date.
+
+    Parameters
+    ----------
+    barrier_type : str
+    filename : Path
+        barrier data file
+    columns : list
+        export fields
+    warnings : str or None
+
+    Returns
+    -------
+    str
+    """
+    key = hashlib.sha256()
+    with open(filename, "rb") as infile:
+        while block := infile.read(HASH_BLOCK_SIZE):
+            key.update(block)
+
+    field_def = FIELD_DEFINITIONS_BY_TYPE[barrier_type]
+    key.update(
+        json.dumps(
+            [
+                columns,
+                warnings,
+                {c: field_def[c] for c in columns if c in field_def},
+                DATA_VERSION,
+                DATA_DATE,
+                metadata.readme,
+                metadata.description,
+                metadata.terms,
+                metadata.terms_of_use,
+            ]
+        ).encode("UTF8")
+    )
+
+    return key.hexdigest()
+
+
+def create_national_download(barrier_type, previous_key=None):
+    """Create zip file of CSV of all barriers of barrier_type, unless it has
+    not changed since it was created with previous_key.
+
+    CSV data are unpacked and written into the zip file in batches, with barriers
+    that have networks first (except road crossings).
+
+    Parameters
+    ----------
+    barrier_type : str
+    previous_key : str, optional (default: None)
+        key from manifest of previous download
+
+    Returns
+    -------
+    (str, bool)
+        tuple of key and True if the download was recreated
+    """
+    path = zip_dir / f"{barrier_type}.zip"
+    filename = api_dir / f"{barrier_type}.feather"
+
+    columns, warnings = get_export_fields(barrier_type)
+
+    key = get_key(barrier_type, filename, columns, warnings)
+    if key == previous_key and path.exists():
+        return key, False
+
+    readme = get_readme(
+        filename=FILENAME,
+        barrier_type=barrier_type,
+        fields=columns,
+        unit_ids=unit_ids,
+        warnings=warnings,
+    )
+    terms = get_terms()
+
+    ds = dataset(filename, format="feather")
+
+    if barrier_type == "road_crossings":
+        scan_filters = [None]
+    else:
+        # sort by HasNetwork by extracting barriers with networks before barriers without
+        scan_filters = [pc.field("HasNetwork"), ~pc.field("HasNetwork")]
+
+    scanners = [ds.scanner(columns=columns, filter=scan_filter) for scan_filter in scan_filters]
+
+    def batches():
+        for scanner in scanners:
+            for batch in scanner.to_batches():
+                for i in range(0, batch.num_rows, BATCH_SIZE):
+                    yield unpack_domains(batch.slice(i, BATCH_SIZE))
+
+    write_download_zip(
+        path, FILENAME, unpack_schema(scanners[0].projected_schema), batches(), readme, terms, compresslevel=9
+    )
+
+    return key, True
+
+
+if __name__ == "__main__":
+    start = time()
+
+    zip_dir.mkdir(exist_ok=True)
+    manifest = json.loads(manifest_filename.read_text()) if manifest_filename.exists() else {}
+
+    with ProcessPoolExecutor(max_workers=min(len(BARRIER_TYPES), os.cpu_count())) as executor:
+        futures = {
+            barrier_type: executor.submit(
+                create_national_download, barrier_type, manifest.get(barrier_type, {}).get("key", None)
+            )
+            for barrier_type in BARRIER_TYPES
+        }
+
+        for barrier_type, future in futures.items():
+            key, created = future.result()
+            if not created:
+                print(f"{zip_dir}/{barrier_type}.zip is up to date")
+                continue
+
+            print(f"Created {zip_dir}/{barrier_type}.zip")
+            manifest[barrier_type] = {"key": key}
+
+    manifest_filename.write_text(json.dumps(manifest, indent=2))
+
+    print(f"Done in {time() - start:.2f}s")
@@ -0,0 +1,100 @@
+"""Create pre-compressed CSV segments for the public API.
+
+Barriers are unpacked and written to CSV for each combination of state and
+HasNetwork, and each segment is compressed separately.  The API concatenates
+the header and the segments of the requested states (barriers without networks
+first) into a single gzip stream without reading or unpacking the barriers.
+Removed dams are written as a single gzipped CSV.  The data version is written
+to the index of each file, so that the API does not use files from a previous
+data release.
+
+Run after analysis/post/aggregate_networks.py:
+python analysis/post/create_public_api_csv.py
+"""
+
+import gzip
+import json
+from pathlib import Path
+from time import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow.csv import write_csv, WriteOptions
+from pyarrow.dataset import dataset
+
+from api.constants import STATES, DAM_PUBLIC_EXPORT_FIELDS, SB_PUBLIC_EXPORT_FIELDS
+from api.lib.domains import unpack_domains
+from api.lib.segments import compress_segment
+from api.settings import DATA_VERSION
+
+
+data_dir = Path("data")
+api_dir = data_dir / "api"
+out_dir = api_dir / "public"
+
+
+def to_csv(df, include_header=True):
+    """Unpack domains and write table to CSV with lowercase column names
+    (same as api.response::csv_response).
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+    include_header : bool, optional (default: True)
+
+    Returns
+    -------
+    bytes
+    """
+    df = unpack_domains(df)
+    df = df.rename_columns([c.lower() for c in df.column_names])
+
+    stream = pa.BufferOutputStream()
+    write_csv(df, stream, write_options=WriteOptions(include_header=include_header))
+
+    return stream.getvalue().to_pybytes()
+
+
+start = time()
+
+out_dir.mkdir(exist_ok=True)
+
+for barrier_type, source, columns in [
+    ("dams", "dams", DAM_PUBLIC_EXPORT_FIELDS),
+    ("barriers", "small_barriers", SB_PUBLIC_EXPORT_FIELDS),
+]:
+    print(f"Creating public API CSV segments for {barrier_type}")
+
+    df = dataset(api_dir / f"{source}.feather", format="feather").to_table(
+        columns=list(dict.fromkeys(columns + ["State", "HasNetwork"]))
+    )
+
+    with open(out_dir / f"{barrier_type}.segments", "wb") as out:
+        # header is the first segment
+        compressed, info = compress_segment(to_csv(df.select(columns).slice(0, 0)))
+        # [offset, length, crc, size, shift]
+        index = {"data_version": DATA_VERSION, "header": [out.tell(), len(compressed)] + info, "segments": {}}
+        out.write(compressed)
+
+        for has_network in [False, True]:
+            segments = index["segments"][str(has_network).lower()] = {}
+
+            for state in sorted(STATES):
+                subset = df.filter(pc.and_(pc.equal(df["State"], state), pc.equal(df["HasNetwork"], has_network)))
+                if len(subset) == 0:
+                    continue
+
+                compressed, info = compress_segment(to_csv(subset.select(columns), include_header=False))
+                # [offset, length, crc, size, shift, count]
+                segments[state] = [out.tell(), len(compressed)] + info + [len(subset)]
+                out.write(compressed)
+
+    (out_dir / f"{barrier_type}.json").write_text(json.dumps(index))
+
+
+print("Creating public API CSV for removed dams")
+df = dataset(api_dir / "removed_dams.feather", format="feather").to_table()
+(out_dir / "removed_dams.csv.gz").write_bytes(gzip.compress(to_csv(df), compresslevel=9))
+(out_dir / "removed_dams.json").write_text(json.dumps({"data_version": DATA_VERSION}))
+
+print(f"Done in {time() - start:.2f}s")
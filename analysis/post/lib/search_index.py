@@ -0,0 +1,55 @@
+import numpy as np
+import pyarrow as pa
+
+from api.lib.trigrams import get_trigrams
+
+
+def create_search_index(df):
+    """Create trigram index of search keys for searching barriers by name.
+
+    Parameters
+    ----------
+    df : DataFrame
+        data frame with SARPID, search_key (lowercased, non-empty), in order
+        of priority for search results
+
+    Returns
+    -------
+    (pyarrow.Table, pyarrow.Table)
+        tuple of table of SARPID, search_key, num_trigrams, and length (of
+        search_key) for each row in df and table of trigram and list of rows for each trigram
+    """
+    trigram_ids = {}
+    num_trigrams = np.zeros(len(df), dtype="uint16")
+    ids = []
+    rows = []
+    for row, key in enumerate(df.search_key.values):
+        trigrams = get_trigrams(key)
+        num_trigrams[row] = len(trigrams)
+        ids.extend(trigram_ids.setdefault(trigram, len(trigram_ids)) for trigram in trigrams)
+        rows.extend([row] * len(trigrams))
+
+    ids = np.array(ids, dtype="uint32")
+    rows = np.array(rows, dtype="uint32")
+
+    # sort by trigram; stable sort keeps rows in increasing order
+    ix = np.argsort(ids, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(ids, minlength=len(trigram_ids)))]).astype("int32")
+
+    names = pa.table(
+        {
+            "SARPID": df.SARPID.values,
+            "search_key": df.search_key.values,
+            "num_trigrams": num_trigrams,
+            "length": np.minimum([len(key) for key in df.search_key.values], 65535).astype("uint16"),
+        }
+    )
+
+    trigrams = pa.table(
+        {
+            "trigram": list(trigram_ids.keys()),
+            "rows": pa.ListArray.from_arrays(offsets, rows[ix]),
+        }
+    )
+
+    return names, trigrams
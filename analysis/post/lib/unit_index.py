@@ -0,0 +1,61 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def create_unit_index(df, unit_fields):
+    """Create an index of the ranges of rows of each summary unit in df.
+
+    Rows of a summary unit are contiguous if df is sorted by that unit field
+    (or a nested unit field, e.g., HUC12 for HUC2 - HUC10); otherwise the rows
+    of a summary unit are split into multiple ranges.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        table of records in the same order as the dataset being indexed;
+        must include unit_fields and may include "Ranked"
+    unit_fields : list-like of unit field names
+
+    Returns
+    -------
+    pyarrow.Table
+        Table with layer, id, start, stop for each range of rows, and ranked
+        (count of rows in range where Ranked is True; 0 if not present in df).
+        The number of rows in df is stored in the "num_rows" schema metadata,
+        so that the index can be checked against the dataset it indexes.
+    """
+    num_rows = len(df)
+
+    if "Ranked" in df.column_names:
+        ranked = np.concatenate([[0], np.cumsum(df["Ranked"].to_numpy(zero_copy_only=False).astype("uint32"))])
+    else:
+        ranked = np.zeros(num_rows + 1, dtype="uint32")
+
+    merged = []
+    for layer in unit_fields:
+        values = df[layer]
+        if pa.types.is_dictionary(values.type):
+            values = values.cast(values.type.value_type)
+
+        values = values.to_numpy(zero_copy_only=False)
+
+        # starts of runs of rows with the same value
+        starts = np.concatenate([[0], np.nonzero(values[1:] != values[:-1])[0] + 1]) if num_rows else np.array([])
+        starts = starts.astype("uint32")
+        stops = np.concatenate([starts[1:], [num_rows]]).astype("uint32")
+
+        ranges = pa.table(
+            {
+                "layer": pa.array(np.repeat(layer, len(starts))),
+                "id": pa.array(values[starts]).cast("string"),
+                "start": starts,
+                "stop": stops,
+                "ranked": (ranked[stops] - ranked[starts]).astype("uint32"),
+            }
+        )
+
+        # blank values are not valid unit ids
+        merged.append(ranges.filter(pc.not_equal(ranges["id"], "")))
+
+    return pa.concat_tables(merged).combine_chunks().replace_schema_metadata({"num_rows": str(num_rows)})
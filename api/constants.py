@@ -117,6 +117,20 @@ BOOLEAN_FILTER_FIELDS = ["Removed"]
 # Summary unit fields
 UNIT_FIELDS = ["HUC2", "HUC6", "HUC8", "HUC10", "HUC12", "State", "County", "CongressionalDistrict", "StateWRA"]
 
+# Summary unit fields in barrier datasets used to select barriers by unit ids
+# (County is selected by COUNTYFIPS); see api.dependencies::get_unit_ids
+UNIT_ID_FIELDS = [
+    "HUC2",
+    "HUC6",
+    "HUC8",
+    "HUC10",
+    "HUC12",
+    "State",
+    "COUNTYFIPS",
+    "CongressionalDistrict",
+    "StateWRA",
+]
+
 
 # metric fields that are only valid for barriers with networks
 METRIC_FIELDS = [
@@ -453,6 +467,17 @@ ROAD_CROSSING_FILTER_FIELDS = [
 ]
 ROAD_CROSSING_FILTER_FIELD_MAP = {f.lower(): f for f in ROAD_CROSSING_FILTER_FIELDS}
 
+# fields returned by query endpoint for each barrier type
+# NOTE: BarrierType is used for counting barriers by type after applying filters
+QUERY_FIELDS = {
+    "dams": DAM_FILTER_FIELDS,
+    "small_barriers": SB_FILTER_FIELDS,
+    "combined_barriers": ["BarrierType"] + COMBINED_FILTER_FIELDS,
+    "largefish_barriers": ["BarrierType"] + COMBINED_FILTER_FIELDS,
+    "smallfish_barriers": ["BarrierType"] + COMBINED_FILTER_FIELDS,
+    "road_crossings": ROAD_CROSSING_FILTER_FIELDS,
+}
+
 
 ### Fields used for export
 # common API fields
@@ -1,20 +1,64 @@
+import json
+import threading
+
 import duckdb
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from pyarrow.dataset import dataset
+from pyarrow.feather import read_table
+from pyarrow.fs import LocalFileSystem
 
+from api.constants import MULTIPLE_VALUE_DICT_FIELDS, QUERY_FIELDS, UNIT_ID_FIELDS, NetworkTypes
+from api.lib.details import create_details_index
+from api.lib.memory import prewarm
+from api.lib.tiers import METRICS
+from api.lib.units import create_unit_catalog
 from api.logger import log
-from api.settings import API_DATA_PATH
+from api.settings import API_DATA_PATH, API_PREWARM, DATA_VERSION
+
+# columns used to select and rank records in nearly every request; these are
+# read at startup so that the first requests do not wait to read them from disk
+PREWARM_FIELDS = UNIT_ID_FIELDS + ["id", "HasNetwork", "Ranked", "lon", "lat"] + METRICS
+
+
+def open_dataset(filename):
+    """Open a feather file as a memory-mapped dataset.
+
+    Parameters
+    ----------
+    filename : Path
 
+    Returns
+    -------
+    pyarrow.dataset.Dataset
+    """
+    return dataset(str(filename), format="feather", filesystem=LocalFileSystem(use_mmap=True))
+
+
+# precomputed counts and bounds of summary units, see below
+# {(<barrier_type>, <unit field>): (<counts dataset>, <bounds dataset>), ...}
+unit_counts = {}
+
+# index of rows of summary units within each barrier dataset, see below
+# {<barrier_type>: ({<unit field>: <index table>, ...}, <record batch offsets>), ...}
+unit_indexes = {}
 
 try:
     db = duckdb.connect(str(API_DATA_PATH / "api.db"), read_only=True)
 
-    dams = dataset(API_DATA_PATH / "dams.feather", format="feather")
-    small_barriers = dataset(API_DATA_PATH / "small_barriers.feather", format="feather")
-    combined_barriers = dataset(API_DATA_PATH / "combined_barriers.feather", format="feather")
-    largefish_barriers = dataset(API_DATA_PATH / "largefish_barriers.feather", format="feather")
-    smallfish_barriers = dataset(API_DATA_PATH / "smallfish_barriers.feather", format="feather")
-    road_crossings = dataset(API_DATA_PATH / "road_crossings.feather", format="feather")
-    waterfalls = dataset(API_DATA_PATH / "waterfalls.feather", format="feather")
+    # summary units are small and static, so these are searched in memory
+    unit_catalog = create_unit_catalog(db.sql("SELECT * FROM map_units").to_arrow_table())
+
+    # barrier datasets are uncompressed and memory-mapped so that they are read
+    # directly from the page cache, which is shared by all API and worker processes
+    dams = open_dataset(API_DATA_PATH / "dams.feather")
+    small_barriers = open_dataset(API_DATA_PATH / "small_barriers.feather")
+    combined_barriers = open_dataset(API_DATA_PATH / "combined_barriers.feather")
+    largefish_barriers = open_dataset(API_DATA_PATH / "largefish_barriers.feather")
+    smallfish_barriers = open_dataset(API_DATA_PATH / "smallfish_barriers.feather")
+    road_crossings = open_dataset(API_DATA_PATH / "road_crossings.feather")
+    waterfalls = open_dataset(API_DATA_PATH / "waterfalls.feather")
 
     barrier_datasets = {
         "dams": dams,
@@ -26,9 +70,186 @@ try:
         "waterfalls": waterfalls,
     }
 
+    # dictionaries of multiple value fields used for filtering each barrier dataset
+    # NOTE: these are the same for all record batches in a dataset, so we only
+    # need to read the first record
+    # {<barrier_type>: {<field>: <dictionary>, ...}, ...}
+    dictionaries = {}
+    for barrier_type, ds in barrier_datasets.items():
+        fields = [f for f in MULTIPLE_VALUE_DICT_FIELDS if f in ds.schema.names]
+        first = ds.head(1, columns=fields)
+        dictionaries[barrier_type] = {f: first[f].combine_chunks().dictionary for f in fields}
+
     # removed dams for public API; not used internally
-    removed_dams = dataset(API_DATA_PATH / "removed_dams.feather", format="feather")
+    removed_dams = open_dataset(API_DATA_PATH / "removed_dams.feather")
+
+    if API_PREWARM:
+        for barrier_type in QUERY_FIELDS:
+            prewarm(barrier_datasets[barrier_type], PREWARM_FIELDS + QUERY_FIELDS[barrier_type])
+
+    # precomputed counts of query field combinations and bounds by summary unit
+    # (created in analysis/post/aggregate_networks.py); these are optional and are
+    # only used to answer queries that select summary units without filters
+    unit_counts_dir = API_DATA_PATH / "unit_counts"
+    for barrier_type in QUERY_FIELDS:
+        for layer in UNIT_ID_FIELDS:
+            counts_filename = unit_counts_dir / f"{barrier_type}_{layer}.feather"
+            bounds_filename = unit_counts_dir / f"{barrier_type}_{layer}_bounds.feather"
+            if counts_filename.exists() and bounds_filename.exists():
+                unit_counts[(barrier_type, layer)] = (
+                    dataset(counts_filename, format="feather"),
+                    dataset(bounds_filename, format="feather"),
+                )
+
+    # index of ranges of rows of each summary unit within each barrier dataset
+    # (created in analysis/post/aggregate_networks.py) and the offsets of the record
+    # batches in each dataset, used to read only the record batches that contain
+    # those rows; these are optional
+    for barrier_type in QUERY_FIELDS:
+        index_filename = API_DATA_PATH / f"{barrier_type}_unit_index.feather"
+        if index_filename.exists():
+            # only read the first column to get the size of each record batch
+            reader = pa.ipc.open_file(
+                pa.memory_map(str(API_DATA_PATH / f"{barrier_type}.feather")),
+                options=pa.ipc.IpcReadOptions(included_fields=[0]),
+            )
+            batch_offsets = np.cumsum([0] + [reader.get_batch(i).num_rows for i in range(reader.num_record_batches)])
+            index = read_table(index_filename)
+
+            # rows in the index are positions in the dataset, so the index must
+            # have been created from the same version of the dataset
+            num_rows = (index.schema.metadata or {}).get(b"num_rows", None)
+            if num_rows is None or int(num_rows) != batch_offsets[-1]:
+                log.error(
+                    f"{index_filename} does not match {barrier_type}.feather "
+                    f"({num_rows} rows indexed, {batch_offsets[-1]} rows in dataset); not using index"
+                )
+                continue
+
+            unit_indexes[barrier_type] = (
+                {
+                    layer: index.filter(pc.equal(index["layer"], layer)).drop(["layer"]).combine_chunks()
+                    for layer in UNIT_ID_FIELDS
+                },
+                batch_offsets,
+            )
 
 except Exception as e:
     print("ERROR: not able to load data")
     log.error(e)
+
+
+# trigram index of barrier name search keys (created in analysis/post/aggregate_networks.py);
+# this is optional.  Rows in the posting list of each trigram are the positions
+# of search keys that contain that trigram.
+# NOTE: these are memory-mapped so that they are shared across API processes
+search_index = None
+
+names_filename = API_DATA_PATH / "search_barriers_name.feather"
+trigrams_filename = API_DATA_PATH / "search_barriers_name_trigrams.feather"
+if names_filename.exists() and trigrams_filename.exists():
+    names = pa.ipc.open_file(pa.memory_map(str(names_filename))).read_all()
+    trigrams = pa.ipc.open_file(pa.memory_map(str(trigrams_filename))).read_all()
+    postings = trigrams["rows"].chunk(0)
+
+    search_index = {
+        "SARPID": names["SARPID"].chunk(0),
+        "search_key": names["search_key"].chunk(0),
+        "num_trigrams": names["num_trigrams"].chunk(0).to_numpy(),
+        "length": names["length"].chunk(0).to_numpy(),
+        "trigrams": {trigram: i for i, trigram in enumerate(trigrams["trigram"].to_pylist())},
+        "offsets": postings.offsets.to_numpy(),
+        "rows": postings.values.to_numpy(),
+    }
+
+
+# key fields of records for barrier details of each network type and road
+# crossings; waterfalls have one record per network type
+# {<table>: [<field>, ...], ...}
+DETAILS_KEY_FIELDS = {
+    **{network_type.value: ["SARPID"] for network_type in NetworkTypes},
+    "road_crossings": ["SARPID"],
+    "waterfalls": ["SARPID", "network_type"],
+}
+
+# index of rows of each record by key for barrier details, created on first use
+# because it takes several seconds per table
+# {<table>: <index> or None, ...}
+_details_indexes = {}
+_details_indexes_lock = threading.Lock()
+
+
+def get_details_index(table):
+    """Get the index of rows of each record in table for barrier details,
+    creating it on first use.
+
+    This is called from threads of the shared executor.
+
+    Parameters
+    ----------
+    table : str
+        one of DETAILS_KEY_FIELDS
+
+    Returns
+    -------
+    dict or None
+        index from create_details_index(), or None if there is no data for table
+    """
+    if table not in _details_indexes:
+        with _details_indexes_lock:
+            # another thread may have created the index while waiting for the lock
+            if table not in _details_indexes:
+                filename = API_DATA_PATH / f"{table}.feather"
+                _details_indexes[table] = (
+                    create_details_index(filename, DETAILS_KEY_FIELDS[table]) if filename.exists() else None
+                )
+
+    return _details_indexes[table]
+
+
+def read_public_csv_index(filename):
+    """Read the index of pre-compressed CSV files for the public API, if it
+    was created for the current data version.
+
+    Parameters
+    ----------
+    filename : Path
+
+    Returns
+    -------
+    dict or None
+        None if the index was created for a different data version
+    """
+    index = json.loads(filename.read_text())
+    if index.get("data_version", None) != DATA_VERSION:
+        log.error(
+            f"{filename} was created for data version {index.get('data_version', None)}, "
+            f"not {DATA_VERSION}; not using pre-compressed CSV"
+        )
+        return None
+
+    return index
+
+
+# pre-compressed CSV segments for the public API (created in
+# analysis/post/create_public_api_csv.py); these are optional and are only
+# used if they were created for the current data version.
+# NOTE: these are memory-mapped so that they are shared across API processes
+# {<barrier_type>: {"content": <buffer>, "index": <index>}, "removed_dams": {"content": <buffer>}}
+public_csv = {}
+
+public_dir = API_DATA_PATH / "public"
+for barrier_type in ["dams", "barriers"]:
+    content_filename = public_dir / f"{barrier_type}.segments"
+    index_filename = public_dir / f"{barrier_type}.json"
+    if content_filename.exists() and index_filename.exists():
+        index = read_public_csv_index(index_filename)
+        if index is not None:
+            public_csv[barrier_type] = {
+                "content": pa.memory_map(str(content_filename)).read_buffer(),
+                "index": index,
+            }
+
+if (public_dir / "removed_dams.csv.gz").exists() and (public_dir / "removed_dams.json").exists():
+    if read_public_csv_index(public_dir / "removed_dams.json") is not None:
+        public_csv["removed_dams"] = {"content": pa.memory_map(str(public_dir / "removed_dams.csv.gz")).read_buffer()}
@@ -1,6 +1,10 @@
+import asyncio
+
+import arq
 from fastapi import HTTPException, status
 from fastapi.requests import Request
 import pyarrow as pa
+from redis.asyncio import ConnectionPool
 
 from api.constants import (
     DAM_FILTER_FIELD_MAP,
@@ -9,8 +13,11 @@ from api.constants import (
     ROAD_CROSSING_FILTER_FIELD_MAP,
     MULTIPLE_VALUE_DICT_FIELDS,
     BOOLEAN_FILTER_FIELDS,
+    UNIT_ID_FIELDS,
     FullySupportedBarrierTypes,
 )
+from api.logger import log
+from api.settings import REDIS, REDIS_HEALTH_CHECK_INTERVAL
 
 
 def get_unit_ids(
@@ -101,17 +108,7 @@ def get_filter_params(
     field_map = {}
 
     # units specifically handled for extracting ids in above function
-    prefiltered_units = {
-        "HUC2",
-        "HUC6",
-        "HUC8",
-        "HUC10",
-        "HUC12",
-        "State",
-        "COUNTYFIPS",
-        "CongressionalDistrict",
-        "StateWRA",
-    }
+    prefiltered_units = set(UNIT_ID_FIELDS)
 
     match barrier_type:
         case "dams":
@@ -164,3 +161,114 @@ def get_filter_params(
                 )
 
     return filters
+
+
+# prevents concurrent requests from each creating a pool if it was not created
+# when the app started
+_redis_lock = asyncio.Lock()
+
+
+class TrackedConnectionPool(ConnectionPool):
+    """Redis connection pool that counts connections that are created, checked
+    out, and released, so that its usage can be reported."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.num_connections = 0
+        self.num_in_use = 0
+        self.num_checkouts = 0
+
+    def reset(self):
+        super().reset()
+        self.num_connections = 0
+        self.num_in_use = 0
+
+    def make_connection(self):
+        connection = super().make_connection()
+        self.num_connections += 1
+        return connection
+
+    def get_available_connection(self):
+        # this is called by get_connection(), which releases the connection if
+        # it cannot connect
+        connection = super().get_available_connection()
+        self.num_in_use += 1
+        self.num_checkouts += 1
+        return connection
+
+    async def release(self, connection):
+        try:
+            await super().release(connection)
+        finally:
+            self.num_in_use -= 1
+
+    def get_metrics(self):
+        """Get usage of connections in this pool.
+
+        Returns
+        -------
+        dict
+            {"in_use": <int>, "idle": <int>, "max_connections": <int>, "checkouts": <int>}
+        """
+        return {
+            "in_use": self.num_in_use,
+            "idle": self.num_connections - self.num_in_use,
+            "max_connections": self.max_connections,
+            "checkouts": self.num_checkouts,
+        }
+
+
+async def create_redis_pool():
+    """Create Redis connection pool shared across requests.
+
+    Returns
+    -------
+    arq.connections.ArqRedis
+    """
+    redis = await arq.create_pool(REDIS)
+
+    # health check interval is not supported by RedisSettings; replace the pool
+    # created by create_pool with one that creates connections with health
+    # checks and tracks its usage, and release the connection used to connect
+    pool = redis.connection_pool
+    redis.connection_pool = TrackedConnectionPool(
+        connection_class=pool.connection_class,
+        max_connections=pool.max_connections,
+        **{**pool.connection_kwargs, "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL},
+    )
+    await pool.disconnect()
+
+    return redis
+
+
+async def get_redis(request: Request):
+    """Get the shared Redis connection pool, which is created in the app's
+    lifespan.  If Redis was not available when the app started, this attempts
+    to create the pool again.
+
+    Parameters
+    ----------
+    request : fastapi.requests.Request
+
+    Returns
+    -------
+    arq.connections.ArqRedis
+    """
+    redis = getattr(request.app.state, "redis", None)
+    if redis is not None:
+        return redis
+
+    async with _redis_lock:
+        # another request may have created the pool while waiting for the lock
+        redis = getattr(request.app.state, "redis", None)
+        if redis is not None:
+            return redis
+
+        try:
+            redis = await create_redis_pool()
+            request.app.state.redis = redis
+            return redis
+
+        except Exception as ex:
+            log.error(f"Error connecting to Redis, is Redis offline?  {ex}")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error")
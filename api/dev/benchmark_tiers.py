@@ -0,0 +1,51 @@
+"""Benchmark calculating tiers for selections of different sizes.
+
+This uses randomly generated values for each metric, with a similar number
+of unique values per metric as the barrier datasets.
+
+Run from the root of this repository:
+python -m api.dev.benchmark_tiers
+"""
+
+from time import perf_counter
+
+import numpy as np
+import pyarrow as pa
+
+from api.lib.tiers import calculate_tiers, METRICS
+
+
+SIZES = [10_000, 100_000, 1_000_000]
+REPEATS = 5
+CLASS_METRICS = {"Landcover", "SizeClasses", "PerennialSizeClasses", "MainstemSizeClasses"}
+
+
+def generate_metrics(size, seed=0):
+    rng = np.random.default_rng(seed)
+
+    columns = {}
+    for field in METRICS:
+        if field in CLASS_METRICS:
+            columns[field] = rng.integers(0, 7, size).astype("uint8")
+        elif field.startswith("Percent"):
+            columns[field] = rng.integers(0, 101, size).astype("float32")
+        else:
+            # miles are heavily skewed toward small values
+            columns[field] = np.round(rng.exponential(5, size), 2).astype("float32")
+
+    return pa.table(columns)
+
+
+if __name__ == "__main__":
+    print(f"{'records':>10}  {'min (ms)':>10}  {'median (ms)':>12}")
+
+    for size in SIZES:
+        df = generate_metrics(size)
+
+        elapsed = []
+        for _ in range(REPEATS):
+            start = perf_counter()
+            calculate_tiers(df)
+            elapsed.append((perf_counter() - start) * 1000)
+
+        print(f"{size:>10,}  {np.min(elapsed):>10.1f}  {np.median(elapsed):>12.1f}")
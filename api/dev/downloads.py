@@ -4,7 +4,7 @@ from fastapi import APIRouter
 from fastapi.requests import Request
 from fastapi.responses import FileResponse
 from api.logger import log_request
-from api.settings import API_DATA_PATH, CUSTOM_DOWNLOAD_DIR
+from api.settings import CUSTOM_DOWNLOAD_DIR, NATIONAL_DOWNLOAD_DIR
 
 
 router = APIRouter()
@@ -12,7 +12,7 @@ router = APIRouter()
 
 @router.get("/downloads/national/{filename}")
 async def get_national_csv_zip(request: Request, filename: str):
-    """Return pre-created zipped CSV downloads created in aggregate_networks.py
+    """Return pre-created zipped CSV downloads created in create_national_downloads.py
 
     IMPORTANT: this is only used for local development; on servers this is
     handled via caddy reverse proxy
@@ -21,7 +21,7 @@ async def get_national_csv_zip(request: Request, filename: str):
     """
     log_request(request)
 
-    path = API_DATA_PATH / "downloads" / filename
+    path = NATIONAL_DOWNLOAD_DIR / filename
 
     return FileResponse(path, media_type="application/zip", filename=filename)
 
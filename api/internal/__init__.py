@@ -8,6 +8,7 @@ from api.internal.barriers.search import router as barrier_search_router
 from api.internal.map_units.details import router as map_unit_details_router
 from api.internal.map_units.list import router as map_unit_list_router
 from api.internal.map_units.search import router as map_unit_search_router
+from api.internal.status import router as status_router
 
 router = APIRouter()
 
@@ -20,5 +21,7 @@ router.include_router(map_unit_details_router)
 router.include_router(map_unit_list_router)
 router.include_router(map_unit_search_router)
 
+router.include_router(status_router)
+
 # this must come last due to variable path
 router.include_router(barrier_download_router)
@@ -1,16 +1,37 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
-import pyarrow.compute as pc
+from fastapi.responses import Response
 
 from api.constants import NetworkTypes
-from api.data import db, waterfalls
+from api.data import get_details_index
+from api.lib.details import get_cached_details, read_details, set_cached_details
+from api.lib.executor import run_in_executor
 from api.logger import log_request
 
 
 router = APIRouter()
 
 
+def get_details(table, key):
+    """Read a record by its key from table and serialize it to JSON.
+
+    Parameters
+    ----------
+    table : str
+    key : tuple
+
+    Returns
+    -------
+    bytes or None
+        None if record is not found
+    """
+    index = get_details_index(table)
+    if index is None:
+        return None
+
+    return read_details(index, key)
+
+
 @router.get("/{network_type}/details/{sarp_id}")
 async def details(
     request: Request,
@@ -22,24 +43,23 @@ async def details(
     network_type = network_type.value
 
     if sarp_id.startswith("f"):
-        # waterfalls use pyarrow search because we store one record per network type
-        # and can't store them in the barrier search index
-        dataset = waterfalls
-        filter = pc.field("SARPID") == sarp_id
-        filter = filter & (pc.field("network_type") == network_type)
-        record = dataset.to_table(filter=filter).slice(0)
+        # waterfalls store one record per network type
+        table = "waterfalls"
+        key = (sarp_id, network_type)
 
     else:
-        if sarp_id.startswith("cr"):
-            table = "road_crossings"
-        else:
-            table = network_type
+        table = "road_crossings" if sarp_id.startswith("cr") else network_type
+        key = (sarp_id,)
+
+    content = get_cached_details(table, key)
+
+    if content is None:
+        content = await run_in_executor("details", get_details, table, key)
 
-        record = db.sql(f"SELECT * FROM {table} WHERE SARPID=? LIMIT 1", params=(sarp_id,)).to_arrow_table()
+        if content is not None:
+            set_cached_details(table, key, content)
 
-    if not len(record):
+    if content is None:
         raise HTTPException(404, detail=f"record not found for SARPID: {sarp_id}")
 
-    # use the bulk converter to dict (otherwise float32 serialization issues)
-    # and return singular first item
-    return JSONResponse(content=record.rename_columns([c.lower() for c in record.schema.names]).to_pylist()[0])
+    return Response(content=content, media_type="application/json")
@@ -1,17 +1,13 @@
-from datetime import datetime
-from io import BytesIO
+import asyncio
+import json
 import os
-from pathlib import Path
-from time import time
-import tempfile
-from zipfile import ZipFile, ZIP_DEFLATED
 
-import arq
+from arq.connections import ArqRedis
+from arq.constants import job_key_prefix, result_key_prefix
 from arq.jobs import Job, JobStatus
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
-from pyarrow.csv import write_csv
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from api.constants import (
     FullySupportedBarrierTypes,
@@ -24,13 +20,28 @@ from api.constants import (
     ROAD_CROSSING_EXPORT_FIELDS,
 )
 from api.logger import log, log_request
-from api.dependencies import get_unit_ids, get_filter_params
-from api.lib.download import extract_for_download
+from api.dependencies import get_unit_ids, get_filter_params, get_redis
+from api.lib.archive import write_download_zip
+from api.lib.download import (
+    extract_for_download,
+    get_download_id,
+    get_download_path,
+)
+from api.lib.executor import run_in_executor
 from api.lib.extract import get_record_count
-from api.lib.progress import get_progress, set_progress
+from api.lib.profiling import span
+from api.lib.progress import get_job_status, set_progress
 from api.metadata import get_readme, get_terms
-from api.settings import MAX_IMMEDIATE_DOWNLOAD_RECORDS, CUSTOM_DOWNLOAD_DIR, REDIS, REDIS_QUEUE, LOGO_PATH
+from api.settings import MAX_IMMEDIATE_DOWNLOAD_RECORDS, REDIS_QUEUE
+
 
+# seconds between checking status of job while streaming status
+STATUS_STREAM_MIN_INTERVAL = 0.5
+STATUS_STREAM_MAX_INTERVAL = 4
+
+JOB_NOT_FOUND_MESSAGE = (
+    "Job not found; it may have been cancelled, timed out, or the server restarted.  Please try again."
+)
 
 router = APIRouter()
 
@@ -45,6 +56,7 @@ async def download(
     custom_rank: bool = False,
     include_unranked: bool = False,
     sort: Scenarios = Scenarios.NCWC,
+    redis: ArqRedis = Depends(get_redis),
 ):
     """Download subset of barrier_type data.
 
@@ -71,7 +83,21 @@ async def download(
     else:
         ranked_only = not include_unranked
 
-    count = get_record_count(barrier_type, unit_ids=unit_ids, filters=filters, ranked_only=ranked_only)
+    download_id = get_download_id(barrier_type, unit_ids, filters, format, custom_rank, ranked_only, sort)
+    path = get_download_path(download_id, barrier_type.value)
+
+    # reuse output of an identical download if it has not yet been cleaned up
+    if path.exists():
+        log.info(f"returning existing download for {barrier_type.replace('_', ' ')}")
+
+        # extend retention of existing download
+        os.utime(path.parent)
+
+        return JSONResponse(content={"status": "success", "path": f"/downloads/custom/{download_id}/{path.name}"})
+
+    count = await run_in_executor(
+        "download", get_record_count, barrier_type, unit_ids=unit_ids, filters=filters, ranked_only=ranked_only
+    )
     download_message = f"selected {count:,} {barrier_type.replace('_', ' ')}"
 
     # always download road crossings in background task to avoid counting
@@ -80,28 +106,25 @@ async def download(
 
         # create custom download task and do this in the background
         try:
-            redis = await arq.create_pool(REDIS)
-            job = await redis.enqueue_job(
-                "custom_download_task",
-                barrier_type=barrier_type,
-                format=format,
-                unit_ids=unit_ids,
-                filters=filters,
-                custom_rank=custom_rank,
-                ranked_only=ranked_only,
-                sort=sort,
-                _queue_name=REDIS_QUEUE,
-            )
-
-            return JSONResponse(content={"job": job.job_id})
+            with span("redis"):
+                await enqueue_download_job(
+                    redis,
+                    download_id,
+                    barrier_type=barrier_type,
+                    format=format,
+                    unit_ids=unit_ids,
+                    filters=filters,
+                    custom_rank=custom_rank,
+                    ranked_only=ranked_only,
+                    sort=sort,
+                )
+
+            return JSONResponse(content={"job": download_id})
 
         except Exception as ex:
             log.error(f"Error creating background task, is Redis offline?  {ex}")
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error")
 
-        finally:
-            await redis.aclose()
-
     log.info(f"{download_message} for immediate download")
 
     barrier_type = barrier_type.value
@@ -123,7 +146,9 @@ async def download(
 
     columns = [c for c in columns if c not in CUSTOM_TIER_FIELDS]
 
-    df = extract_for_download(
+    schema, batches = await run_in_executor(
+        "download",
+        extract_for_download,
         barrier_type,
         unit_ids=unit_ids,
         filters=filters,
@@ -133,17 +158,13 @@ async def download(
         sort=sort,
     )
 
-    tmp_dir = Path(tempfile.mkdtemp(dir=CUSTOM_DOWNLOAD_DIR))
-    # grant permissions to Caddy to read from this directory; the default is too restrictive
-    os.chmod(tmp_dir, 0o755)
-
     filename = f"road_stream_crossings.{format}" if barrier_type == "road_crossings" else f"{barrier_type}.{format}"
 
     ### Get metadata
     readme = get_readme(
         filename=filename,
         barrier_type=barrier_type,
-        fields=df.column_names,
+        fields=schema.names,
         unit_ids=unit_ids,
         warnings=warnings,
     )
@@ -151,22 +172,41 @@ async def download(
 
     # other types will be rejected above
     if format == "csv":
-        with open(tmp_dir / f"{barrier_type}.zip", "wb") as out:
-            with ZipFile(out, "w", compression=ZIP_DEFLATED, compresslevel=5) as zf:
-                csv_stream = BytesIO()
-                write_csv(df, csv_stream)
+        await run_in_executor(
+            "download", write_download_zip, path, filename, schema, batches, readme=readme, terms=terms
+        )
 
-                # release memory
-                del df
+        return JSONResponse(content={"status": "success", "path": f"/downloads/custom/{download_id}/{path.name}"})
 
-                zf.writestr(filename, csv_stream.getvalue())
-                zf.writestr("README.txt", readme)
-                zf.writestr("TERMS_OF_USE.txt", terms)
-                zf.write(LOGO_PATH, LOGO_PATH.name)
 
-        return JSONResponse(
-            content={"status": "success", "path": f"/downloads/custom/{tmp_dir.name}/{barrier_type}.zip"}
-        )
+async def enqueue_download_job(redis, download_id, **kwargs):
+    """Enqueue a background download job, using the download id as the job id
+    so that identical download requests attach to the same job.
+
+    arq does not enqueue a job if a job with the same id is already queued, in
+    progress, or has a result.  Results are retained longer than download files,
+    and jobs may be dropped from the queue when the worker restarts, so those
+    jobs are removed and enqueued again.
+
+    Parameters
+    ----------
+    redis : ArqRedis
+    download_id : str
+        id from get_download_id()
+    **kwargs
+        parameters passed to custom_download_task()
+    """
+    job = await redis.enqueue_job("custom_download_task", _job_id=download_id, _queue_name=REDIS_QUEUE, **kwargs)
+    if job is not None:
+        return
+
+    job_status = await Job(download_id, redis=redis, _queue_name=REDIS_QUEUE).status()
+    if job_status in {JobStatus.queued, JobStatus.deferred, JobStatus.in_progress}:
+        log.info(f"attaching to existing download job {download_id}")
+        return
+
+    await redis.delete(job_key_prefix + download_id, result_key_prefix + download_id)
+    await redis.enqueue_job("custom_download_task", _job_id=download_id, _queue_name=REDIS_QUEUE, **kwargs)
 
 
 async def custom_download_task(
@@ -179,12 +219,21 @@ async def custom_download_task(
     ranked_only: bool,
     sort: Scenarios,
 ):
-    await set_progress(ctx["redis"], ctx["job_id"], "0", "Extracting data")
-
     barrier_type = barrier_type.value
     format = format.value
     sort = sort.value
 
+    # job id is the download id
+    download_id = ctx["job_id"]
+    path = get_download_path(download_id, barrier_type)
+
+    # identical download may have been completed by another job
+    if path.exists():
+        os.utime(path.parent)
+        return f"{download_id}/{path.name}"
+
+    await set_progress(ctx["redis"], ctx["job_id"], "0", "Extracting data")
+
     columns = ["id"]
     warnings = None
     match barrier_type:
@@ -200,7 +249,7 @@ async def custom_download_task(
 
     columns = [c for c in columns if c not in CUSTOM_TIER_FIELDS]
 
-    df = extract_for_download(
+    schema, batches = extract_for_download(
         barrier_type,
         unit_ids=unit_ids,
         filters=filters,
@@ -212,17 +261,13 @@ async def custom_download_task(
 
     await set_progress(ctx["redis"], ctx["job_id"], "50", "Creating zip file")
 
-    tmp_dir = Path(tempfile.mkdtemp(dir=CUSTOM_DOWNLOAD_DIR))
-    # grant permissions to Caddy to read from this directory; the default is too restrictive
-    os.chmod(tmp_dir, 0o755)
-
     filename = f"road_stream_crossings.{format}" if barrier_type == "road_crossings" else f"{barrier_type}.{format}"
 
     ### Get metadata
     readme = get_readme(
         filename=filename,
         barrier_type=barrier_type,
-        fields=df.column_names,
+        fields=schema.names,
         unit_ids=unit_ids,
         warnings=warnings,
     )
@@ -230,33 +275,17 @@ async def custom_download_task(
 
     # other types will be rejected before calling into this
     if format == "csv":
-        with open(tmp_dir / f"{barrier_type}.zip", "wb") as out:
-            with ZipFile(out, "w", compression=ZIP_DEFLATED, compresslevel=5) as zf:
-                csv_stream = BytesIO()
-                write_csv(df, csv_stream)
-
-                del df
-
-                zf.writestr(filename, csv_stream.getvalue())
-                zf.writestr("README.txt", readme)
-                zf.writestr("TERMS_OF_USE.txt", terms)
-                zf.write(LOGO_PATH, LOGO_PATH.name)
+        write_download_zip(path, filename, schema, batches, readme=readme, terms=terms)
 
     await set_progress(ctx["redis"], ctx["job_id"], "100", "All done")
 
-    return f"{tmp_dir.name}/{barrier_type}.zip"
+    return f"{download_id}/{path.name}"
 
 
 @router.get("/downloads/status/{job_id}")
-async def get_download_job_status(job_id: str):
+async def get_download_job_status(job_id: str, redis: ArqRedis = Depends(get_redis)):
     """Return the status of a download job.
 
-    Job status values derived from JobStatus enum at:
-    https://github.com/samuelcolvin/arq/blob/master/arq/jobs.py
-    ['deferred', 'queued', 'in_progress', 'complete', 'not_found']
-
-    We add ['success', 'failed'] status values here.
-
     Parameters
     ----------
     job_id : str
@@ -264,96 +293,70 @@ async def get_download_job_status(job_id: str):
     Returns
     -------
     JSON
-        {"status": "...", "progress": 0-100, "result": "...only if complete...", "detail": "...only if failed..."}
+        {"status": "...", "progress": 0-100, "path": "...only if success...", "detail": "...only if failed..."}
     """
 
-    # loop until return or hit number of retries in case of redis timeout
-    retry = 0
-    while retry <= 5:
-        redis = None
+    with span("redis"):
+        job_status = await get_job_status(redis, job_id)
 
-        try:
-            redis = await arq.create_pool(REDIS)
+    if job_status["status"] == JobStatus.not_found:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=JOB_NOT_FOUND_MESSAGE)
 
-            job = Job(job_id, redis=redis, _queue_name=REDIS_QUEUE)
-            job_status = await job.status()
+    if job_status["status"] == "failed":
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=job_status["detail"])
 
-            if job_status == JobStatus.not_found:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Job not found; it may have been cancelled, timed out, or the server restarted.  Please try again.",
-                )
+    return JSONResponse(content=job_status)
 
-            # TODO: proof by turning off redis
-            if job_status == JobStatus.queued:
-                job_info = await job.info()
-                elapsed_time = datetime.now(tz=job_info.enqueue_time.tzinfo) - job_info.enqueue_time
-
-                queued = [
-                    j[0]
-                    for j in sorted(
-                        [(job.job_id, job.enqueue_time) for job in await redis.queued_jobs(queue_name=REDIS_QUEUE)],
-                        key=lambda x: x[1],
-                    )
-                ]
-
-                return JSONResponse(
-                    content={
-                        "status": job_status,
-                        "progress": 0,
-                        "queue_position": queued.index(job_id),
-                        "elapsed_time": elapsed_time.seconds,
-                    }
-                )
 
-            if job_status != JobStatus.complete:
-                progress, message = await get_progress(redis, job_id)
+@router.get("/downloads/status/{job_id}/stream")
+async def stream_download_job_status(request: Request, job_id: str, redis: ArqRedis = Depends(get_redis)):
+    """Stream the status of a download job as server-sent events.
 
-                return JSONResponse(
-                    content={
-                        "status": job_status,
-                        "progress": progress,
-                        "message": message,
-                    }
-                )
+    An event is sent whenever the status changes; the job is checked less
+    frequently (up to every STATUS_STREAM_MAX_INTERVAL seconds) while the
+    status does not change.  The stream ends after the job succeeds, fails,
+    or is not found.
 
-            info = await job.result_info()
-
-            try:
-                # this re-raises the underlying exception raised in the worker
-                zip_filename = await job.result()
-
-                if info.success:
-                    return JSONResponse(
-                        content={
-                            "status": "success",
-                            "path": f"/downloads/custom/{zip_filename}",
-                        }
-                    )
-
-            # raise timeout to outer retry loop
-            except TimeoutError as ex:
-                raise ex
-
-            except Exception as ex:
-                log.error(ex)
-                message = "Internal server error"
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Internal server error",
-                )
+    Parameters
+    ----------
+    request : Request
+    job_id : str
+
+    Returns
+    -------
+    StreamingResponse
+        text/event-stream of JSON status messages (see get_download_job_status())
+    """
+
+    async def events():
+        interval = STATUS_STREAM_MIN_INTERVAL
+        prev = None
+
+        while not await request.is_disconnected():
+            job_status = await get_job_status(redis, job_id)
 
-            return JSONResponse(content={"status": "failed", "detail": message})
+            if job_status["status"] == JobStatus.not_found:
+                job_status = {"status": "failed", "detail": JOB_NOT_FOUND_MESSAGE}
 
-        # in case we hit a Redis timeout while polling job status, make sure we don't break until connection cannot be re-established
-        except TimeoutError as ex:
-            retry += 1
-            log.error(f"Redis connection timeout, retry {retry}")
-            time.sleep(1)
+            # elapsed time increases while queued and is not a change in status
+            current = {k: v for k, v in job_status.items() if k != "elapsed_time"}
+            if current != prev:
+                yield f"data: {json.dumps(job_status)}\n\n"
+                interval = STATUS_STREAM_MIN_INTERVAL
+                prev = current
 
-            if retry >= 5:
-                raise ex
+            else:
+                # send comment to keep connection open
+                yield ": ping\n\n"
+                interval = min(interval * 2, STATUS_STREAM_MAX_INTERVAL)
 
-        finally:
-            if redis is not None:
-                await redis.aclose()
+            if job_status["status"] in {"success", "failed"}:
+                return
+
+            await asyncio.sleep(interval)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
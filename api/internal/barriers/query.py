@@ -3,18 +3,14 @@ from fastapi.requests import Request
 import pyarrow as pa
 import pyarrow.compute as pc
 
-from api.constants import (
-    FullySupportedBarrierTypes,
-    DAM_FILTER_FIELDS,
-    SB_FILTER_FIELDS,
-    COMBINED_FILTER_FIELDS,
-    ROAD_CROSSING_FILTER_FIELDS,
-)
+from api.constants import FullySupportedBarrierTypes, QUERY_FIELDS
 
 from api.dependencies import get_unit_ids, get_filter_params
-from api.lib.extract import extract_records
+from api.lib.cache import get_cache_key, get_cached_response, set_cached_response
+from api.lib.executor import run_in_executor
+from api.lib.extract import extract_records, get_unit_counts
 from api.logger import log, log_request
-from api.response import feather_response
+from api.response import buffer_response, to_feather_buffer
 
 
 router = APIRouter()
@@ -46,40 +42,68 @@ async def query(
 
     barrier_type = barrier_type.value
 
-    filter_fields = None
-    match barrier_type:
-        case "dams":
-            filter_fields = DAM_FILTER_FIELDS
-        case "small_barriers":
-            filter_fields = SB_FILTER_FIELDS
-        case "combined_barriers" | "largefish_barriers" | "smallfish_barriers":
-            # NOTE: BarrierType is used for counting barriers by type after
-            # applying filters
-            filter_fields = ["BarrierType"] + COMBINED_FILTER_FIELDS
-        case "road_crossings":
-            filter_fields = ROAD_CROSSING_FILTER_FIELDS
-
-        case _:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, detail=f"query is not supported for {barrier_type}"
-            )
-
-    # always extract ranked barriers unless type is road_crossings (not applicable)
-    df = extract_records(
-        barrier_type,
-        unit_ids=unit_ids,
-        filters=filters,
-        columns=["id", "lon", "lat"] + filter_fields,
-        ranked_only=barrier_type != "road_crossings",
-    )
+    cache_key = get_cache_key("query", barrier_type, unit_ids, filters)
+    content = await get_cached_response(cache_key)
+    if content is not None:
+        log.info(f"returning cached query results for {barrier_type.replace('_', ' ')}")
+        return buffer_response(content, request=request)
+
+    if barrier_type not in QUERY_FIELDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"query is not supported for {barrier_type}"
+        )
+
+    content = await run_in_executor("query", query_barriers, barrier_type, unit_ids, filters)
+    await set_cached_response(cache_key, content)
+
+    return buffer_response(content, request=request)
+
+
+def query_barriers(barrier_type, unit_ids, filters):
+    """Count barriers that meet the filters by each unique combination of
+    values of the query fields for barrier_type.
+
+    Parameters
+    ----------
+    barrier_type : str
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+
+    Returns
+    -------
+    pyarrow Buffer
+        feather (Arrow IPC) of query fields and _count, with bounds in metadata
+    """
+    filter_fields = QUERY_FIELDS[barrier_type]
+
+    # use precomputed counts if only selecting summary units
+    precomputed = get_unit_counts(barrier_type, unit_ids=unit_ids, filters=filters, query_fields=filter_fields)
+
+    if precomputed is not None:
+        counts, bounds = precomputed
+        count = pc.sum(counts["id_count"]).as_py() or 0
+
+    else:
+        # always extract ranked barriers unless type is road_crossings (not applicable)
+        df = extract_records(
+            barrier_type,
+            unit_ids=unit_ids,
+            filters=filters,
+            columns=["id", "lon", "lat"] + filter_fields,
+            ranked_only=barrier_type != "road_crossings",
+        )
+        count = len(df)
+
+        # extract extent
+        xmin, xmax = pc.min_max(df["lon"]).as_py().values()
+        ymin, ymax = pc.min_max(df["lat"]).as_py().values()
+        bounds = [xmin, ymin, xmax, ymax]
 
-    # extract extent
-    xmin, xmax = pc.min_max(df["lon"]).as_py().values()
-    ymin, ymax = pc.min_max(df["lat"]).as_py().values()
-    bounds = [xmin, ymin, xmax, ymax]
+        # group by filter fields
+        counts = df.group_by(filter_fields).aggregate([("id", "count")])
 
-    # group by filter fields
-    counts = df.group_by(filter_fields).aggregate([("id", "count")])
     schema = counts.schema
     # cast count to uint32
     fields = [pa.field("id_count", "uint32") if c == "id_count" else schema.field(c) for c in schema.names]
@@ -88,7 +112,7 @@ async def query(
     counts = counts.rename_columns(["_count" if c == "id_count" else c for c in counts.column_names])
 
     log.info(
-        f"query selected {len(df):,} {barrier_type.replace('_', ' ')} ({len(counts):,} unique combinations of fields)"
+        f"query selected {count:,} {barrier_type.replace('_', ' ')} ({len(counts):,} unique combinations of fields)"
     )
 
-    return feather_response(counts, bounds)
+    return to_feather_buffer(counts, bounds)
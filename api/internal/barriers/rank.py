@@ -7,9 +7,11 @@ from api.lib.compression import pack_bits
 from api.lib.tiers import calculate_tiers, METRICS
 from api.constants import RankedBarrierTypes
 from api.dependencies import get_unit_ids, get_filter_params
+from api.lib.cache import get_cache_key, get_cached_response, set_cached_response
+from api.lib.executor import run_in_executor
 from api.lib.extract import extract_records
 from api.logger import log, log_request
-from api.response import feather_response
+from api.response import buffer_response, to_feather_buffer
 
 
 router = APIRouter()
@@ -42,6 +44,34 @@ async def rank(
 
     barrier_type = barrier_type.value
 
+    cache_key = get_cache_key("rank", barrier_type, unit_ids, filters)
+    content = await get_cached_response(cache_key)
+    if content is not None:
+        log.info(f"returning cached rank results for {barrier_type.replace('_', ' ')}")
+        return buffer_response(content, request=request)
+
+    content = await run_in_executor("rank", rank_barriers, barrier_type, unit_ids, filters)
+    await set_cached_response(cache_key, content)
+
+    return buffer_response(content, request=request)
+
+
+def rank_barriers(barrier_type, unit_ids, filters):
+    """Calculate tiers for ranked barriers that meet the filters.
+
+    Parameters
+    ----------
+    barrier_type : str
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+
+    Returns
+    -------
+    pyarrow Buffer
+        feather (Arrow IPC) of id and packed tiers, with bounds in metadata
+    """
     df = extract_records(
         barrier_type, unit_ids=unit_ids, filters=filters, columns=["id", "lat", "lon"] + METRICS, ranked_only=True
     )
@@ -74,4 +104,4 @@ async def rank(
         }
     )
 
-    return feather_response(tiers, bounds=bounds)
+    return to_feather_buffer(tiers, bounds=bounds)
@@ -1,14 +1,16 @@
-from io import BytesIO
 import re
 from time import time
 
-from fastapi import APIRouter, Response
+from fastapi import APIRouter
 from fastapi.requests import Request
-from pyarrow.feather import write_feather
+import pyarrow as pa
+import pyarrow.compute as pc
 
 from api.constants import BARRIER_SEARCH_RESULT_FIELDS
 from api.data import db
+from api.lib.search import search_names
 from api.logger import log_request, log
+from api.response import arrow_response
 
 
 router = APIRouter()
@@ -32,6 +34,7 @@ async def search(request: Request, query: str):
 
     query = query.strip()
     total = 0
+    start = time()
 
     col_expr = ", ".join([f"search_barriers.{col} AS {col.lower()}" for col in BARRIER_SEARCH_RESULT_FIELDS])
 
@@ -55,10 +58,23 @@ async def search(request: Request, query: str):
         # discard pandas metadata and store total count
         matches = matches.replace_schema_metadata({"count": str(total)})
 
+    elif (results := search_names(query, NUM_BARRIER_SEARCH_RESULTS)) is not None:
+        # use trigram index of search keys
+        total, sarpids = results
+
+        matches = db.sql(
+            f"SELECT {col_expr} FROM search_barriers WHERE SARPID IN ({', '.join(['?'] * len(sarpids)) or 'NULL'})",
+            params=sarpids,
+        ).to_arrow_table()
+
+        # restore order of matches
+        matches = matches.take(pc.index_in(pa.array(sarpids, type="string"), matches["sarpid"]))
+
+        log.info(f"query by name using index: {time() - start}s")
+
     else:
         # use a simple like query for faster performance, and Jaccard similarity
         # NOTE: we use the row_number() to preserve the row order through the join
-        start = time()
         total = db.sql(
             "SELECT count(*) FROM search_barriers_name WHERE search_key LIKE ?",
             params=(f"%{query.replace(' ', '%')}%",),
@@ -98,10 +114,4 @@ async def search(request: Request, query: str):
     # discard pandas metadata and store total count
     matches = matches.replace_schema_metadata({"count": str(total)})
 
-    stream = BytesIO()
-    write_feather(
-        matches,
-        stream,
-        compression="uncompressed",
-    )
-    return Response(content=stream.getvalue(), media_type="application/octet-stream")
+    return arrow_response(matches, request=request)
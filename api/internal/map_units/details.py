@@ -1,10 +1,10 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.requests import Request
 from fastapi.responses import JSONResponse
-import pyarrow.compute as pc
 
-from api.constants import Layers, SUMMARY_UNIT_FIELDS
-from api.data import db
+from api.constants import Layers
+from api.data import unit_catalog
+from api.lib.units import get_units
 from api.logger import log_request
 
 
@@ -17,9 +17,7 @@ async def unit_details(request: Request, layer: Layers, id: str):
 
     layer = layer.value
 
-    col_expr = ", ".join(SUMMARY_UNIT_FIELDS)
-
-    match = db.sql(f"SELECT {col_expr} FROM map_units WHERE layer=? AND id=?", params=(layer, id)).fetch_arrow_table()
+    match = get_units(unit_catalog, layer, [id])
 
     if not len(match):
         raise HTTPException(404, detail=f"record not found for {layer}: {id}")
@@ -1,12 +1,11 @@
-from io import BytesIO
-
-from fastapi import APIRouter, Response, HTTPException
+from fastapi import APIRouter, HTTPException
 from fastapi.requests import Request
-from pyarrow.feather import write_feather
 
-from api.constants import Layers, SUMMARY_UNIT_FIELDS
-from api.data import db
+from api.constants import Layers
+from api.data import unit_catalog
+from api.lib.units import get_units
 from api.logger import log_request, log
+from api.response import arrow_response
 
 
 MAX_RECORDS = 100
@@ -31,21 +30,9 @@ async def unit_list(request: Request, layer: Layers, id: str):
 
     layer = layer.value
 
-    col_expr = ", ".join(SUMMARY_UNIT_FIELDS)
-    ids = id.split(",")
-    id_placeholder = ", ".join(["?"] * len(ids))
-
-    records = db.sql(
-        f"SELECT {col_expr} FROM map_units WHERE layer=? AND id IN ({id_placeholder})", params=[layer] + ids
-    ).fetch_arrow_table()
+    records = get_units(unit_catalog, layer, id.split(","))
 
     if len(records) > MAX_RECORDS:
         raise HTTPException(400, "Too many records requested")
 
-    stream = BytesIO()
-    write_feather(
-        records,
-        stream,
-        compression="uncompressed",
-    )
-    return Response(content=stream.getvalue(), media_type="application/octet-stream")
+    return arrow_response(records, request=request)
@@ -1,12 +1,11 @@
-from io import BytesIO
-
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, HTTPException
 from fastapi.requests import Request
-from pyarrow.feather import write_feather
 
-from api.constants import UNIT_FIELDS, SUMMARY_UNIT_FIELDS
-from api.data import db
+from api.constants import UNIT_FIELDS
+from api.data import unit_catalog
+from api.lib.units import search_units as search_unit_catalog
 from api.logger import log_request
+from api.response import arrow_response
 
 
 NUM_UNIT_SEARCH_RESULTS = 10
@@ -39,31 +38,9 @@ async def search_units(request: Request, layer: str, query: str):
     if invalid_layers:
         raise HTTPException(400, detail=f"invalid layers: {', '.join(invalid_layers)}")
 
-    layers_placeholder = ", ".join(["?"] * len(layers))
+    total_count, matches = search_unit_catalog(unit_catalog, layers, query, NUM_UNIT_SEARCH_RESULTS)
 
-    total_count = db.sql(
-        f"SELECT count(*) FROM map_units WHERE layer IN ({layers_placeholder}) AND key LIKE ?",
-        params=(layers + [f"%{query.replace(' ', '%')}%"]),
-    ).fetchone()[0]
+    # store total count
+    matches = matches.replace_schema_metadata({"count": str(total_count)})
 
-    sql_query = f"""
-    SELECT *, instr(key, ?) AS ipos, length(key) as len
-    FROM map_units
-    WHERE layer IN ({layers_placeholder}) AND key LIKE ?
-    ORDER BY priority ASC, ipos ASC, len ASC, state ASC
-    LIMIT {NUM_UNIT_SEARCH_RESULTS}
-    """
-    matches = (
-        db.sql(sql_query, params=[query] + layers + [f"%{query.replace(' ', '%')}%"]).to_arrow_table().combine_chunks()
-    )
-
-    # discard pandas metadata and store total count
-    matches = matches.select(SUMMARY_UNIT_FIELDS).replace_schema_metadata({"count": str(total_count)})
-
-    stream = BytesIO()
-    write_feather(
-        matches,
-        stream,
-        compression="uncompressed",
-    )
-    return Response(content=stream.getvalue(), media_type="application/octet-stream")
+    return arrow_response(matches, request=request)
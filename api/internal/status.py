@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from api.dependencies import get_redis
+
+from api.lib.executor import get_executor_metrics
+from api.lib.memory import get_memory_metrics
+
+
+router = APIRouter()
+
+
+@router.get("/status/executor")
+async def executor_status():
+    """Return metrics of CPU-bound work run in the shared thread pool of this
+    API process, used to tune the number of threads and processes.
+
+    Returns
+    -------
+    JSON
+        see api.lib.executor::get_executor_metrics()
+    """
+    return JSONResponse(content=get_executor_metrics())
+
+
+@router.get("/status/memory")
+async def memory_status():
+    """Return resident memory of this API process, split into memory shared
+    with other processes (memory-mapped datasets) and private memory, used to
+    determine how many processes can run on a server.
+
+    Returns
+    -------
+    JSON
+        see api.lib.memory::get_memory_metrics()
+    """
+    return JSONResponse(content=get_memory_metrics())
+
+
+@router.get("/status/redis")
+async def redis_status(redis=Depends(get_redis)):
+    """Return usage of the Redis connection pool shared by requests to this API
+    process, used to tune REDIS_MAX_CONNECTIONS.
+
+    Returns
+    -------
+    JSON
+        see api.dependencies::TrackedConnectionPool.get_metrics()
+    """
+    return JSONResponse(content=redis.connection_pool.get_metrics())
@@ -0,0 +1,57 @@
+import os
+import tempfile
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from pyarrow.csv import CSVWriter
+
+from api.settings import LOGO_PATH
+
+
+def write_download_zip(path, filename, schema, batches, readme, terms, compresslevel=5):
+    """Write batches of records to CSV within a zip file, along with metadata files.
+
+    CSV data are written directly into the zip file in batches rather than
+    first writing the full CSV to memory.
+
+    Parameters
+    ----------
+    path : Path
+        output zip filename
+    filename : str
+        filename of CSV within zip file
+    schema : pyarrow.Schema
+        schema of records in batches
+    batches : iterable of pyarrow.Table or pyarrow.RecordBatch
+    readme : str
+        contents of README.txt
+    terms : str
+        contents of TERMS_OF_USE.txt
+    compresslevel : int, optional (default: 5)
+    """
+    path.parent.mkdir(exist_ok=True)
+    # grant permissions to Caddy to read from this directory; the default is too restrictive
+    os.chmod(path.parent, 0o755)
+
+    # write to a temporary file first so that a partial file is never served
+    # to identical download requests
+    fd, tmp_filename = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            with ZipFile(outfile, "w", compression=ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+                # force_zip64 is required because the size of the CSV is not known in advance
+                with zf.open(filename, "w", force_zip64=True) as out:
+                    with CSVWriter(out, schema) as writer:
+                        for batch in batches:
+                            writer.write(batch)
+
+                zf.writestr("README.txt", readme)
+                zf.writestr("TERMS_OF_USE.txt", terms)
+                zf.write(LOGO_PATH, LOGO_PATH.name)
+
+        os.chmod(tmp_filename, 0o644)
+        os.replace(tmp_filename, path)
+
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from api.lib.executor import run_in_executor
+from api.logger import log
+from api.settings import DATA_VERSION, RESPONSE_CACHE_DIR, RESPONSE_CACHE_SIZE
+
+
+# in-memory cache of {<key>: <response bytes>}, in least recently used order
+_cache = OrderedDict()
+_cache_size = 0
+
+if RESPONSE_CACHE_DIR is not None:
+    # responses cached on disk are invalidated by using a new directory for each data version
+    RESPONSE_CACHE_VERSION_DIR = RESPONSE_CACHE_DIR / DATA_VERSION
+    RESPONSE_CACHE_VERSION_DIR.mkdir(exist_ok=True, parents=True)
+
+    # remove responses cached for previous data versions
+    for path in RESPONSE_CACHE_DIR.iterdir():
+        if path.is_dir() and path != RESPONSE_CACHE_VERSION_DIR:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def get_cache_key(endpoint, barrier_type, unit_ids, filters, **params):
+    """Construct a canonical cache key for a request.
+
+    Unit ids and filter values are sorted and deduplicated so that equivalent
+    requests produce the same key regardless of the order of ids or values.
+
+    Parameters
+    ----------
+    endpoint : str
+        name of endpoint, e.g., "rank"
+    barrier_type : str
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    **params
+        any other request parameters that determine the response; values must
+        be JSON serializable
+
+    Returns
+    -------
+    str
+        hash of data version and normalized request parameters
+    """
+
+    key = {
+        "data_version": DATA_VERSION,
+        "endpoint": endpoint,
+        "barrier_type": barrier_type,
+        "unit_ids": {layer: sorted(set(ids.tolist())) for layer, ids in unit_ids.items()},
+        "filters": {
+            field: [match_type, sorted(set(values), key=str)] for field, (match_type, values) in filters.items()
+        },
+        "params": params,
+    }
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("UTF8")).hexdigest()
+
+
+async def get_cached_response(key):
+    """Get response bytes from the cache, checking the in-memory cache first
+    and then the on-disk cache (if enabled).
+
+    The on-disk cache is read in the shared thread pool so that it does not
+    block the event loop.
+
+    Parameters
+    ----------
+    key : str
+        key from get_cache_key()
+
+    Returns
+    -------
+    bytes or None
+        None if key is not found in cache
+    """
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    if RESPONSE_CACHE_DIR is None:
+        return None
+
+    content = await run_in_executor("cache", _read_from_disk_cache, key)
+    if content is not None:
+        _add_to_memory_cache(key, content)
+
+    return content
+
+
+async def set_cached_response(key, content):
+    """Store response bytes in the cache, and on disk if enabled.
+
+    The on-disk cache is written in the shared thread pool so that it does not
+    block the event loop.
+
+    Parameters
+    ----------
+    key : str
+        key from get_cache_key()
+    content : bytes
+    """
+    _add_to_memory_cache(key, content)
+
+    if RESPONSE_CACHE_DIR is None:
+        return
+
+    await run_in_executor("cache", _write_to_disk_cache, key, content)
+
+
+def _read_from_disk_cache(key):
+    try:
+        with open(RESPONSE_CACHE_VERSION_DIR / key, "rb") as infile:
+            return infile.read()
+
+    except FileNotFoundError:
+        return None
+
+
+def _write_to_disk_cache(key, content):
+    # write to a temporary file first so that other processes never read a partial file
+    try:
+        fd, tmp_filename = tempfile.mkstemp(dir=RESPONSE_CACHE_VERSION_DIR)
+        with os.fdopen(fd, "wb") as out:
+            out.write(content)
+
+        os.replace(tmp_filename, RESPONSE_CACHE_VERSION_DIR / key)
+
+    except OSError as ex:
+        log.error(f"Could not write response to cache: {ex}")
+
+
+def _add_to_memory_cache(key, content):
+    global _cache_size
+
+    size = len(content)
+    if size > RESPONSE_CACHE_SIZE:
+        return
+
+    if key in _cache:
+        _cache_size -= len(_cache.pop(key))
+
+    _cache[key] = content
+    _cache_size += size
+
+    # evict least recently used entries
+    while _cache_size > RESPONSE_CACHE_SIZE:
+        _, evicted = _cache.popitem(last=False)
+        _cache_size -= len(evicted)
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+import json
+
+import numpy as np
+import pyarrow as pa
+
+
+# maximum number of serialized records cached in memory per process
+DETAILS_CACHE_SIZE = 4096
+
+# in-memory cache of {(<table>, <key>): <JSON bytes>}, in least recently used order
+_cache = OrderedDict()
+
+
+def create_details_index(filename, key_fields):
+    """Create a hash index of the rows of each record in a memory-mapped feather
+    file, so that individual records can be read without scanning the file.
+
+    Rows are indexed by the Python hash of the tuple of values of key_fields;
+    hashes are only consistent within a process, so this must be created in
+    each process.  Hash collisions are resolved by comparing key values of the
+    records that are read.
+
+    Parameters
+    ----------
+    filename : Path
+        feather file
+    key_fields : list of str
+        fields that uniquely identify each record
+
+    Returns
+    -------
+    dict
+    """
+    source = pa.memory_map(str(filename))
+    reader = pa.ipc.open_file(source)
+
+    # only read key fields to build index
+    key_reader = pa.ipc.open_file(
+        source, options=pa.ipc.IpcReadOptions(included_fields=[reader.schema.get_field_index(f) for f in key_fields])
+    )
+
+    batch_sizes = []
+    hashes = []
+    for i in range(key_reader.num_record_batches):
+        batch = key_reader.get_batch(i)
+        batch_sizes.append(batch.num_rows)
+        hashes.extend(hash(key) for key in zip(*(batch[f].to_pylist() for f in key_fields)))
+
+    hashes = np.array(hashes, dtype="int64")
+    ix = np.argsort(hashes, kind="stable")
+
+    return {
+        "reader": reader,
+        "key_fields": key_fields,
+        "offsets": np.cumsum([0] + batch_sizes),
+        "hashes": hashes[ix],
+        "rows": ix.astype("uint32"),
+    }
+
+
+def read_details(index, key):
+    """Read a record by its key and serialize it to JSON.
+
+    Parameters
+    ----------
+    index : dict
+        index from create_details_index()
+    key : tuple
+        values of key fields of index
+
+    Returns
+    -------
+    bytes or None
+        None if record is not found
+    """
+    key_hash = hash(key)
+    start = np.searchsorted(index["hashes"], key_hash, side="left")
+    stop = np.searchsorted(index["hashes"], key_hash, side="right")
+
+    for row in index["rows"][start:stop]:
+        batch_id = np.searchsorted(index["offsets"], row, side="right") - 1
+        record = index["reader"].get_batch(batch_id).slice(row - index["offsets"][batch_id], 1)
+
+        if tuple(record[f][0].as_py() for f in index["key_fields"]) == key:
+            # use the bulk converter to dict (otherwise float32 serialization issues)
+            record = record.rename_columns([c.lower() for c in record.schema.names]).to_pylist()[0]
+
+            # serialize the same as JSONResponse
+            return json.dumps(record, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("UTF8")
+
+    return None
+
+
+def get_cached_details(table, key):
+    """Get serialized record from the cache.
+
+    Parameters
+    ----------
+    table : str
+    key : tuple
+
+    Returns
+    -------
+    bytes or None
+        None if record is not in cache
+    """
+    content = _cache.get((table, key), None)
+    if content is not None:
+        _cache.move_to_end((table, key))
+
+    return content
+
+
+def set_cached_details(table, key, content):
+    """Store serialized record in the cache, evicting the least recently used
+    record if the cache is full.
+
+    Parameters
+    ----------
+    table : str
+    key : tuple
+    content : bytes
+    """
+    _cache[(table, key)] = content
+    _cache.move_to_end((table, key))
+
+    if len(_cache) > DETAILS_CACHE_SIZE:
+        _cache.popitem(last=False)
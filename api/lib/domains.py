@@ -1,79 +1,170 @@
-import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 
 from api.constants import DOMAINS, MULTI_VALUE_DOMAINS
+from api.lib.profiling import span
 
 
-def unpack_field(arr, lookup):
-    """Unpack domain codes to string values for a single field, using numpy.
-    Values that are not present in lookup are assigned empty string.
+# type of unpacked domain fields; values are stored once in the dictionary of
+# each array instead of once per record
+UNPACKED_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+# precomputed Arrow arrays of codes and values for each domain; the last value
+# is an empty string for codes that are not present in the domain
+# {<field>: (<codes>, <values>), ...}
+DOMAIN_VALUES = {
+    field: (pa.array(list(lookup.keys())), pa.array(list(lookup.values()) + [""], type="string"))
+    for field, lookup in DOMAINS.items()
+}
+
+# cache of expanded values of combinations of multi-value domain codes
+# {(<field>, <combination>): <expanded value>, ...}
+_expanded_values = {}
+
+
+def _get_code_indices(arr, codes):
+    """Get the position of each value of arr within codes.
+
+    Parameters
+    ----------
+    arr : pyarrow.Array
+    codes : pyarrow.Array
+
+    Returns
+    -------
+    pyarrow.Int32Array
+        null where values are null or not present in codes
+    """
+    if pa.types.is_dictionary(arr.type):
+        # only look up each unique value
+        return _get_code_indices(arr.dictionary, codes).take(arr.indices)
+
+    if pa.types.is_integer(arr.type):
+        arr = arr.cast("int64")
+        codes = codes.cast("int64")
+
+    elif pa.types.is_floating(arr.type):
+        arr = arr.cast("float64")
+        codes = codes.cast("float64")
+
+    else:
+        codes = codes.cast(arr.type)
+
+    return pc.index_in(arr, value_set=codes).cast("int32")
+
+
+def unpack_field(arr, field):
+    """Unpack domain codes to string values for a single field.  Values that
+    are not present in the domain are assigned empty string.
+
+    Parameters
+    ----------
+    arr : pyarrow.Array
+    field : str
+        name of field in DOMAINS
+
+    Returns
+    -------
+    pyarrow.DictionaryArray
+    """
+    codes, values = DOMAIN_VALUES[field]
+    indices = pc.fill_null(_get_code_indices(arr, codes), len(values) - 1)
+    return pa.DictionaryArray.from_arrays(indices, values)
+
+
+def unpack_multivalue_field(arr, field):
+    """Unpack multi-value domain codes to string values for a single field.
+    Codes that are not present in the domain are dropped.
+
+    This expands each unique combination of codes to a combination of values,
+    which are cached for reuse.
 
     Parameters
     ----------
-    column : array-like
-    lookup : dict
-        lookup of codes to values
+    arr : pyarrow.Array
+    field : str
+        name of field in MULTI_VALUE_DOMAINS
 
     Returns
     -------
-    np.array
+    pyarrow.DictionaryArray
     """
-    u, inv = np.unique(arr, return_inverse=True)
-    return np.array([lookup.get(x, "") for x in u], dtype=str)[inv].reshape(inv.shape)
+    if not pa.types.is_dictionary(arr.type):
+        arr = arr.dictionary_encode()
 
+    lookup = MULTI_VALUE_DOMAINS[field]
+    expanded = []
+    for combination in arr.dictionary.to_pylist():
+        key = (field, combination)
+        if key not in _expanded_values:
+            _expanded_values[key] = ", ".join(lookup[k] for k in (combination or "").split(",") if k in lookup)
+        expanded.append(_expanded_values[key])
 
-def unpack_multivalue_field(arr, lookup):
-    """Unpack multi-value domain codes to string values for a single field,
-    using numpy. Values that are not present in lookup are assigned empty string.
+    # add empty string for null values
+    indices = pc.fill_null(arr.indices.cast("int32"), len(expanded))
+    return pa.DictionaryArray.from_arrays(indices, pa.array(expanded + [""], type="string"))
 
-    This first finds all unique values of the multi-value field, then creates
-    a new lookup table for those to their expanded string versions
+
+def unpack_schema(schema):
+    """Get the schema that results from unpacking domain codes to values.
 
     Parameters
     ----------
-    column : array-like
-    lookup : dict
-        lookup of codes to values
+    schema : pyarrow.Schema
 
     Returns
     -------
-    np.array
+    pyarrow.Schema
+        schema with domain fields set to dictionary-encoded string type
     """
+    schema = schema.remove_metadata()
+    for i, field in enumerate(schema.names):
+        if field in DOMAINS or field in MULTI_VALUE_DOMAINS:
+            schema = schema.set(i, pa.field(field, UNPACKED_TYPE))
 
-    # expand unique combinations of codes to combinations of values for lookup
-    u, inv = np.unique(arr, return_inverse=True)
-    expanded_lookup = {
-        combination: ", ".join([lookup[k] for k in combination.split(",") if combination]) for combination in u
-    }
-    return np.array([expanded_lookup.get(x, "") for x in u], dtype=str)[inv].reshape(inv.shape)
+    return schema
 
 
 def unpack_domains(df):
     """Unpack domain codes to values.
 
+    Unpacked fields are dictionary-encoded, so that each value is only stored
+    once; these are decoded when written to CSV.
+
     See analysis.export.lib for version for Pandas DataFrames
 
     Parameters
     ----------
-    df : pyarrow.Table
+    df : pyarrow.Table or pyarrow.RecordBatch
+
+    Returns
+    -------
+    pyarrow.Table
     """
 
-    schema = df.schema.remove_metadata()
-    arrays = []
-    for i, field in enumerate(schema.names):
-        if field in DOMAINS:
-            unpacked = unpack_field(df[field], DOMAINS[field])
-            # force domain fields to string type
-            schema = schema.set(i, pa.field(field, "string"))
+    with span("unpack"):
+        schema = unpack_schema(df.schema)
+        arrays = []
+        for field in schema.names:
+            if field in DOMAINS:
+                unpacked = _map_chunks(df[field], unpack_field, field)
+
+            elif field in MULTI_VALUE_DOMAINS:
+                unpacked = _map_chunks(df[field], unpack_multivalue_field, field)
+
+            else:
+                unpacked = df[field]
+
+            arrays.append(unpacked)
+
+        if isinstance(df, pa.RecordBatch):
+            return pa.Table.from_batches([pa.RecordBatch.from_arrays(arrays, schema=schema)], schema=schema)
 
-        elif field in MULTI_VALUE_DOMAINS:
-            unpacked = unpack_multivalue_field(df[field], MULTI_VALUE_DOMAINS[field])
-            # force domain fields to string type
-            schema = schema.set(i, pa.field(field, "string"))
+        return pa.Table.from_arrays(arrays, schema=schema)
 
-        else:
-            unpacked = df[field]
 
-        arrays.append(unpacked)
+def _map_chunks(arr, func, field):
+    if isinstance(arr, pa.ChunkedArray):
+        return pa.chunked_array([func(chunk, field) for chunk in arr.chunks], type=UNPACKED_TYPE)
 
-    return pa.Table.from_arrays(arrays, schema=schema)
+    return func(arr, field)
@@ -1,15 +1,158 @@
+import numpy as np
 import pyarrow as pa
 import pyarrow.compute as pc
 
-from api.constants import FullySupportedBarrierTypes, Scenarios, CUSTOM_TIER_FIELDS, SPECIES_HABITAT_FIELDS
-from api.lib.domains import unpack_domains
+from api.constants import FullySupportedBarrierTypes, Scenarios, SPECIES_HABITAT_FIELDS
+from api.lib.cache import get_cache_key
+from api.lib.domains import unpack_domains, unpack_schema
 from api.lib.extract import extract_records
-from api.lib.tiers import calculate_tiers
+from api.lib.tiers import calculate_tiers, METRICS
+from api.settings import CUSTOM_DOWNLOAD_DIR
 
 # list of columns that can be dropped if entirely empty
 OPTIONAL_STRING_COLS = ["StateWRA"]
 OPTIONAL_NUMERIC_COLS = ["FlowsToOcean", "FlowsToGreatLakes", "BrookTroutPortfolio"] + SPECIES_HABITAT_FIELDS
 
+# maximum number of records to unpack and write to CSV at a time
+DOWNLOAD_BATCH_SIZE = 100_000
+
+
+def get_download_id(barrier_type, unit_ids, filters, format, custom_rank, ranked_only, sort):
+    """Get a unique id for a download based on its parameters, so that
+    identical download requests share the same background job and output
+    file.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    format : Formats
+    custom_rank : bool
+    ranked_only : bool
+    sort : Scenarios
+
+    Returns
+    -------
+    str
+    """
+    return get_cache_key(
+        "download",
+        barrier_type,
+        unit_ids,
+        filters,
+        format=format,
+        custom_rank=custom_rank,
+        ranked_only=ranked_only,
+        sort=sort,
+    )
+
+
+def get_download_path(download_id, barrier_type):
+    """Get path of zip file for a download.
+
+    Parameters
+    ----------
+    download_id : str
+        id from get_download_id()
+    barrier_type : str
+
+    Returns
+    -------
+    Path
+    """
+    return CUSTOM_DOWNLOAD_DIR / download_id / f"{barrier_type}.zip"
+
+
+def get_empty_columns(batch, columns):
+    """Get the optional columns that have no useful data in a batch of records.
+
+    Parameters
+    ----------
+    batch : pyarrow.RecordBatch
+    columns : iterable of str
+        optional column names to check
+
+    Returns
+    -------
+    set
+        column names that are empty in batch
+    """
+    empty_cols = set()
+    for col in columns:
+        if col in OPTIONAL_STRING_COLS:
+            is_empty = pc.all(pc.equal(batch[col], ""))
+        else:
+            is_empty = pc.all(pc.less_equal(batch[col], 0))
+
+        if is_empty.as_py():
+            empty_cols.add(col)
+
+    return empty_cols
+
+
+def get_download_columns(
+    barrier_type: FullySupportedBarrierTypes,
+    unit_ids: dict,
+    filters: dict,
+    columns: list,
+    ranked_only: bool,
+):
+    """Drop optional columns that have no useful data for the records that
+    meet the filters.
+
+    This only scans the optional columns, one batch at a time.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    columns : list
+        list of column names requested for download
+    ranked_only : bool
+        If true, will limit results to ranked barriers
+
+    Returns
+    -------
+    list
+        columns with empty optional columns removed
+    """
+    optional_cols = [c for c in columns if c in OPTIONAL_STRING_COLS or c in OPTIONAL_NUMERIC_COLS]
+    if not optional_cols:
+        return columns
+
+    scanner = extract_records(
+        barrier_type,
+        unit_ids=unit_ids,
+        filters=filters,
+        columns=optional_cols,
+        ranked_only=ranked_only,
+        as_table=False,
+    )
+
+    num_rows = 0
+    empty_cols = set(optional_cols)
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+
+        num_rows += batch.num_rows
+
+        empty_cols = get_empty_columns(batch, empty_cols)
+        if not empty_cols:
+            break
+
+    # retain all columns if there are no records
+    if num_rows == 0:
+        return columns
+
+    return [c for c in columns if c not in empty_cols]
+
 
 def extract_for_download(
     barrier_type: FullySupportedBarrierTypes,
@@ -20,60 +163,159 @@ def extract_for_download(
     custom_rank: bool,
     sort: Scenarios,
 ):
-    df = extract_records(
+    """Extract records for download, and unpack domain codes to values in
+    batches so that the full unpacked output is never held in memory at once.
+
+    Records are sorted with barriers that have networks first (and by custom
+    tier if `custom_rank` is True).  Without custom ranks, this is done by
+    scanning the dataset for records with networks and then for records without
+    networks, so that only a single batch of records is held in memory at a time.
+    Custom ranks are calculated across all ranked records and determine the
+    sort order, so these require extracting all records first.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    columns : list
+        list of column names to include in output; must include "id"
+    ranked_only : bool
+        If true, will limit results to ranked barriers
+    custom_rank : bool
+        If true, will calculate custom tiers for ranked barriers
+    sort : Scenarios
+        custom tier scenario used to sort records if custom_rank is True
+
+    Returns
+    -------
+    (pyarrow.Schema, generator of pyarrow.Table)
+        schema of unpacked records and generator of unpacked records
+    """
+    if barrier_type != "road_crossings" and custom_rank:
+        return extract_ranked_for_download(barrier_type, unit_ids, filters, columns, ranked_only, sort)
+
+    columns = get_download_columns(barrier_type, unit_ids, filters, columns, ranked_only)
+    columns = [c for c in columns if c != "id"]
+
+    if barrier_type == "road_crossings":
+        scan_filters = [filters]
+    else:
+        # sort by HasNetwork by extracting barriers with networks before barriers without
+        scan_filters = [
+            {**filters, "HasNetwork": ("in_array", [True])},
+            {**filters, "HasNetwork": ("in_array", [False])},
+        ]
+
+    scanners = [
+        extract_records(
+            barrier_type,
+            unit_ids=unit_ids,
+            filters=scan_filter,
+            columns=columns,
+            ranked_only=ranked_only,
+            as_table=False,
+        )
+        for scan_filter in scan_filters
+    ]
+
+    def batches():
+        for scanner in scanners:
+            for batch in scanner.to_batches():
+                for i in range(0, batch.num_rows, DOWNLOAD_BATCH_SIZE):
+                    yield unpack_domains(batch.slice(i, DOWNLOAD_BATCH_SIZE))
+
+    return unpack_schema(scanners[0].projected_schema), batches()
+
+
+def extract_ranked_for_download(
+    barrier_type: FullySupportedBarrierTypes,
+    unit_ids: dict,
+    filters: dict,
+    columns: list,
+    ranked_only: bool,
+    sort: Scenarios,
+):
+    """Extract records for download with custom tiers calculated across all
+    ranked records, sorted with barriers that have networks first and then by
+    custom tier.
+
+    Records are scanned once; empty optional columns are detected during the
+    scan instead of in a separate pass.  Tiers are calculated for ranked
+    records and scattered back into columns in the original order of records
+    (with -1 for records that are not ranked), and records are only copied in
+    sorted order one batch at a time as they are unpacked.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    columns : list
+        list of column names to include in output
+    ranked_only : bool
+        If true, will limit results to ranked barriers
+    sort : Scenarios
+        custom tier scenario used to sort records
+
+    Returns
+    -------
+    (pyarrow.Schema, generator of pyarrow.Table)
+        schema of unpacked records and generator of unpacked records
+    """
+    columns = [c for c in columns if c != "id"]
+    optional_cols = [c for c in columns if c in OPTIONAL_STRING_COLS or c in OPTIONAL_NUMERIC_COLS]
+
+    scanner = extract_records(
         barrier_type,
         unit_ids=unit_ids,
         filters=filters,
         columns=columns,
         ranked_only=ranked_only,
+        as_table=False,
     )
 
+    batches = []
+    empty_cols = set(optional_cols)
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+
+        batches.append(batch)
+        if empty_cols:
+            empty_cols = get_empty_columns(batch, empty_cols)
+
+    # this does not copy the batches
+    df = pa.Table.from_batches(batches, schema=scanner.projected_schema)
+
     if len(df) == 0:
-        return df
-
-    # drop columns that have no useful data
-    drop_cols = set()
-    for col in set(df.column_names).intersection(OPTIONAL_STRING_COLS):
-        if pc.all(pc.equal(df[col], "")):
-            drop_cols.add(col)
-
-    for col in set(df.column_names).intersection(OPTIONAL_NUMERIC_COLS):
-        if pc.all(pc.less_equal(df[col], 0)):
-            drop_cols.add(col)
-
-    if len(drop_cols) > 0:
-        df = df.drop(drop_cols)
-
-    if barrier_type != "road_crossings":
-        # calculate custom ranks
-        # NOTE: can only calculate ranks for those that have networks and are not excluded from ranking
-        if custom_rank:
-            to_rank = df.filter(pc.equal(df["Ranked"], True))
-            tiers = calculate_tiers(to_rank)
-            # cast to int8 to allow setting -1 null values
-            tiers = tiers.cast(pa.schema([pa.field(c, "int8") for c in tiers.column_names])).add_column(
-                0, to_rank.schema.field("id"), to_rank["id"]
-            )
-
-            # join back to full data frame
-            df = df.join(tiers, "id")
-
-            if len(to_rank) < len(df):
-                # fill missing values
-                df = pa.Table.from_pydict(
-                    {
-                        **{col: df[col] for col in df.column_names if col not in CUSTOM_TIER_FIELDS},
-                        **{col: df[col].fill_null(-1) for col in df.column_names if col in CUSTOM_TIER_FIELDS},
-                    }
-                )
-
-            # Sort by HasNetwork, tier
-            df = df.sort_by([("HasNetwork", "descending"), (f"{sort}_tier", "ascending")])
+        # retain all columns if there are no records
+        return unpack_schema(df.schema), iter([])
 
-        else:
-            # sort only HasNetwork
-            df = df.sort_by([("HasNetwork", "descending")])
+    df = df.drop([c for c in optional_cols if c in empty_cols])
+
+    # calculate custom ranks
+    # NOTE: can only calculate ranks for those that have networks and are not excluded from ranking
+    ranked = pc.indices_nonzero(df["Ranked"])
+    tiers = calculate_tiers(df.select(METRICS).take(ranked))
+
+    # use int8 to allow setting -1 for records that are not ranked
+    ranked = ranked.to_numpy()
+    for col in tiers.column_names:
+        values = np.full(len(df), -1, dtype="int8")
+        values[ranked] = tiers[col].to_numpy()
+        df = df.append_column(col, pa.array(values))
+
+    # Sort by HasNetwork, tier
+    ix = pc.sort_indices(df, sort_keys=[("HasNetwork", "descending"), (f"{sort}_tier", "ascending")])
+
+    def batches():
+        for i in range(0, len(ix), DOWNLOAD_BATCH_SIZE):
+            yield unpack_domains(df.take(ix.slice(i, DOWNLOAD_BATCH_SIZE)))
 
-    df = unpack_domains(df.drop(["id"]))
+    return unpack_schema(df.schema), batches()
 
-    return df
@@ -0,0 +1,123 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from time import perf_counter
+
+from api.lib.profiling import is_profiling
+from api.settings import API_THREADS, API_ENDPOINT_CONCURRENCY
+
+
+# shared pool of threads for CPU-bound work; pyarrow and numpy release the GIL
+# for most operations, so these can run in parallel with the event loop
+executor = ThreadPoolExecutor(max_workers=API_THREADS, thread_name_prefix="api")
+
+# {<name>: asyncio.Semaphore, ...}
+_semaphores = {}
+
+# {<name>: {<metric>: <value>, ...}, ...}
+_metrics = {}
+
+
+async def run_in_executor(name, func, *args, **kwargs):
+    """Run func in the shared thread pool, limiting the number of concurrent
+    calls with the same name (e.g., endpoint) to API_ENDPOINT_CONCURRENCY.
+
+    Time spent waiting for a slot for name and for a thread in the pool is
+    recorded as wait time, separately from time spent running func.
+
+    func is run in a copy of the current context, so that it records metrics
+    to the current request.  If the current request is being profiled, func
+    is run directly in the event loop thread so that it is included in the
+    profile.
+
+    Parameters
+    ----------
+    name : str
+        name used to limit concurrency and to record metrics
+    func : callable
+    *args, **kwargs
+        passed to func
+
+    Returns
+    -------
+    return value of func
+    """
+    if is_profiling():
+        return func(*args, **kwargs)
+
+    if name not in _semaphores:
+        _semaphores[name] = asyncio.Semaphore(API_ENDPOINT_CONCURRENCY)
+
+    semaphore = _semaphores[name]
+    metrics = _metrics.setdefault(
+        name,
+        {
+            "calls": 0,
+            "active": 0,
+            "running": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "run_time": 0.0,
+            "max_run_time": 0.0,
+        },
+    )
+
+    queued = perf_counter()
+    started = None
+    context = contextvars.copy_context()
+
+    def run():
+        nonlocal started
+        started = perf_counter()
+        return context.run(func, *args, **kwargs)
+
+    metrics["active"] += 1
+    try:
+        async with semaphore:
+            metrics["running"] += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(executor, run)
+
+            finally:
+                metrics["running"] -= 1
+
+    finally:
+        finished = perf_counter()
+        metrics["active"] -= 1
+        metrics["calls"] += 1
+
+        if started is not None:
+            wait_time = started - queued
+            run_time = finished - started
+            metrics["wait_time"] += wait_time
+            metrics["max_wait_time"] = max(metrics["max_wait_time"], wait_time)
+            metrics["run_time"] += run_time
+            metrics["max_run_time"] = max(metrics["max_run_time"], run_time)
+
+
+def get_executor_metrics():
+    """Get metrics for calls run in the shared thread pool.
+
+    Returns
+    -------
+    dict
+        {"threads": <int>, "endpoint_concurrency": <int>, "calls": {<name>: {...}, ...}}
+        where the metrics for each name include the number of completed calls,
+        the number of calls currently waiting or running, and the total, mean,
+        and maximum time in seconds spent waiting for and running calls.
+    """
+    return {
+        "threads": API_THREADS,
+        "endpoint_concurrency": API_ENDPOINT_CONCURRENCY,
+        "calls": {
+            name: {
+                "calls": metrics["calls"],
+                "waiting": metrics["active"] - metrics["running"],
+                "running": metrics["running"],
+                **{k: v for k, v in metrics.items() if k.endswith("_time")},
+                "mean_wait_time": metrics["wait_time"] / metrics["calls"] if metrics["calls"] else 0,
+                "mean_run_time": metrics["run_time"] / metrics["calls"] if metrics["calls"] else 0,
+            }
+            for name, metrics in _metrics.items()
+        },
+    }
@@ -1,12 +1,51 @@
+from functools import lru_cache
+
+import numpy as np
 import pyarrow as pa
 import pyarrow.compute as pc
+from pyarrow.dataset import Scanner
 
 from api.constants import FullySupportedBarrierTypes
-from api.data import barrier_datasets
+from api.data import barrier_datasets, dictionaries, unit_counts, unit_indexes
+from api.lib.profiling import count, span
+
+
+# maximum number of ranges of rows to read using the unit index; if there are
+# more ranges than this, the full dataset is scanned instead
+MAX_INDEX_RANGES = 10_000
+
+
+def _get_dictionary_matches(barrier_type: FullySupportedBarrierTypes, field: str, values: list):
+    """Get the dictionary values of a dictionary-encoded field that contain
+    any of the values.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    field : str
+    values : list of str
+
+    Returns
+    -------
+    pyarrow.Array
+    """
+    matches = [_match_dictionary(barrier_type, field, value) for value in sorted(set(values))]
+    return pc.unique(pa.concat_arrays(matches))
+
+
+@lru_cache(maxsize=4096)
+def _match_dictionary(barrier_type: FullySupportedBarrierTypes, field: str, value: str):
+    dictionary = dictionaries[barrier_type][field]
+    return dictionary.filter(pc.match_substring(dictionary, value))
+
+
+@lru_cache(maxsize=16)
+def _get_num_rows(barrier_type: FullySupportedBarrierTypes):
+    return barrier_datasets[barrier_type].count_rows()
 
 
 def _construct_filter_expr(
-    dataset: pa.dataset.Dataset,
+    barrier_type: FullySupportedBarrierTypes,
     unit_ids: dict,
     filters: dict,
     ranked_only: bool = False,
@@ -15,8 +54,8 @@ def _construct_filter_expr(
 
     Parameters
     ----------
-    dataset : pyarrow Dataset
-        dataset that data are being read from
+    barrier_type : FullySupportedBarrierTypes
+        barrier type of dataset that data are being read from
     unit_ids : dict
         dict of {<unit type>:[...unit ids...], ...}
     filters : dict
@@ -42,18 +81,9 @@ def _construct_filter_expr(
     # fields are evaluated using AND logic
     for key, (match_type, values) in filters.items():
         if match_type == "in_dict":
-            # find the corresponding dictionary entries so that we can search for these
-            # NOTE: we have to read at least 1 record from the dataset to get the dictionary
-            dictionary = dataset.scanner(columns=[key]).head(1)[key].combine_chunks().dictionary
-
+            # find the corresponding dictionary entries so that we can search for these;
             # value filters are combined with OR logic
-            matches = dictionary.filter(pc.match_substring(dictionary, values[0]))
-            match_ix = pc.is_in(pc.field(key), matches)
-            for value in values[1:]:
-                matches = dictionary.filter(pc.match_substring(dictionary, value))
-                match_ix = match_ix | pc.is_in(pc.field(key), matches)
-
-            ix = ix & match_ix
+            ix = ix & pc.is_in(pc.field(key), _get_dictionary_matches(barrier_type, key, values))
 
         else:
             # test that the field value is present in the set of incoming values
@@ -62,6 +92,117 @@ def _construct_filter_expr(
     return ix
 
 
+def _get_unit_ranges(barrier_type: FullySupportedBarrierTypes, unit_ids: dict):
+    """Get the ranges of rows in the dataset for the unit ids from the unit index.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+
+    Returns
+    -------
+    pyarrow.Table or None
+        Table with id, start, stop, ranked for each range of rows, or None if
+        there are no unit ids, no unit index for barrier_type, or too many
+        ranges of rows to read efficiently
+    """
+    if not unit_ids or barrier_type not in unit_indexes:
+        return None
+
+    index, _ = unit_indexes[barrier_type]
+
+    # evaluate unit ids using OR logic
+    ranges = pa.concat_tables(
+        [index[layer].filter(pc.is_in(index[layer]["id"], ids)) for layer, ids in unit_ids.items()]
+    )
+
+    # reading many small ranges of rows is slower than scanning the full dataset
+    if len(ranges) > MAX_INDEX_RANGES:
+        return None
+
+    return ranges
+
+
+def _get_rows(ranges):
+    """Convert ranges of rows to sorted unique row indices.
+
+    Parameters
+    ----------
+    ranges : pyarrow.Table
+        Table with start and stop for each range of rows
+
+    Returns
+    -------
+    ndarray of uint32
+    """
+    starts = ranges["start"].to_numpy().astype("int64")
+    lengths = ranges["stop"].to_numpy().astype("int64") - starts
+
+    # offset of each position in the output from the start of its range
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows = np.repeat(starts, lengths) + offsets
+
+    # ranges from different unit layers may overlap
+    return np.unique(rows).astype("uint32")
+
+
+def _scan_rows(
+    barrier_type: FullySupportedBarrierTypes,
+    rows,
+    columns: list | None,
+    filter_fields: list,
+    filter,
+):
+    """Create a Scanner that reads only the record batches that contain rows,
+    and selects those rows.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    rows : ndarray
+        sorted row indices
+    columns : list or None
+        list of column names to include in output; if None, will return all columns
+    filter_fields : list
+        list of column names used in filter
+    filter : pyarrow Expression
+        filter to apply to selected rows
+
+    Returns
+    -------
+    pyarrow Scanner
+    """
+    dataset = barrier_datasets[barrier_type]
+    _, batch_offsets = unit_indexes[barrier_type]
+
+    schema = dataset.schema
+    read_fields = schema.names if columns is None else set(columns).union(filter_fields)
+    reader = pa.ipc.open_file(
+        pa.memory_map(dataset.files[0]),
+        options=pa.ipc.IpcReadOptions(included_fields=sorted(schema.get_field_index(c) for c in read_fields)),
+    )
+
+    # rows are sorted, so rows in the same record batch are contiguous
+    batch_ids = np.searchsorted(batch_offsets, rows, side="right") - 1
+    batch_ids, starts = np.unique(batch_ids, return_index=True)
+    stops = np.append(starts[1:], len(rows))
+
+    def batches():
+        for batch_id, start, stop in zip(batch_ids, starts, stops):
+            batch = reader.get_batch(batch_id)
+            batch_rows = rows[start:stop] - batch_offsets[batch_id]
+
+            # slice if rows are contiguous (e.g., within a HUC), otherwise take
+            if batch_rows[-1] - batch_rows[0] == len(batch_rows) - 1:
+                yield batch.slice(batch_rows[0], len(batch_rows))
+            else:
+                yield batch.take(batch_rows)
+
+    return Scanner.from_batches(batches(), schema=reader.schema, columns=columns, filter=filter)
+
+
 def get_record_count(
     barrier_type: FullySupportedBarrierTypes,
     unit_ids: dict,
@@ -83,14 +224,34 @@ def get_record_count(
 
     Returns
     -------
-    _type_
-        _description_
+    int
     """
     dataset = barrier_datasets[barrier_type]
-    filter = _construct_filter_expr(dataset, unit_ids, filters, ranked_only=ranked_only)
-    scanner = dataset.scanner(columns=[], filter=filter)
 
-    return scanner.count_rows()
+    with span("count"):
+        ranges = _get_unit_ranges(barrier_type, unit_ids)
+        if ranges is not None:
+            # counts can be calculated directly from the index if there are no
+            # other filters and ranges do not overlap (only a single unit layer)
+            if len(filters) == 0 and len(unit_ids) == 1:
+                if ranked_only:
+                    return pc.sum(ranges["ranked"]).as_py() or 0
+
+                return (pc.sum(ranges["stop"]).as_py() or 0) - (pc.sum(ranges["start"]).as_py() or 0)
+
+            filter = _construct_filter_expr(barrier_type, {}, filters, ranked_only=ranked_only)
+            filter_fields = list(filters.keys()) + (["Ranked"] if ranked_only else [])
+            rows = _get_rows(ranges)
+            count("rows_scanned", len(rows))
+            scanner = _scan_rows(barrier_type, rows, [], filter_fields, filter)
+
+            return scanner.count_rows()
+
+        filter = _construct_filter_expr(barrier_type, unit_ids, filters, ranked_only=ranked_only)
+        count("rows_scanned", _get_num_rows(barrier_type))
+        scanner = dataset.scanner(columns=[], filter=filter)
+
+        return scanner.count_rows()
 
 
 def extract_records(
@@ -126,10 +287,87 @@ def extract_records(
     """
 
     dataset = barrier_datasets[barrier_type]
-    filter = _construct_filter_expr(dataset, unit_ids, filters, ranked_only=ranked_only)
-    scanner = dataset.scanner(columns=columns, filter=filter)
+
+    with span("filter"):
+        ranges = _get_unit_ranges(barrier_type, unit_ids)
+        if ranges is not None:
+            # only read rows in the selected units and apply other filters to those
+            filter = _construct_filter_expr(barrier_type, {}, filters, ranked_only=ranked_only)
+            filter_fields = list(filters.keys()) + (["Ranked"] if ranked_only else [])
+            rows = _get_rows(ranges)
+            count("rows_scanned", len(rows))
+            scanner = _scan_rows(barrier_type, rows, columns, filter_fields, filter)
+
+        else:
+            filter = _construct_filter_expr(barrier_type, unit_ids, filters, ranked_only=ranked_only)
+            count("rows_scanned", _get_num_rows(barrier_type))
+            scanner = dataset.scanner(columns=columns, filter=filter)
 
     if as_table:
-        return scanner.to_table().combine_chunks()
+        with span("extract"):
+            df = scanner.to_table().combine_chunks()
+
+        count("rows_returned", len(df))
+
+        return df
 
     return scanner
+
+
+def get_unit_counts(
+    barrier_type: FullySupportedBarrierTypes,
+    unit_ids: dict,
+    filters: dict,
+    query_fields: list,
+):
+    """Get counts of each combination of query fields and the bounds of barriers
+    in the selected summary units, from counts precomputed for each summary unit.
+
+    Precomputed counts can only be used if ids are for a single summary unit
+    layer (barriers may be present in units of multiple layers, so counts
+    cannot be combined across layers) and there are no other filters.
+
+    Parameters
+    ----------
+    barrier_type : FullySupportedBarrierTypes
+    unit_ids : dict
+        dict of {<unit type>:[...unit ids...], ...}
+    filters : dict
+        dict of {<field>: (<filter type>, <filter values>), ...}
+    query_fields : list
+        list of fields to count combinations of; must match fields used to
+        precompute counts
+
+    Returns
+    -------
+    (pyarrow.Table, list) or None
+        Table of counts in "id_count" column for each combination of query_fields
+        and [xmin, ymin, xmax, ymax] of barriers, or None if counts cannot be
+        determined from precomputed counts.
+    """
+    if len(unit_ids) != 1 or len(filters) > 0:
+        return None
+
+    layer, ids = next(iter(unit_ids.items()))
+    if (barrier_type, layer) not in unit_counts:
+        return None
+
+    counts_dataset, bounds_dataset = unit_counts[(barrier_type, layer)]
+    filter = pc.field(layer).isin(ids)
+
+    counts = (
+        counts_dataset.to_table(columns=query_fields + ["_count"], filter=filter)
+        .group_by(query_fields)
+        .aggregate([("_count", "sum")])
+        .rename_columns(query_fields + ["id_count"])
+    )
+
+    bounds = bounds_dataset.to_table(filter=filter)
+    bounds = [
+        pc.min(bounds["xmin"]).as_py(),
+        pc.min(bounds["ymin"]).as_py(),
+        pc.max(bounds["xmax"]).as_py(),
+        pc.max(bounds["ymax"]).as_py(),
+    ]
+
+    return counts, bounds
@@ -0,0 +1,80 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+# memory metrics (in kB) reported by Linux for all mappings of a process
+SMAPS_ROLLUP = Path("/proc/self/smaps_rollup")
+SMAPS_FIELDS = {
+    "Rss": "resident",
+    "Pss": "proportional",
+    "Shared_Clean": "shared_clean",
+    "Shared_Dirty": "shared_dirty",
+    "Private_Clean": "private_clean",
+    "Private_Dirty": "private_dirty",
+    "Anonymous": "anonymous",
+}
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def prewarm(dataset, columns):
+    """Read one byte from every page of the columns of a memory-mapped dataset,
+    so that those pages are loaded into the page cache (shared by all processes)
+    before the first request that uses them.
+
+    Parameters
+    ----------
+    dataset : pyarrow.dataset.Dataset
+    columns : list of str
+        columns to prewarm; columns not present in dataset are skipped
+    """
+    columns = [c for c in columns if c in dataset.schema.names]
+
+    for batch in dataset.to_batches(columns=columns):
+        for column in batch.columns:
+            arrays = [column]
+            if hasattr(column, "dictionary"):
+                arrays.append(column.dictionary)
+
+            for array in arrays:
+                for buffer in array.buffers():
+                    if buffer is not None and buffer.size > 0:
+                        np.frombuffer(buffer, dtype="uint8")[::PAGE_SIZE].sum()
+
+
+def get_memory_metrics():
+    """Get resident memory of this process, split into memory that is shared
+    with other processes (e.g., memory-mapped datasets in the page cache) and
+    memory that is private to this process.
+
+    Returns
+    -------
+    dict
+        {"pid": <pid>, "resident": <bytes>, "shared": <bytes>, "private": <bytes>, ...};
+        "proportional", "anonymous", and "file_backed" are only available if
+        /proc/self/smaps_rollup is available; metrics are None if not available
+        on this platform
+    """
+    metrics = {"pid": os.getpid(), "resident": None, "shared": None, "private": None}
+
+    if SMAPS_ROLLUP.exists():
+        for line in SMAPS_ROLLUP.read_text().splitlines():
+            field, _, value = line.partition(":")
+            if field in SMAPS_FIELDS:
+                metrics[SMAPS_FIELDS[field]] = int(value.split()[0]) * 1024
+
+        metrics["shared"] = metrics.pop("shared_clean") + metrics.pop("shared_dirty")
+        metrics["private"] = metrics.pop("private_clean") + metrics.pop("private_dirty")
+        # memory-mapped files are file-backed and can be shared by other processes
+        # even if not yet mapped by them
+        metrics["file_backed"] = metrics["resident"] - metrics["anonymous"]
+
+    elif Path("/proc/self/statm").exists():
+        _, resident, shared, *_ = (int(v) for v in Path("/proc/self/statm").read_text().split())
+        metrics["resident"] = resident * PAGE_SIZE
+        metrics["shared"] = shared * PAGE_SIZE
+        metrics["private"] = (resident - shared) * PAGE_SIZE
+
+    return metrics
@@ -0,0 +1,213 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import cProfile
+import threading
+from time import perf_counter
+
+
+# metrics of the current request:
+# {"spans": {<stage>: <seconds>, ...}, "counters": {<name>: <value>, ...}, "profile": <cProfile.Profile> or None}
+_request_metrics = ContextVar("request_metrics", default=None)
+
+# totals across all requests handled by this process
+# {<stage>: [<count>, <seconds>], ...}
+_span_totals = {}
+# {<name>: <value>, ...}
+_counter_totals = {}
+# {(<method>, <route>, <status>): [<count>, <seconds>], ...}
+_request_totals = {}
+
+# spans and counts are recorded from threads of the shared executor as well as
+# the event loop thread
+_totals_lock = threading.Lock()
+
+# only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+COUNTERS = {
+    "rows_scanned": "number of rows read from barrier datasets",
+    "rows_returned": "number of rows extracted from barrier datasets after filtering",
+    "bytes_serialized": "number of bytes of serialized responses",
+}
+
+
+def start_request(profile=False):
+    """Start recording metrics for the current request.
+
+    Parameters
+    ----------
+    profile : bool, optional (default: False)
+        if True, profile the request using cProfile unless another request
+        is being profiled
+
+    Returns
+    -------
+    dict
+        metrics of the request, updated as spans and counts are recorded
+    """
+    metrics = {"spans": {}, "counters": {}, "profile": None}
+
+    if profile and _profile_lock.acquire(blocking=False):
+        metrics["profile"] = cProfile.Profile()
+        metrics["profile"].enable()
+
+    _request_metrics.set(metrics)
+
+    return metrics
+
+
+def end_request(metrics, method, route, status, elapsed):
+    """Stop recording metrics for a request and add them to the totals for
+    this process.
+
+    Parameters
+    ----------
+    metrics : dict
+        metrics from start_request()
+    method : str
+    route : str
+        path of route, e.g., /internal/{barrier_type}/rank
+    status : int
+    elapsed : float
+        total time of request in seconds
+
+    Returns
+    -------
+    cProfile.Profile or None
+        profile of the request, if profiled
+    """
+    profile = metrics["profile"]
+    if profile is not None:
+        profile.disable()
+        _profile_lock.release()
+
+    with _totals_lock:
+        total = _request_totals.setdefault((method, route, status), [0, 0.0])
+        total[0] += 1
+        total[1] += elapsed
+
+    return profile
+
+
+def is_profiling():
+    """Return True if the current request is being profiled.
+
+    Returns
+    -------
+    bool
+    """
+    metrics = _request_metrics.get()
+    return metrics is not None and metrics["profile"] is not None
+
+
+def record_span(stage, seconds):
+    """Record time spent in a stage of the current request.
+
+    Parameters
+    ----------
+    stage : str
+    seconds : float
+    """
+    metrics = _request_metrics.get()
+
+    with _totals_lock:
+        total = _span_totals.setdefault(stage, [0, 0.0])
+        total[0] += 1
+        total[1] += seconds
+
+        if metrics is not None:
+            metrics["spans"][stage] = metrics["spans"].get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    """Context manager that records the time spent in a stage of the current
+    request, e.g., "extract".
+
+    Parameters
+    ----------
+    stage : str
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, perf_counter() - start)
+
+
+def count(name, value):
+    """Add value to a counter of the current request.
+
+    Parameters
+    ----------
+    name : str
+        one of COUNTERS
+    value : int
+    """
+    metrics = _request_metrics.get()
+
+    with _totals_lock:
+        _counter_totals[name] = _counter_totals.get(name, 0) + value
+
+        if metrics is not None:
+            metrics["counters"][name] = metrics["counters"].get(name, 0) + value
+
+
+def get_server_timing(metrics, elapsed):
+    """Format metrics of a request as a Server-Timing header.
+
+    Parameters
+    ----------
+    metrics : dict
+        metrics from start_request()
+    elapsed : float
+        total time of request in seconds
+
+    Returns
+    -------
+    str
+    """
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in metrics["spans"].items()]
+    entries += [f'{name};desc="{value}"' for name, value in metrics["counters"].items()]
+    entries.append(f"total;dur={elapsed * 1000:.1f}")
+
+    return ", ".join(entries)
+
+
+def render_metrics():
+    """Render totals for this process in Prometheus text format.
+
+    Returns
+    -------
+    str
+    """
+    with _totals_lock:
+        request_totals = {key: list(total) for key, total in _request_totals.items()}
+        span_totals = {stage: list(total) for stage, total in _span_totals.items()}
+        counter_totals = dict(_counter_totals)
+
+    lines = [
+        "# HELP api_request_seconds time spent handling requests",
+        "# TYPE api_request_seconds summary",
+    ]
+    for (method, route, status), (num, seconds) in sorted(request_totals.items()):
+        labels = f'method="{method}",route="{route}",status="{status}"'
+        lines.append(f"api_request_seconds_sum{{{labels}}} {seconds}")
+        lines.append(f"api_request_seconds_count{{{labels}}} {num}")
+
+    lines += [
+        "# HELP api_stage_seconds time spent in each stage of requests",
+        "# TYPE api_stage_seconds summary",
+    ]
+    for stage, (num, seconds) in sorted(span_totals.items()):
+        lines.append(f'api_stage_seconds_sum{{stage="{stage}"}} {seconds}')
+        lines.append(f'api_stage_seconds_count{{stage="{stage}"}} {num}')
+
+    for name, description in COUNTERS.items():
+        lines += [
+            f"# HELP api_{name}_total {description}",
+            f"# TYPE api_{name}_total counter",
+            f"api_{name}_total {counter_totals.get(name, 0)}",
+        ]
+
+    return "\n".join(lines) + "\n"
@@ -1,11 +1,9 @@
-import logging
-import time
+from datetime import datetime
 
-from redis.exceptions import TimeoutError
+from arq.jobs import Job, JobStatus
 
-from api.settings import DOWNLOAD_JOB_TIMEOUT
-
-log = logging.getLogger("api")
+from api.logger import log
+from api.settings import DOWNLOAD_JOB_TIMEOUT, REDIS_QUEUE
 
 
 JOB_PREFIX = "arq:job-progress:"
@@ -24,19 +22,8 @@ async def set_progress(redis, job_id, progress=0, message=""):
         short status message, if any
     """
 
-    retry = 0
-    while retry <= 5:
-        try:
-            await redis.setex(f"{JOB_PREFIX}{job_id}", EXPIRATION, f"{progress}|{message}")
-            return
-
-        except TimeoutError as ex:
-            retry += 1
-            if retry >= 5:
-                raise ex
-
-            log.error(f"Redis connection timeout in set_progress, retry {retry}")
-            time.sleep(2)
+    # NOTE: Redis timeouts are retried by the connection pool (see settings.REDIS)
+    await redis.setex(f"{JOB_PREFIX}{job_id}", EXPIRATION, f"{progress}|{message}")
 
 
 async def get_progress(redis, job_id):
@@ -53,23 +40,89 @@ async def get_progress(redis, job_id):
         tuple of progress percent, message, errors
     """
 
-    retry = 0
-    while retry <= 5:
-        try:
-            progress = await redis.get(f"{JOB_PREFIX}{job_id}")
+    # NOTE: Redis timeouts are retried by the connection pool (see settings.REDIS)
+    progress = await redis.get(f"{JOB_PREFIX}{job_id}")
+
+    if progress is None:
+        return 0, ""
+
+    progress, message = progress.decode("UTF8").split("|")
+
+    return int(progress), message
+
+
+async def get_queue_position(redis, job_id):
+    """Get the position of a job in the queue.
+
+    arq stores queued jobs in a Redis sorted set scored by enqueue time; a job
+    is added at enqueue and removed once it is finished, so the rank of the
+    job in that set is its position in the queue.
+
+    Parameters
+    ----------
+    redis: redis connection pool
+    job_id : str
+
+    Returns
+    -------
+    int
+        0 if job is not found in queue
+    """
+    position = await redis.zrank(REDIS_QUEUE, job_id)
+    return position or 0
+
+
+async def get_job_status(redis, job_id):
+    """Get status of a download job.
+
+    Job status values derived from JobStatus enum at:
+    https://github.com/samuelcolvin/arq/blob/master/arq/jobs.py
+    ['deferred', 'queued', 'in_progress', 'complete', 'not_found']
+
+    We add ['success', 'failed'] status values here.
+
+    Parameters
+    ----------
+    redis: redis connection pool
+    job_id : str
+
+    Returns
+    -------
+    dict
+        {"status": "...", "progress": 0-100, "path": "...only if success...", "detail": "...only if failed..."}
+    """
+    job = Job(job_id, redis=redis, _queue_name=REDIS_QUEUE)
+    job_status = await job.status()
+
+    if job_status == JobStatus.not_found:
+        return {"status": job_status}
+
+    if job_status == JobStatus.queued:
+        job_info = await job.info()
+        elapsed_time = datetime.now(tz=job_info.enqueue_time.tzinfo) - job_info.enqueue_time
+
+        return {
+            "status": job_status,
+            "progress": 0,
+            "queue_position": await get_queue_position(redis, job_id),
+            "elapsed_time": elapsed_time.seconds,
+        }
 
-            if progress is None:
-                return 0, ""
+    if job_status != JobStatus.complete:
+        progress, message = await get_progress(redis, job_id)
 
-            progress, message = progress.decode("UTF8").split("|")
+        return {
+            "status": job_status,
+            "progress": progress,
+            "message": message,
+        }
 
-            return int(progress), message
+    info = await job.result_info()
 
-        except TimeoutError as ex:
-            retry += 1
+    if info.success:
+        return {"status": "success", "path": f"/downloads/custom/{info.result}"}
 
-            if retry >= 5:
-                raise ex
+    # result is the exception raised in the worker
+    log.error(info.result)
 
-            log.error(f"Redis connection timeout in get_progress, retry {retry}")
-            time.sleep(2)
+    return {"status": "failed", "detail": "Internal server error"}
@@ -0,0 +1,81 @@
+import re
+
+import numpy as np
+import pyarrow as pa
+
+from api.data import search_index
+from api.lib.trigrams import get_query_trigrams
+
+
+def search_names(query, limit):
+    """Search barrier names using the trigram index of search keys.
+
+    Candidates are search keys that contain all trigrams of the query, ranked
+    by trigram similarity to the query (keys with fewer trigrams are more
+    similar because all query trigrams are present), then by length of key,
+    then by priority of barrier type.  Only the top candidates are verified to contain the words of
+    the query in order (equivalent to search_key LIKE '%word1%word2%').
+
+    Parameters
+    ----------
+    query : str
+    limit : int
+        maximum number of SARPIDs to return
+
+    Returns
+    -------
+    (int, list of str) or None
+        tuple of total count and SARPIDs of top matches, in order; the count
+        is approximate if there are more candidates than were verified.  None
+        if the search index is not available or query has no trigrams.
+    """
+    if search_index is None:
+        return None
+
+    trigrams = get_query_trigrams(query)
+    if not trigrams:
+        return None
+
+    postings = []
+    for trigram in trigrams:
+        index = search_index["trigrams"].get(trigram, None)
+        if index is None:
+            return 0, []
+
+        postings.append(search_index["rows"][search_index["offsets"][index] : search_index["offsets"][index + 1]])
+
+    # intersect posting lists of rows, starting from the shortest
+    postings = sorted(postings, key=len)
+    rows = postings[0]
+    for posting in postings[1:]:
+        rows = np.intersect1d(rows, posting, assume_unique=True)
+        if len(rows) == 0:
+            return 0, []
+
+    # rank by number of trigrams, then length of search key, then row (rows are
+    # in order of priority then SARPID)
+    rank = (
+        (search_index["num_trigrams"][rows].astype("uint64") << 48)
+        | (search_index["length"][rows].astype("uint64") << 32)
+        | rows.astype("uint64")
+    )
+
+    pattern = re.compile(".*".join(re.escape(word) for word in query.lower().split()))
+    keys = search_index["search_key"]
+
+    # verify the top candidates in order until there are enough matches
+    k = min(limit * 4, len(rows))
+    while True:
+        top = rank if k == len(rows) else rank[np.argpartition(rank, k - 1)[:k]]
+        top = np.sort(top) & np.uint64(0xFFFFFFFF)
+        matches = [row for row in top if pattern.search(keys[row].as_py())]
+
+        if len(matches) >= limit or k == len(rows):
+            break
+
+        k = min(k * 4, len(rows))
+
+    # count is exact if all candidates were verified
+    total = len(matches) if k == len(rows) else len(rows)
+
+    return total, search_index["SARPID"].take(pa.array(matches[:limit], type="uint32")).to_pylist()
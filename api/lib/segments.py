@@ -0,0 +1,107 @@
+import struct
+import zlib
+
+
+# gzip header with no file name or modification time (RFC 1952)
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+# empty final deflate block that ends a series of segments
+FINAL_BLOCK = b"\x03\x00"
+
+# reversed CRC-32 polynomial used by gzip
+CRC32_POLY = 0xEDB88320
+
+
+def _multmodp(a, b):
+    """Multiply a and b modulo the CRC-32 polynomial (see zlib crc32.c)."""
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if (a & (m - 1)) == 0:
+                break
+        m >>= 1
+        b = (b >> 1) ^ CRC32_POLY if b & 1 else b >> 1
+
+    return p
+
+
+# x^(2^n) modulo the CRC-32 polynomial
+_X2N_TABLE = [1 << 30]
+for _ in range(31):
+    _X2N_TABLE.append(_multmodp(_X2N_TABLE[-1], _X2N_TABLE[-1]))
+
+
+def get_crc32_shift(size):
+    """Get the operator used to combine the CRC-32 of data before a segment
+    of size bytes with the CRC-32 of that segment.
+
+    Parameters
+    ----------
+    size : int
+        uncompressed size of segment
+
+    Returns
+    -------
+    int
+    """
+    # x^(8 * size) modulo the CRC-32 polynomial
+    p = 1 << 31
+    k = 3
+    while size:
+        if size & 1:
+            p = _multmodp(_X2N_TABLE[k & 31], p)
+        size >>= 1
+        k += 1
+
+    return p
+
+
+def compress_segment(data):
+    """Compress data as a segment of deflate blocks that can be concatenated
+    with other segments into a single gzip stream.
+
+    Parameters
+    ----------
+    data : bytes
+
+    Returns
+    -------
+    (bytes, list)
+        tuple of compressed segment and its [crc, size, shift]
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # sync flush ends the segment on a byte boundary without a final block
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    return compressed, [zlib.crc32(data), len(data), get_crc32_shift(len(data))]
+
+
+def iter_gzip_segments(content, segments):
+    """Concatenate compressed segments into a single gzip stream.
+
+    Parameters
+    ----------
+    content : memoryview
+        compressed segments
+    segments : list of [offset, length, crc, size, shift, ...]
+        offset and length of each segment within content, and values from
+        compress_segment()
+
+    Yields
+    ------
+    bytes or memoryview
+    """
+    crc = 0
+    size = 0
+
+    yield GZIP_HEADER
+
+    for offset, length, segment_crc, segment_size, shift, *_ in segments:
+        yield content[offset : offset + length]
+
+        crc = _multmodp(shift, crc) ^ segment_crc
+        size += segment_size
+
+    yield FINAL_BLOCK + struct.pack("<II", crc, size & 0xFFFFFFFF)
@@ -2,6 +2,8 @@ import numpy as np
 import pyarrow as pa
 import pyarrow.compute as pc
 
+from api.lib.profiling import span
+
 
 SCENARIOS = {
     # NetworkConnectivity
@@ -35,88 +37,101 @@ METRICS = [
 ]
 
 
-def calculate_score(column, ascending=True):
-    """Calculate score based on the rank of a row's value within the sorted array of unique values.
-    By default, the smallest unique value receives the lowest score, and the largest unique value
-    receives the highest score.
+def calculate_scores(df, fields):
+    """Calculate scores for each field based on the rank of a row's value within
+    the sorted array of unique values of that field.  The smallest unique value
+    receives a score of 0, and the largest unique value receives a score of 1.
+
+    Unique values are found by dictionary-encoding each field, so that only the
+    unique values need to be sorted.
 
     Parameters
     ----------
-    series : pyarrow ChunkedArray
-        Array from which to extract unique values and assign scores.
-    ascending : boolean (default: True)
-        If True, unique values are sorted in ascending order, meaning that the lowest score is the
-        lowest unique value in the series, and the highest score is the length of the unique values.
+    df : pyarrow.Table
+    fields : list-like of field names
 
     Returns
     -------
-    numpy.ndarray, dtype is float64
-        score value for each entry in the array
+    numpy.ndarray of shape (len(df), len(fields)), dtype is float64
+        score value for each entry in each field
     """
-    unique = column.unique()
-    rank_size = len(unique) - 1 or 1  # to prevent divide by 0
+    # column-major so that each field's scores are contiguous
+    scores = np.empty((len(df), len(fields)), dtype="float64", order="F")
+
+    for i, field in enumerate(fields):
+        encoded = pc.dictionary_encode(df[field]).combine_chunks()
+        unique = encoded.dictionary
+        rank_size = len(unique) - 1 or 1  # to prevent divide by 0
+
+        # position of each unique value within sorted unique values
+        unique_rank = np.empty(len(unique), dtype="float64")
+        unique_rank[pc.sort_indices(unique).to_numpy()] = np.arange(len(unique))
+
+        # convert position of value within sorted unique values to 0-1 scale
+        np.divide(unique_rank, rank_size, out=unique_rank)
+        np.take(unique_rank, encoded.indices.to_numpy(), out=scores[:, i])
 
-    sort_indices = (
-        pc.sort_indices(unique, sort_keys=[("", "ascending" if ascending else "descending")]).to_numpy().astype("int64")
-    )
+    return scores
 
-    # convert position of value within sorted unique values to 0-1 scale
-    score = np.searchsorted(unique, column, sorter=sort_indices) / rank_size
-    return score
 
+def calculate_composite_scores(scores, fields):
+    """Calculate composite scores for each scenario, with all inputs of each
+    scenario weighted equally.
 
-def calculate_composite_score(scores, columns, weights=None):
-    """Calculate composite score calculated across columns.
+    Scenarios that are composed of other scenarios use the composite scores of
+    those scenarios, so scenarios must be listed after their inputs in SCENARIOS.
 
     Parameters
     ----------
-    scores : dict
-        contains keys corresponding to columns, values are ndarrays
-    columns : list-like of column names
-    weights : list-like, optional (default: None)
-        list-like of weights.  It is up to caller to make sure these sum to 1.  By default,
-        if no weights are provided, all columns are weighted equally.  If provided, must
-        be same length as dataframe.columns
+    scores : numpy.ndarray of shape (n, len(fields))
+        scores from calculate_scores
+    fields : list-like of field names in scores
 
     Returns
     -------
-    numpy.array, dtype is int
-        tiers
+    numpy.ndarray of shape (n, len(SCENARIOS)), dtype is float64
     """
+    columns = {field: scores[:, i] for i, field in enumerate(fields)}
 
-    num_cols = len(columns)
-    if weights is None:
-        # all columns weighted equally
-        weights = [1.0 / num_cols] * num_cols
+    composite = np.zeros((len(scores), len(SCENARIOS)), dtype="float64", order="F")
+    for i, (scenario, inputs) in enumerate(SCENARIOS.items()):
+        weight = 1.0 / len(inputs)
+        out = composite[:, i]
 
-    elif not len(weights) == num_cols:
-        raise ValueError("weights must be same length as number of columns in input data frame")
+        # NOTE: inputs are added in order so that results are consistent with
+        # previous versions of this function; changing the order of operations
+        # causes floating point differences that change tiers at bin edges
+        for col in inputs:
+            out += columns[col] * weight
 
-    score = np.sum([scores[col] * weight for col, weight in zip(columns, weights)], axis=0)
+        columns[scenario] = out
 
-    return score
+    return composite
 
 
 def calculate_tier(scores):
     """Calculate tiers based on 5% increments of the composite score calculated
-    across columns.
+    across columns, for each column of scores.
 
     The lowest tier (1) is the highest 95% of the composite score range.
 
     Parameters
     ----------
-    scores : numpy.ndarray
+    scores : numpy.ndarray of shape (n, number of scenarios)
 
     Returns
     -------
-    numpy.ndarray
+    numpy.ndarray of shape (n, number of scenarios)
     """
 
-    min_score, max_score = pc.min_max(scores).as_py().values()
-    score_range = (max_score - min_score) or 1  # avoid divide by 0
+    min_score = scores.min(axis=0)
+    score_range = scores.max(axis=0) - min_score
+    score_range[score_range == 0] = 1  # avoid divide by 0
 
-    # calculate relative score
-    relative_score = 100.0 * (scores - min_score) / score_range
+    # calculate relative score (in place to avoid extra copies)
+    relative_score = scores - min_score
+    relative_score *= 100.0
+    relative_score /= score_range
 
     # break into 5% increments, such that tier 0 is in top 95% of the relative scores
     bins = np.arange(95, -5, -5)
@@ -132,8 +147,6 @@ def calculate_tiers(df):
     ----------
     df : pyarrow.Table
         Input data frame containing at least all input fields
-    group_field: str, optional (default: None)
-        Name of a column to use for grouping tier calculation (all scores will be based on values within each group).
 
     Returns
     -------
@@ -141,11 +154,11 @@ def calculate_tiers(df):
         Table is in same order as input
     """
 
-    scores = {field: calculate_score(df[field]) for field in METRICS}
+    if len(df) == 0:
+        return pa.Table.from_pydict({f"{scenario}_tier": pa.array([], "uint8") for scenario in SCENARIOS})
 
-    tiers = {}
-    for scenario, inputs in SCENARIOS.items():
-        scores[scenario] = calculate_composite_score(scores, columns=[field for field in inputs])
-        tiers[f"{scenario}_tier"] = calculate_tier(scores[scenario])
+    with span("tiers"):
+        scores = calculate_scores(df, METRICS)
+        tiers = calculate_tier(calculate_composite_scores(scores, METRICS))
 
-    return pa.Table.from_pydict(tiers)
+        return pa.Table.from_pydict({f"{scenario}_tier": tiers[:, i] for i, scenario in enumerate(SCENARIOS)})
@@ -0,0 +1,46 @@
+def get_trigrams(text):
+    """Get the set of trigrams in each word of text.
+
+    Each word is padded with two leading spaces, so that words of 1-2
+    characters can be matched against the start of words.
+
+    Parameters
+    ----------
+    text : str
+
+    Returns
+    -------
+    set of str
+    """
+    trigrams = set()
+    for word in text.lower().split():
+        padded = f"  {word}"
+        trigrams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+
+    return trigrams
+
+
+def get_query_trigrams(query):
+    """Get the set of trigrams that must be present for a search key to match
+    all words in query.
+
+    Words of at least 3 characters can match anywhere within a word of the
+    search key, so only their unpadded trigrams are used.  Shorter words
+    can only be matched against the start of words.
+
+    Parameters
+    ----------
+    query : str
+
+    Returns
+    -------
+    set of str
+    """
+    trigrams = set()
+    for word in query.lower().split():
+        if len(word) >= 3:
+            trigrams.update(word[i : i + 3] for i in range(len(word) - 2))
+        else:
+            trigrams.update(get_trigrams(word))
+
+    return trigrams
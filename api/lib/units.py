@@ -0,0 +1,148 @@
+import re
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from api.constants import SUMMARY_UNIT_FIELDS
+
+
+# maximum number of bytes of each word suffix stored in the prefix index;
+# longer queries are verified against the full key
+KEY_PREFIX_LENGTH = 24
+
+
+def create_unit_catalog(df):
+    """Create in-memory catalog of summary units with an index of ids in each
+    layer and a sorted index of the suffixes of keys that start at each word,
+    so that keys with words that start with a query can be found using a
+    binary search.
+
+    Parameters
+    ----------
+    df : pyarrow.Table
+        map_units table with SUMMARY_UNIT_FIELDS, key, and priority
+
+    Returns
+    -------
+    dict
+    """
+    layers = df["layer"].to_pylist()
+    ids = df["id"].to_pylist()
+    keys = df["key"].to_pylist()
+
+    suffixes = []
+    suffix_rows = []
+    suffix_positions = []
+    for row, key in enumerate(keys):
+        for match in re.finditer(r"\S+", key):
+            suffixes.append(key[match.start() :].encode("UTF8")[:KEY_PREFIX_LENGTH])
+            suffix_rows.append(row)
+            suffix_positions.append(match.start())
+
+    suffixes = np.array(suffixes, dtype=f"S{KEY_PREFIX_LENGTH}")
+    ix = np.argsort(suffixes, kind="stable")
+
+    # use integer codes of layer and state for faster filtering and sorting;
+    # codes of state are in sorted order of state
+    layer_values, layer_codes = np.unique(np.array(layers, dtype="U"), return_inverse=True)
+    _, state_codes = np.unique(np.array(pc.fill_null(df["state"], "").to_pylist(), dtype="U"), return_inverse=True)
+
+    id_index = {}
+    for row, (layer, id) in enumerate(zip(layers, ids)):
+        id_index.setdefault(layer, {})[id] = row
+
+    return {
+        "units": df.select(SUMMARY_UNIT_FIELDS).combine_chunks(),
+        "keys": df["key"].combine_chunks(),
+        "ids": id_index,
+        "layers": {layer: code for code, layer in enumerate(layer_values)},
+        "layer": layer_codes.astype("uint8"),
+        "priority": df["priority"].to_numpy(),
+        "length": pc.utf8_length(df["key"]).to_numpy(),
+        "state": state_codes.astype("uint32"),
+        "suffixes": suffixes[ix],
+        "suffix_rows": np.array(suffix_rows, dtype="uint32")[ix],
+        "suffix_positions": np.array(suffix_positions, dtype="uint16")[ix],
+    }
+
+
+def get_units(catalog, layer, ids):
+    """Get units by id within a layer.
+
+    Parameters
+    ----------
+    catalog : dict
+        catalog from create_unit_catalog()
+    layer : str
+    ids : list-like of str
+
+    Returns
+    -------
+    pyarrow.Table
+        table of SUMMARY_UNIT_FIELDS of units found, in order of ids
+    """
+    layer_ids = catalog["ids"].get(layer, {})
+    rows = [layer_ids[id] for id in dict.fromkeys(ids) if id in layer_ids]
+
+    return catalog["units"].take(pa.array(rows, type="uint32"))
+
+
+def search_units(catalog, layers, query, limit):
+    """Search units by words that start with query, ordered by priority of
+    layer, position of match in key, length of key, and state.
+
+    The first word of the query is found using a binary search of the suffix
+    index; other words must follow the first in order (equivalent to key LIKE
+    '%word1%word2%').
+
+    Parameters
+    ----------
+    catalog : dict
+        catalog from create_unit_catalog()
+    layers : list-like of str
+    query : str
+    limit : int
+
+    Returns
+    -------
+    (int, pyarrow.Table)
+        tuple of total count and table of SUMMARY_UNIT_FIELDS of top matches
+    """
+    words = query.split()
+    if not words:
+        return 0, catalog["units"].slice(0, 0)
+
+    prefix = words[0].encode("UTF8")[:KEY_PREFIX_LENGTH]
+    start = np.searchsorted(catalog["suffixes"], prefix, side="left")
+    # 0xff never occurs in UTF-8, so it sorts after all suffixes that start with prefix
+    stop = np.searchsorted(catalog["suffixes"], prefix + b"\xff", side="left")
+
+    rows = catalog["suffix_rows"][start:stop]
+    positions = catalog["suffix_positions"][start:stop]
+
+    layer_codes = [catalog["layers"][layer] for layer in layers if layer in catalog["layers"]]
+    rows_in_layers = np.isin(catalog["layer"][rows], layer_codes)
+    rows = rows[rows_in_layers]
+    positions = positions[rows_in_layers]
+
+    # keep first position of match within each row
+    ix = np.lexsort((positions, rows))
+    rows = rows[ix]
+    positions = positions[ix]
+    first = np.concatenate([[True], rows[1:] != rows[:-1]]) if len(rows) else np.array([], dtype="bool")
+    rows = rows[first]
+    positions = positions[first]
+
+    # verify that other words are present, or the full first word if it
+    # was truncated in the index
+    if len(words) > 1 or len(words[0].encode("UTF8")) > KEY_PREFIX_LENGTH:
+        pattern = ".*".join(re.escape(word) for word in words)
+        is_match = pc.match_substring_regex(catalog["keys"].take(pa.array(rows, type="uint32")), pattern)
+        is_match = is_match.to_numpy(zero_copy_only=False)
+        rows = rows[is_match]
+        positions = positions[is_match]
+
+    top = np.lexsort((catalog["state"][rows], catalog["length"][rows], positions, catalog["priority"][rows]))[:limit]
+
+    return len(rows), catalog["units"].take(pa.array(rows[top], type="uint32"))
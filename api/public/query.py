@@ -10,14 +10,44 @@ from api.constants import (
     SB_PUBLIC_EXPORT_FIELDS,
 )
 from api.lib.domains import unpack_domains
-from api.data import dams, small_barriers, removed_dams
+from api.lib.executor import run_in_executor
+from api.data import dams, small_barriers, removed_dams, public_csv
 from api.logger import log, log_request
-from api.response import csv_response
+from api.lib.segments import iter_gzip_segments
+from api.response import csv_response, get_accepted_encodings, gzip_response, iter_buffer
 
 
 router = APIRouter()
 
 
+def extract_by_state(dataset, columns, ids):
+    """Extract barriers in states, with barriers without networks first and
+    then by state in the order of ids (same order as the pre-compressed CSV
+    segments).
+
+    Parameters
+    ----------
+    dataset : pyarrow.dataset.Dataset
+    columns : list
+    ids : pyarrow.Array
+        unique state abbreviations
+
+    Returns
+    -------
+    pyarrow.Table
+        table with domains unpacked to values
+    """
+    df = dataset.scanner(columns=columns, filter=pc.is_in(pc.field("State"), ids)).to_table()
+
+    # sort is stable, so barriers within each state remain in dataset order
+    order = pc.sort_indices(
+        pa.table({"HasNetwork": df["HasNetwork"], "state": pc.index_in(df["State"], value_set=ids)}),
+        sort_keys=[("HasNetwork", "ascending"), ("state", "ascending")],
+    )
+
+    return unpack_domains(df.take(order))
+
+
 @router.get("/{barrier_type}/state")
 async def query_by_state(request: Request, barrier_type: PublicAPIBarrierTypes, id: str):
     """Return subset of barrier_type based on state abbreviations.
@@ -48,14 +78,31 @@ async def query_by_state(request: Request, barrier_type: PublicAPIBarrierTypes,
     if invalid:
         raise HTTPException(400, detail=f"ids are not valid: {', '.join(invalid)}")
 
-    ids = pa.array(ids)
+    # use pre-compressed CSV segments if available and accepted by the client
+    if barrier_type in public_csv and "gzip" in get_accepted_encodings(request):
+        content = memoryview(public_csv[barrier_type]["content"])
+        index = public_csv[barrier_type]["index"]
 
-    df = dataset.scanner(columns=columns, filter=pc.is_in(pc.field("State"), ids)).to_table().sort_by("HasNetwork")
-    df = unpack_domains(df)
+        # barriers without networks first
+        segments = [index["header"]] + [
+            index["segments"][has_network][id]
+            for has_network in ["false", "true"]
+            for id in dict.fromkeys(ids)
+            if id in index["segments"][has_network]
+        ]
+
+        count = sum(segment[-1] for segment in segments[1:])
+        log.info(f"public query selected {count:,} {barrier_type.replace('_', ' ')}")
+
+        return gzip_response(iter_gzip_segments(content, segments), media_type="text/csv")
+
+    ids = pa.array(list(dict.fromkeys(ids)))
+
+    df = await run_in_executor("public", extract_by_state, dataset, columns, ids)
 
     log.info(f"public query selected {len(df):,} {barrier_type.replace('_', ' ')}")
 
-    return csv_response(df)
+    return csv_response(df, request=request)
 
 
 @router.get("/removed_dams")
@@ -65,6 +112,10 @@ async def query_removed_dams(
     """Return dams that were removed for conservation"""
 
     log_request(request)
-    df = unpack_domains(removed_dams.to_table())
 
-    return csv_response(df)
+    if "removed_dams" in public_csv and "gzip" in get_accepted_encodings(request):
+        return gzip_response(iter_buffer(public_csv["removed_dams"]["content"]), media_type="text/csv")
+
+    df = await run_in_executor("public", lambda: unpack_domains(removed_dams.to_table()))
+
+    return csv_response(df, request=request)
@@ -1,62 +1,366 @@
-from io import BytesIO
-from zipfile import ZipFile, ZIP_DEFLATED
+import zlib
 
-from fastapi.responses import Response
-from pyarrow.feather import write_feather
-from pyarrow.csv import write_csv
+from fastapi.responses import Response, StreamingResponse
+import pyarrow as pa
+from pyarrow.csv import CSVWriter
 
+from api.lib.profiling import count, span
+from api.settings import RESPONSE_COMPRESSION
 
-def csv_response(df, bounds=None):
-    """Write data frame to CSV and return Response with proper headers
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# maximum number of records to serialize into each chunk of a streaming response
+RESPONSE_BATCH_SIZE = 65_536
+
+# size of chunks of serialized responses sent at a time
+RESPONSE_CHUNK_SIZE = 1 << 20
+
+# Feather format in JS Arrow lib does not yet support compressed
+IPC_WRITE_OPTIONS = pa.ipc.IpcWriteOptions(compression=None)
+
+# supported content encodings, in order of preference
+CONTENT_ENCODINGS = (["zstd"] if zstandard is not None else []) + ["gzip"]
+
+
+class ChunkSink:
+    """Writable file-like object that collects chunks written to it, so that
+    they can be sent as they are written instead of serializing the entire
+    response first.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        # data may be a view of a buffer that is reused by the writer
+        self.chunks.append(data if isinstance(data, bytes) else bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        """Return chunks written since the last call to drain().
+
+        Returns
+        -------
+        list of bytes
+        """
+        chunks = self.chunks
+        self.chunks = []
+        count("bytes_serialized", sum(len(chunk) for chunk in chunks))
+        return chunks
+
+
+def get_accepted_encodings(request):
+    """Get the content encodings accepted by the client.
+
+    Parameters
+    ----------
+    request : Request
+
+    Returns
+    -------
+    set of str
+    """
+    accepted = set()
+    for value in request.headers.get("accept-encoding", "").split(","):
+        encoding, _, params = value.strip().partition(";")
+        if params.strip().replace(" ", "") in {"q=0", "q=0.0"}:
+            continue
+        accepted.add(encoding.strip().lower())
+
+    return accepted
+
+
+def get_content_encoding(request):
+    """Get the preferred content encoding supported by the client, if
+    compression of responses is enabled.
+
+    Parameters
+    ----------
+    request : Request
+
+    Returns
+    -------
+    str or None
+        None if compression is disabled or none of CONTENT_ENCODINGS are accepted
+    """
+    if request is None or not RESPONSE_COMPRESSION:
+        return None
+
+    accepted = get_accepted_encodings(request)
+    for encoding in CONTENT_ENCODINGS:
+        if encoding in accepted:
+            return encoding
+
+    return None
+
+
+def encode_chunks(chunks, encoding):
+    """Compress chunks as they are generated.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+    encoding : str
+        one of CONTENT_ENCODINGS
+
+    Yields
+    ------
+    bytes
+    """
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        # wbits=31 writes gzip header and trailer
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+def stream_response(chunks, media_type, request=None, headers=None):
+    """Create a response that sends chunks as they are generated, compressing
+    them if enabled and supported by the client.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+    media_type : str
+    request : Request, optional (default: None)
+        used to negotiate content encoding
+    headers : dict, optional (default: None)
+
+    Returns
+    -------
+    fastapi StreamingResponse
+    """
+    headers = headers or {}
+
+    encoding = get_content_encoding(request)
+    if encoding is not None:
+        chunks = encode_chunks(chunks, encoding)
+        headers = {**headers, "Content-Encoding": encoding, "Vary": "Accept-Encoding"}
+
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+def gzip_response(chunks, media_type, headers=None):
+    """Create a response that sends chunks that are already compressed using
+    gzip (each chunk may be a separate gzip member).
+
+    Parameters
+    ----------
+    chunks : iterable of bytes or memoryview
+    media_type : str
+    headers : dict, optional (default: None)
+
+    Returns
+    -------
+    fastapi StreamingResponse
+    """
+    headers = {**(headers or {}), "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+def iter_feather(table):
+    """Serialize table to feather (Arrow IPC file format), one batch at a time.
+
+    Parameters
+    ----------
+    table : pyarrow Table
+
+    Yields
+    ------
+    bytes
+    """
+    sink = ChunkSink()
+    with pa.ipc.new_file(sink, table.schema, options=IPC_WRITE_OPTIONS) as writer:
+        for batch in table.to_batches(max_chunksize=RESPONSE_BATCH_SIZE):
+            with span("serialize"):
+                writer.write_batch(batch)
+
+            yield from sink.drain()
+
+    yield from sink.drain()
+
+
+def iter_csv(table):
+    """Serialize table to CSV, one batch at a time.
+
+    Parameters
+    ----------
+    table : pyarrow Table
+
+    Yields
+    ------
+    bytes
+    """
+    sink = ChunkSink()
+    with CSVWriter(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=RESPONSE_BATCH_SIZE):
+            with span("serialize"):
+                writer.write_batch(batch)
+
+            yield from sink.drain()
+
+    yield from sink.drain()
+
+
+def iter_buffer(buffer):
+    """Split a serialized buffer into chunks without copying it.
+
+    Parameters
+    ----------
+    buffer : bytes or pyarrow Buffer
+
+    Yields
+    ------
+    memoryview
+    """
+    view = memoryview(buffer)
+    for i in range(0, len(view), RESPONSE_CHUNK_SIZE):
+        yield view[i : i + RESPONSE_CHUNK_SIZE]
+
+
+def prepare_feather(df, bounds=None):
+    """Lowercase column names and set bounds in the schema metadata (discarding
+    any pandas metadata).
+
+    Parameters
+    ----------
+    df : pyarrow Table
+    bounds : list-like of [xmin, ymin, xmax, ymax], optional (default: None)
+
+    Returns
+    -------
+    pyarrow Table
+    """
+    cols = [c.lower() for c in df.schema.names]
+    table = df.rename_columns(cols)
+
+    return table.replace_schema_metadata({"bounds": ",".join(str(b) for b in bounds) if bounds is not None else ""})
+
+
+def to_feather_buffer(df, bounds=None):
+    """Serialize data frame to feather (Arrow IPC) for responses that are cached.
 
     Parameters
     ----------
     df : pyarrow Table
     bounds : list-like of [xmin, ymin, xmax, ymax], optional (default: None)
 
+    Returns
+    -------
+    pyarrow Buffer
+    """
+    table = prepare_feather(df, bounds)
+
+    with span("serialize"):
+        stream = pa.BufferOutputStream()
+        with pa.ipc.new_file(stream, table.schema, options=IPC_WRITE_OPTIONS) as writer:
+            writer.write_table(table, max_chunksize=RESPONSE_BATCH_SIZE)
+
+        # this does not copy the underlying data
+        buffer = stream.getvalue()
+
+    count("bytes_serialized", buffer.size)
+
+    return buffer
+
+
+def buffer_response(buffer, media_type="application/octet-stream", request=None):
+    """Return Response for content that has already been serialized.
+
+    Parameters
+    ----------
+    buffer : bytes or pyarrow Buffer
+    media_type : str, optional (default: "application/octet-stream")
+    request : Request, optional (default: None)
+        used to negotiate content encoding
+
     Returns
     -------
     fastapi Response
     """
+    if get_content_encoding(request) is None:
+        return Response(content=memoryview(buffer), media_type=media_type)
 
-    csv_stream = BytesIO()
-    cols = [c.lower() for c in df.schema.names]
-    write_csv(df.rename_columns(cols).combine_chunks(), csv_stream)
+    return stream_response(iter_buffer(buffer), media_type=media_type, request=request)
 
-    response = Response(content=csv_stream.getvalue(), media_type="text/csv")
 
-    if bounds is not None:
-        response.headers["X-BOUNDS"] = ",".join(str(b) for b in bounds)
+def arrow_response(table, request=None):
+    """Stream table as feather (Arrow IPC) in batches.
 
-    return response
+    Parameters
+    ----------
+    table : pyarrow Table
+    request : Request, optional (default: None)
+        used to negotiate content encoding
+
+    Returns
+    -------
+    fastapi StreamingResponse
+    """
+    return stream_response(iter_feather(table), media_type="application/octet-stream", request=request)
 
 
-def feather_response(df, bounds=None):
-    """Write data frame to feather (Arrow IPC) and return Response with proper headers
+def csv_response(df, bounds=None, request=None):
+    """Stream data frame as CSV in batches and return Response with proper headers
 
     Parameters
     ----------
     df : pyarrow Table
     bounds : list-like of [xmin, ymin, xmax, ymax], optional (default: None)
+    request : Request, optional (default: None)
+        used to negotiate content encoding
 
     Returns
     -------
-    fastapi Response
+    fastapi StreamingResponse
     """
 
     cols = [c.lower() for c in df.schema.names]
-    table = df.rename_columns(cols)
 
-    # discard pandas metadata and set bounds
-    table = table.replace_schema_metadata({"bounds": ",".join(str(b) for b in bounds) if bounds is not None else ""})
+    headers = {}
+    if bounds is not None:
+        headers["X-BOUNDS"] = ",".join(str(b) for b in bounds)
+
+    return stream_response(iter_csv(df.rename_columns(cols)), media_type="text/csv", request=request, headers=headers)
+
+
+def feather_response(df, bounds=None, request=None):
+    """Stream data frame as feather (Arrow IPC) in batches and return Response with proper headers
 
-    stream = BytesIO()
-    write_feather(
-        table,
-        stream,
-        # Feather format in JS Arrow lib does not yet support compressed
-        compression="uncompressed",
-    )
-    response = Response(content=stream.getvalue(), media_type="application/octet-stream")
+    Parameters
+    ----------
+    df : pyarrow Table
+    bounds : list-like of [xmin, ymin, xmax, ymax], optional (default: None)
+    request : Request, optional (default: None)
+        used to negotiate content encoding
+
+    Returns
+    -------
+    fastapi StreamingResponse
+    """
 
-    return response
+    return arrow_response(prepare_feather(df, bounds), request=request)
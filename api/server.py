@@ -1,16 +1,21 @@
 from contextlib import asynccontextmanager
 import logging
+import re
+from time import perf_counter, strftime
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.requests import Request
-from fastapi.responses import Response
+from fastapi.responses import PlainTextResponse, Response
 
 import sentry_sdk
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 
+from api.dependencies import create_redis_pool
+from api.lib.executor import executor
+from api.lib.profiling import end_request, get_server_timing, render_metrics, start_request
 from api.logger import log
-from api.settings import ALLOWED_ORIGINS, SENTRY_DSN, API_ROOT_PATH, PROVIDE_DOWNLOAD_ENDPOINTS
+from api.settings import ALLOWED_ORIGINS, SENTRY_DSN, API_ROOT_PATH, API_PROFILE_DIR, PROVIDE_DOWNLOAD_ENDPOINTS
 from api.internal import router as internal_router
 from api.public import router as public_router
 from api.dev.downloads import router as dev_downloads_router
@@ -25,7 +30,7 @@ if SENTRY_DSN:
 ### Create the main API app
 
 
-# setup logger
+# setup logger and shared resources
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger = log
@@ -33,8 +38,20 @@ async def lifespan(app: FastAPI):
     handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s:\t%(message)s"))
     logger.addHandler(handler)
 
+    # create Redis connection pool shared across requests
+    try:
+        app.state.redis = await create_redis_pool()
+    except Exception as ex:
+        app.state.redis = None
+        log.error(f"Error connecting to Redis, is Redis offline?  {ex}")
+
     yield
 
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+
+    executor.shutdown(wait=False, cancel_futures=True)
+
 
 app = FastAPI(version="1.0", root_path=API_ROOT_PATH, docs_url=False, redoc_url=False, lifespan=lifespan)
 
@@ -62,6 +79,58 @@ async def catch_exceptions_middleware(request: Request, call_next):
         return Response("Internal server error", status_code=500)
 
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Middleware that records the time spent in each stage of a request
+    (see api.lib.profiling::span) and returns these in the Server-Timing header.
+
+    If API_PROFILE_DIR is set and the request includes ?profile=true, the
+    request is profiled and the profile is written to API_PROFILE_DIR.  The
+    profile covers the event loop thread, so it also includes other requests
+    handled while this request is in progress.
+
+    NOTE: stages of streaming responses that occur after the response starts
+    are only included in /metrics.
+
+    Parameters
+    ----------
+    request : Request
+    call_next : func
+        next func in the chain to call
+    """
+    profile = API_PROFILE_DIR is not None and request.query_params.get("profile", "").lower() in {"1", "true"}
+
+    metrics = start_request(profile=profile)
+    start = perf_counter()
+    status = 500
+
+    try:
+        response = await call_next(request)
+        status = response.status_code
+
+        elapsed = perf_counter() - start
+        response.headers["Server-Timing"] = get_server_timing(metrics, elapsed)
+
+        return response
+
+    finally:
+        # replace path parameters with their names to group requests by route
+        params = {str(value): f"{{{name}}}" for name, value in request.scope.get("path_params", {}).items()}
+        if "route" in request.scope:
+            route = "/".join(params.get(part, part) for part in request.url.path.split("/"))
+        else:
+            route = "unmatched"
+
+        profile = end_request(metrics, request.method, route, status, perf_counter() - start)
+
+        if profile is not None:
+            API_PROFILE_DIR.mkdir(exist_ok=True, parents=True)
+            path = re.sub(r"[^A-Za-z0-9]+", "_", request.url.path).strip("_")
+            filename = API_PROFILE_DIR / f"{strftime('%Y%m%d%H%M%S')}_{path}.prof"
+            profile.dump_stats(filename)
+            log.info(f"wrote profile of {request.url} to {filename}")
+
+
 app.add_middleware(SentryAsgiMiddleware)
 
 ### Enable CORS
@@ -76,6 +145,14 @@ app.add_middleware(
 
 
 ### Add the routes to the main app
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Return request and stage timings and counts for this API process in
+    Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 app.include_router(internal_router, prefix="/internal", include_in_schema=False)
 app.include_router(public_router, prefix="/public")
 
@@ -4,6 +4,8 @@ from pathlib import Path
 
 from arq.connections import RedisSettings
 from dotenv import load_dotenv
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
 
 load_dotenv()
 
@@ -31,16 +33,52 @@ LOGO_PATH = Path("ui/src/lib/assets/images/nacc_logo.svg").resolve()
 # custom download; otherwise these are handled via Caddy
 PROVIDE_DOWNLOAD_ENDPOINTS = bool(os.getenv("PROVIDE_DOWNLOAD_ENDPOINTS"))
 
+# compress API responses if supported by the client; this is not needed if
+# compression is handled by Caddy
+RESPONSE_COMPRESSION = bool(os.getenv("RESPONSE_COMPRESSION"))
+
+# read frequently used columns of barrier datasets when each API process starts
+API_PREWARM = os.getenv("API_PREWARM", "1") != "0"
+
+# if set, requests with ?profile=true are profiled using cProfile and the
+# profiles are written to this directory
+API_PROFILE_DIR = Path(os.getenv("API_PROFILE_DIR")) if os.getenv("API_PROFILE_DIR") else None
+
+# number of threads used to run CPU-bound work (extracting, ranking, etc) off
+# the event loop, and maximum number of concurrent requests for each endpoint
+# that are run in those threads; others wait until these are completed
+API_THREADS = int(os.getenv("API_THREADS", 4))
+API_ENDPOINT_CONCURRENCY = int(os.getenv("API_ENDPOINT_CONCURRENCY", 2))
+
 # number of records that can be downloaded directly from API endpoint without
 # requiring a background task
 MAX_IMMEDIATE_DOWNLOAD_RECORDS = 2000
 
-REDIS = RedisSettings(host="localhost", port=6379, retry_on_timeout=True, conn_timeout=2)
+# retry Redis commands that time out with exponential backoff, reconnecting as needed
+REDIS = RedisSettings(
+    host="localhost",
+    port=6379,
+    retry_on_timeout=True,
+    retry=Retry(ExponentialBackoff(cap=4, base=0.25), retries=5),
+    conn_timeout=2,
+    max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+)
+# check that idle Redis connections are still alive before reusing them after this many seconds
+REDIS_HEALTH_CHECK_INTERVAL = 30
 REDIS_QUEUE = "connectivity-tool"
 
+# national downloads are created in analysis/post/create_national_downloads.py
+NATIONAL_DOWNLOAD_DIR = API_DATA_PATH / "downloads"
+
 CUSTOM_DOWNLOAD_DIR = Path(os.getenv("CUSTOM_DOWNLOAD_DIR", "/tmp/sarp/downloads/custom"))
 CUSTOM_DOWNLOAD_DIR.mkdir(exist_ok=True, parents=True)
 
+# maximum size (in MB) of rank and query responses cached in memory per process
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256)) * 1024 * 1024
+
+# if set, rank and query responses are also cached to this directory
+RESPONSE_CACHE_DIR = Path(os.getenv("RESPONSE_CACHE_DIR")) if os.getenv("RESPONSE_CACHE_DIR") else None
+
 # time jobs out after 5 minutes
 DOWNLOAD_JOB_TIMEOUT = 300
 
@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+
+from analysis.lib.graph.speedups import CSRDirectedGraph, DirectedGraph
+
+
+def create_graph(seed, kind):
+    """Create source and target arrays of a random graph with non-contiguous
+    node ids.
+
+    Parameters
+    ----------
+    seed : int
+    kind : str
+        "tree": each node has one upstream node, like a flowline network
+        "downstream": each node has one downstream node, like a flowline
+        network facing downstream
+        "dag": each node may have multiple upstream nodes
+        "cycles": random edges, including cycles and duplicate edges
+
+    Returns
+    -------
+    (ndarray(int64), ndarray(int64))
+    """
+    rng = np.random.default_rng(seed)
+    n = 200
+
+    if kind == "tree":
+        target = np.arange(1, n)
+        source = np.array([rng.integers(0, i) for i in target])
+
+    elif kind == "downstream":
+        source = np.arange(1, n)
+        target = np.array([rng.integers(0, i) for i in source])
+
+    elif kind == "dag":
+        source = []
+        target = []
+        for i in range(1, n):
+            for parent in rng.choice(i, size=min(i, 3), replace=False):
+                source.append(parent)
+                target.append(i)
+
+        source = np.array(source)
+        target = np.array(target)
+
+    else:
+        source = rng.integers(0, n, 2 * n)
+        target = rng.integers(0, n, 2 * n)
+        source = np.concatenate([source, source[:10]])
+        target = np.concatenate([target, target[:10]])
+
+    return source.astype("int64") * 7 + 3, target.astype("int64") * 7 + 3
+
+
+def get_sources(seed, source, size=20):
+    """Get random unique source node ids, including ids that are not in graph."""
+    rng = np.random.default_rng(seed)
+    ids = np.unique(np.concatenate([source, [1, 2]]))
+    return np.unique(rng.choice(ids, size=size, replace=False))
+
+
+def sort_pairs(pairs):
+    return np.unique(pairs, axis=0)
+
+
+@pytest.mark.parametrize("kind", ["tree", "dag", "cycles"])
+@pytest.mark.parametrize("seed", range(5))
+def test_network_pairs(seed, kind):
+    source, target = create_graph(seed, kind)
+    sources = get_sources(seed, source)
+
+    expected = DirectedGraph(source, target).network_pairs(sources)
+    actual = CSRDirectedGraph(source, target).network_pairs(sources)
+
+    assert np.array_equal(sort_pairs(actual), sort_pairs(expected))
+
+
+@pytest.mark.parametrize("kind", ["tree", "dag", "cycles"])
+@pytest.mark.parametrize("seed", range(5))
+def test_descendants(seed, kind):
+    source, target = create_graph(seed, kind)
+    sources = get_sources(seed, source)
+
+    expected = DirectedGraph(source, target).descendants(sources)
+    actual = CSRDirectedGraph(source, target).descendants(sources)
+
+    assert actual == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_network_labels(seed):
+    source, target = create_graph(seed, "tree")
+    sources = get_sources(seed, source)
+
+    # break the graph at each source, like at barriers, so that networks are disjoint
+    ix = ~np.isin(target, sources)
+    source, target = source[ix], target[ix]
+
+    pairs = sort_pairs(DirectedGraph(source, target).network_pairs(sources))
+    nodes, labels, conflicts = CSRDirectedGraph(source, target).network_labels(sources)
+
+    actual = sort_pairs(np.column_stack([sources[labels], nodes]))
+
+    assert np.array_equal(actual, pairs)
+    assert len(conflicts) == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_network_labels_conflicts(seed):
+    source, target = create_graph(seed, "tree")
+    sources = get_sources(seed, source)
+
+    pairs = sort_pairs(DirectedGraph(source, target).network_pairs(sources))
+    nodes, labels, conflicts = CSRDirectedGraph(source, target).network_labels(sources)
+
+    # every node is assigned to one of the networks that contain it
+    assert np.array_equal(np.unique(nodes), np.unique(pairs[:, 1]))
+    assert np.isin(
+        np.column_stack([sources[labels], nodes]).view("int64,int64").ravel(), pairs.view("int64,int64").ravel()
+    ).all()
+
+    # nodes in multiple networks are conflicts
+    values, counts = np.unique(pairs[:, 1], return_counts=True)
+    assert np.array_equal(np.unique(conflicts), values[counts > 1])
+
+
+@pytest.mark.parametrize("kind", ["tree", "downstream", "dag", "cycles"])
+@pytest.mark.parametrize("seed", range(5))
+def test_accumulate_descendants(seed, kind):
+    source, target = create_graph(seed, kind)
+    sources = get_sources(seed, source)
+
+    # values for a subset of nodes, including nodes that are not in graph
+    rng = np.random.default_rng(seed)
+    ids = get_sources(seed + 1, np.concatenate([source, target]), size=100)
+    values = rng.integers(0, 10, (len(ids), 2))
+
+    pairs = sort_pairs(DirectedGraph(source, target).network_pairs(sources))
+    node_values = dict(zip(ids.tolist(), values.tolist()))
+    expected = np.zeros((len(sources), 2), dtype=values.dtype)
+    for root, node in pairs.tolist():
+        expected[np.searchsorted(sources, root)] += node_values.get(node, [0, 0])
+
+    graph = CSRDirectedGraph(source, target)
+
+    assert np.array_equal(graph.accumulate_descendants(sources, ids, values), expected)
+    assert np.array_equal(graph.accumulate_descendants(sources, ids, values[:, 0]), expected[:, 0])
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_accumulate_descendants_chain(reverse):
+    # linear chain of 10 nodes; each node has a single child, in either direction
+    ids = np.arange(10, dtype="int64") * 7 + 3
+    source, target = (ids[1:], ids[:-1]) if reverse else (ids[:-1], ids[1:])
+    values = np.arange(1, 11)
+
+    graph = CSRDirectedGraph(source, target)
+    totals = graph.accumulate_descendants(ids, ids, values)
+
+    expected = np.cumsum(values) if reverse else np.cumsum(values[::-1])[::-1]
+    assert np.array_equal(totals, expected)
@@ -0,0 +1,35 @@
+import pyarrow as pa
+from pyarrow.feather import write_feather
+
+from analysis.post import create_national_downloads
+
+
+def test_create_national_download_unchanged(tmp_path, monkeypatch):
+    monkeypatch.setattr(create_national_downloads, "api_dir", tmp_path)
+    monkeypatch.setattr(create_national_downloads, "zip_dir", tmp_path / "downloads")
+    monkeypatch.setattr(create_national_downloads, "get_export_fields", lambda barrier_type: (["SARPID"], None))
+    (tmp_path / "downloads").mkdir()
+
+    write_feather(
+        pa.table({"SARPID": ["a", "b", "c"], "HasNetwork": [True, False, True]}),
+        tmp_path / "dams.feather",
+        compression="uncompressed",
+    )
+
+    key, created = create_national_downloads.create_national_download("dams")
+    assert created
+    assert (tmp_path / "downloads" / "dams.zip").exists()
+
+    next_key, created = create_national_downloads.create_national_download("dams", key)
+    assert next_key == key
+    assert not created
+
+    # changes to the data recreate the download
+    write_feather(
+        pa.table({"SARPID": ["a", "b"], "HasNetwork": [True, False]}),
+        tmp_path / "dams.feather",
+        compression="uncompressed",
+    )
+    next_key, created = create_national_downloads.create_national_download("dams", key)
+    assert next_key != key
+    assert created